@@ -4,7 +4,9 @@ import sys
 import csv
 import os
 import fileinput
+import glob
 from enum import Enum
+from benchs.container_session import ContainerSession, container_session_tools, podman_exec_failure_codes
 
 # Global list of available benchmarks
 base_benches = []
@@ -30,11 +32,48 @@ class Bench(object):
     spdk_path = ''
     # benchmark specific arguments
     arguments = []
+    # all devices given for the run, overwritten by set_devs()
+    devs = []
+    # container sessions per image, started by start_container_sessions()
+    container_sessions = {}
+    # block device telemetry samplers, started by start_telemetry()
+    telemetry_samplers = []
+    # run the benchmark prep even if the device is already preconditioned
+    force_prep = False
+    # checkpoint manifest of the run, set by set_checkpoint()
+    checkpoint = None
+
+    # Benchmarks are pickled to run their jobs in a process pool. The
+    # telemetry sampler threads stay in the parent process.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['telemetry_samplers'] = []
+        return state
 
     # Interface to be implemented by inheriting classes
     def id(self):
         return "Generic benchmark (name)"
 
+    def supports_multiple_devs(self):
+        return False
+
+    def set_devs(self, devs):
+        self.devs = devs
+
+    def get_devs(self, dev):
+        if len(self.devs) > 0:
+            return self.devs
+        return [dev]
+
+    def supports_resume(self):
+        return False
+
+    def set_checkpoint(self, checkpoint):
+        self.checkpoint = checkpoint
+
+    def set_force_prep(self, force_prep):
+        self.force_prep = force_prep
+
     def setup(self, container, output, arguments=[]):
         self.container = container
         self.output = output
@@ -53,10 +92,43 @@ class Bench(object):
     def plot(self, csv_file):
         print("Not implemented (plot)")
 
+    # Whether plot() also accepts a plotter.sqlite_source.SqlitePlotSource
+    # instead of csv files (--plot-db)
+    def supports_sqlite_plot(self):
+        return False
+
+    def plot_telemetry(self, path):
+        from plotter import matplotlib_plotter
+        from benchs.zbd import load_zone_samples
+        plot = matplotlib_plotter.RunPlot(path)
+        for zone_samples_file in sorted(glob.glob(os.path.join(path, "zone-samples-*.npz"))):
+            devname = os.path.basename(zone_samples_file)[len("zone-samples-"):-len(".npz")]
+            plot.gen_ZONE_STATE_TIMELINE(load_zone_samples(zone_samples_file), devname)
+        plot.gen_DASHBOARD()
+        plot.render()
+
     def get_default_device_scheduler(self):
         return DeviceScheduler.MQ_DEADLINE
 
+    # Repetition of the benchmark points, given with '-x runs=N' (minimum
+    # runs), '-x max_runs=M' and '-x ci_target=PCT' (see benchs/repetition.py)
+    def get_repetition(self, default_runs=1):
+        from benchs.repetition import Repetition, default_ci_target_pct
+        min_runs = int(self.get_argument('runs', default_runs))
+        max_runs = int(self.get_argument('max_runs', min_runs))
+        return Repetition(min_runs, max_runs, float(self.get_argument('ci_target', default_ci_target_pct)))
+
     # Helpers
+    # Benchmark arguments are given as '-x flag' or '-x key=value'
+    def has_argument(self, name):
+        return any(a == name or a.startswith(name + '=') for a in self.arguments)
+
+    def get_argument(self, name, default=None):
+        for a in self.arguments:
+            if a.startswith(name + '='):
+                return a.split('=', 1)[1]
+        return default
+
     def result_path(self):
         if self.container == 'yes':
             return "/output"
@@ -123,31 +195,26 @@ class Bench(object):
             nr_max_open_zones = int(f.readline())
         return nr_max_open_zones
 
+    def get_zone_geometry(self, dev):
+        from benchs.zbd import get_zone_geometry
+        return get_zone_geometry(dev)
+
     def get_number_of_zones(self, dev):
-        devname = dev.strip('/dev/')
-        nr_zones = 0
-        with open(f"/sys/class/block/{devname}/queue/nr_zones", 'r') as f:
-            nr_zones = int(f.readline())
-        return nr_zones
+        return self.get_zone_geometry(dev).nr_zones()
 
     def get_zone_size_mb(self, dev):
-        devname = dev.strip('/dev/')
-        zonesize = 0
-
-        with open('/sys/block/%s/queue/chunk_sectors' % devname, 'r') as f:
-            zonesize = int(((int(f.readline()) * 512) / 1024) / 1024)
-
-        return zonesize
+        return int(self.get_zone_geometry(dev).zone_size() / (1024**2))
 
+    # Smallest capacity of the sequential zones
     def get_zone_capacity_mb(self, dev):
-        devname = dev.strip('/dev/')
-
-        with open(f'{self.output}/blkzone-report.txt', 'r') as f:
-            capacity_blocks = int(f.readline().split()[5].strip(','), 0)
-            capacity_bytes = capacity_blocks * 512
-            capacity_mb = capacity_bytes / (1024**2)
+        return self.get_zone_geometry(dev).min_zone_capacity() / (1024**2)
 
-        return capacity_mb
+    # Bytes that can be written to the device in one pass (in KB), which is
+    # the sum of the zone capacities on a zoned device
+    def get_usable_dev_size(self, dev):
+        if is_dev_zoned(dev):
+            return self.get_zone_geometry(dev).usable_capacity() / 1024
+        return self.get_dev_size(dev)
 
     def get_sector_size(self, dev):
         devname = dev.strip('/dev/')
@@ -184,12 +251,137 @@ class Bench(object):
         else:
             subprocess.check_call("blkdiscard %s" % dev, shell=True)
 
+    # Writes the typed columnar copy of a csv report (see benchs/columnar.py),
+    # from the given rows or else by reading back the csv
+    def save_columnar_report(self, csv_file, delimiter=',', header=None, rows=None):
+        from benchs import columnar
+        if header is None:
+            columnar.csv_to_columnar(csv_file, delimiter)
+        else:
+            columnar.write_columnar(csv_file, header, rows)
+
+    # Per-I/O latency tracing (-x lat_trace): fio logs the latency of every
+    # I/O of the job to <name>_clat.<job>.log, which is converted into a
+    # compact binary trace after the job (see benchs/lat_trace.py)
+    def get_lat_trace_params(self, name):
+        if not self.has_argument('lat_trace'):
+            return ''
+        return f" --write_lat_log={self.result_path()}/{name} --log_avg_msec=0 "
+
+    def save_lat_trace(self, name):
+        if not self.has_argument('lat_trace'):
+            return
+        from benchs import lat_trace
+        prefix = os.path.join(self.output, name)
+        lat_trace.convert_fio_logs(prefix)
+        lat_trace.save_lat_trace_report(prefix, int(self.get_argument('lat_window_ms', lat_trace.default_window_ms)))
+
     def safe_csv_metadata(self, filename, content):
         with open(os.path.join(self.output, filename), 'w') as f:
             w = csv.writer(f, delimiter=";")
             w.writerow(content)
 
+    def start_container_sessions(self, dev, container, output):
+        self.container_sessions = {}
+        if container != 'yes':
+            return
+
+        for tool in self.required_container_tools():
+            if tool not in container_session_tools:
+                continue
+            if tool == 'fio' and get_spdk_install_dir():
+                continue
+            image = container_session_tools[tool][0]
+            if image in self.container_sessions:
+                continue
+            session = ContainerSession(image, self.get_devs(dev), output)
+            if session.start():
+                self.container_sessions[image] = session
+
+    def stop_container_sessions(self):
+        for session in self.container_sessions.values():
+            session.stop()
+        self.container_sessions = {}
+
+    def start_telemetry(self, dev, interval_sec, zone_interval_sec=0):
+        from benchs.telemetry import DiskStatsSampler
+        from benchs.zbd import ZoneSampler
+        self.telemetry_samplers = []
+
+        for d in self.get_devs(dev):
+            if interval_sec > 0:
+                sampler = DiskStatsSampler(d, interval_sec)
+                sampler.start()
+                self.telemetry_samplers.append(sampler)
+            if zone_interval_sec > 0 and is_dev_zoned(d):
+                sampler = ZoneSampler(d, zone_interval_sec)
+                sampler.start()
+                self.telemetry_samplers.append(sampler)
+
+    def stop_telemetry(self):
+        for sampler in self.telemetry_samplers:
+            sampler.stop()
+            sampler.save(self.output)
+        self.telemetry_samplers = []
+
+    # The precondition cache is kept next to the run directories, so it is
+    # shared by all runs using the same output directory.
+    def get_precondition_cache(self):
+        from benchs.precondition import PreconditionCache
+        return PreconditionCache(os.path.dirname(self.output))
+
+    def is_preconditioned(self, dev, workload, params=None):
+        if self.force_prep or not is_dev_zoned(dev):
+            return False
+        if self.get_precondition_cache().matches(dev, workload, params):
+            print(f"{dev} is already preconditioned for '{workload}'")
+            return True
+        return False
+
+    def record_precondition(self, dev, workload, params):
+        if is_dev_zoned(dev):
+            self.get_precondition_cache().record(dev, workload, params)
+
+    # Sweep points and phases completed by an earlier attempt of the run
+    def is_point_done(self, point):
+        if self.checkpoint is None:
+            return False
+        return self.checkpoint.is_done(point)
+
+    def mark_point_done(self, point):
+        if self.checkpoint is not None:
+            self.checkpoint.mark_done(point)
+
+    def is_resumed(self):
+        return self.checkpoint is not None and len(self.checkpoint.get_completed()) > 0
+
+    def get_container_session(self, tool, container):
+        if container != 'yes' or tool not in container_session_tools:
+            return None
+        if tool == 'fio' and self.spdk_path:
+            return None
+        return self.container_sessions.get(container_session_tools[tool][0])
+
     def run_cmd(self, dev, container, tool, tool_params, extra_container_params=''):
+        session = self.get_container_session(tool, container)
+        # The session container is already created, so commands that need
+        # their own container parameters (e.g. a device created after the
+        # session start) are run in a new container.
+        if session is not None and extra_container_params == '':
+            cmd = session.exec_cmd(container_session_tools[tool][1], tool_params)
+
+            print("Exec: %s" % cmd)
+
+            p = subprocess.run(cmd, shell=True)
+            if p.returncode == 0:
+                return cmd
+            if p.returncode not in podman_exec_failure_codes:
+                raise subprocess.CalledProcessError(p.returncode, cmd)
+
+            print(f"Container session {session.name} failed. Falling back to a new container per command.")
+            session.stop()
+            del self.container_sessions[session.image]
+
         cmd = "%s %s" % (self.sys_cmd(tool, dev, container, extra_container_params), tool_params)
 
         print("Exec: %s" % cmd)
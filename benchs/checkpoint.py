@@ -0,0 +1,59 @@
+import fcntl
+import json
+import os
+
+# Manifest of a benchmark run recording its completed sweep points and
+# phases, so an interrupted run can be resumed in the same run directory.
+checkpoint_file = "checkpoint.json"
+
+class Checkpoint(object):
+    def __init__(self, path):
+        self.filename = os.path.join(path, checkpoint_file)
+
+    @classmethod
+    def create(cls, path, benchmark, devs, benchmark_args):
+        checkpoint = cls(path)
+        with open(checkpoint.filename, 'w') as f:
+            json.dump({'benchmark': benchmark,
+                       'devs': devs,
+                       'benchmark_args': list(benchmark_args),
+                       'completed': []}, f, indent=2)
+        return checkpoint
+
+    @classmethod
+    def load(cls, path):
+        checkpoint = cls(path)
+        if not os.path.exists(checkpoint.filename):
+            return None
+        return checkpoint
+
+    def read(self):
+        with open(self.filename, 'r') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            return json.load(f)
+
+    def get_benchmark(self):
+        return self.read()['benchmark']
+
+    def get_devs(self):
+        return self.read()['devs']
+
+    def get_benchmark_args(self):
+        return self.read()['benchmark_args']
+
+    def get_completed(self):
+        return self.read()['completed']
+
+    def is_done(self, point):
+        return point in self.get_completed()
+
+    def mark_done(self, point):
+        # The manifest is shared between the processes of a sharded run
+        with open(self.filename, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            manifest = json.load(f)
+            if point not in manifest['completed']:
+                manifest['completed'].append(point)
+            f.seek(0)
+            f.truncate()
+            json.dump(manifest, f, indent=2)
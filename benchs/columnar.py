@@ -0,0 +1,60 @@
+import csv
+import os
+import numpy as np
+
+# Typed columnar copy of a csv report (<report>.npz), which the plotter and
+# the data collector load instead of parsing the csv text. Each column is
+# stored as int64 if all its values are integers, as float64 if all are
+# numbers or empty (NaN), and as strings otherwise.
+columnar_suffix = ".npz"
+
+def columnar_filename(csv_file):
+    return os.path.splitext(csv_file)[0] + columnar_suffix
+
+def to_typed_column(values):
+    if len(values) > 0 and all([v == '' for v in values]):
+        return np.array(values, dtype=str)
+    try:
+        return np.array([int(v) for v in values], dtype=np.int64)
+    except (ValueError, OverflowError):
+        pass
+    try:
+        return np.array([float(v) if v != '' else np.nan for v in values], dtype=np.float64)
+    except ValueError:
+        return np.array(values, dtype=str)
+
+def write_columnar(csv_file, header, rows):
+    # Short rows (e.g. appended by benchmarks with fewer columns) are padded
+    rows = [[str(v) for v in row] + [''] * (len(header) - len(row)) for row in rows]
+    columns = list(zip(*rows)) if len(rows) > 0 else [()] * len(header)
+    arrays = {f"c{i}": to_typed_column(list(c)) for i, c in enumerate(columns)}
+    np.savez(columnar_filename(csv_file), columns=np.array(header, dtype=str), **arrays)
+
+def csv_to_columnar(csv_file, delimiter):
+    with open(csv_file, 'r') as f:
+        r = csv.reader(f, delimiter=delimiter)
+        header = next(r)
+        rows = [row for row in r]
+    write_columnar(csv_file, header, rows)
+
+# Returns the columns of the report as {name: array} in the csv column order,
+# or None if there is no columnar copy or it is older than the csv.
+def read_columnar(csv_file):
+    filename = columnar_filename(csv_file)
+    if not os.path.exists(filename):
+        return None
+    if os.path.exists(csv_file) and os.path.getmtime(filename) < os.path.getmtime(csv_file):
+        return None
+    with np.load(filename, allow_pickle=False) as data:
+        names = data['columns'].tolist()
+        return {name: data[f"c{i}"] for i, name in enumerate(names)}
+
+# Rows of python values (None for missing numbers) for e.g. a database insert
+def columnar_rows(columns):
+    values = []
+    for array in columns.values():
+        if array.dtype.kind == 'f':
+            values.append([None if np.isnan(v) else v for v in array.tolist()])
+        else:
+            values.append(array.tolist())
+    return list(zip(*values))
@@ -0,0 +1,56 @@
+import os
+import subprocess
+
+# Container image and the executable within the image for each tool that can
+# be run in a container session. The spdk fio container is not included, as
+# its launch script prepares the container for a single fio run.
+container_session_tools = {
+    'fio': ('zfio', 'fio'),
+    'db_bench': ('zrocksdb', 'db_bench'),
+    'zenfs': ('zrocksdb', 'zenfs'),
+    'mkfs.f2fs': ('zf2fs', 'mkfs.f2fs'),
+    'mkfs.xfs': ('zxfs', 'mkfs.xfs'),
+    'sysbench': ('zsysbench', ''),
+}
+
+# podman exec exit codes for failures of podman itself (125) or when the
+# command could not be executed within the container (126, 127).
+podman_exec_failure_codes = [125, 126, 127]
+
+# A long-lived container for one tool image. The container is started once and
+# every command is issued into it with 'podman exec', which avoids paying for
+# the container creation, seccomp setup and image mount for each command.
+class ContainerSession(object):
+    def __init__(self, image, devs, output):
+        self.image = image
+        self.devs = devs
+        self.output = output
+        self.name = f"zbdbench-{os.getpid()}-{image}"
+        self.running = False
+
+    def start(self):
+        dev_params = " ".join([f"--device={d}:{d}" for d in self.devs])
+        # rslave propagation makes file-systems mounted below the output
+        # directory after the container start visible within the container.
+        cmd = (f"podman run -d --rm --name {self.name} {dev_params}"
+               f" -v \"{self.output}:/output:rslave\" --privileged"
+               f" --security-opt unmask=/sys/dev/block --security-opt seccomp=unconfined"
+               f" --entrypoint sleep {self.image} infinity")
+        print("Exec: %s" % cmd)
+        p = subprocess.run(cmd, shell=True, stdout=subprocess.DEVNULL)
+        if p.returncode != 0:
+            print(f"Could not start the container session for {self.image}. Using a new container for each command.")
+            return False
+        self.running = True
+        return True
+
+    def exec_cmd(self, executable, tool_params):
+        return f"podman exec {self.name} {executable} {tool_params}"
+
+    def stop(self):
+        if not self.running:
+            return
+        cmd = f"podman rm -f {self.name}"
+        print("Exec: %s" % cmd)
+        subprocess.run(cmd, shell=True, stdout=subprocess.DEVNULL)
+        self.running = False
@@ -0,0 +1,81 @@
+import json
+import os
+import numpy as np
+
+# Completion latency histograms from fio's json+ output. fio reports the
+# non-empty bins of its latency histogram as {bin value in ns: count}. The
+# bin values are fixed by fio, so histograms of jobs and runs are merged
+# exactly by adding the counts of equal bins. Each histogram is stored as a
+# pair of sorted arrays (bin values, counts) per data direction.
+histogram_suffix = ".clat_hist.npz"
+histogram_directions = ['read', 'write']
+
+def histogram_filename(log_file):
+    return os.path.splitext(log_file)[0] + histogram_suffix
+
+# Returns the json+ object of a fio output file, which may be preceded by
+# terse output lines
+def load_json_output(filename):
+    with open(filename, 'r') as f:
+        content = f.read()
+    start = content.find('\n{')
+    if content.startswith('{'):
+        start = 0
+    elif start < 0:
+        return None
+    return json.loads(content[start:])
+
+def empty_histogram():
+    return (np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64))
+
+def merge_histograms(histograms):
+    if len(histograms) == 0:
+        return empty_histogram()
+    bins = np.concatenate([h[0] for h in histograms])
+    counts = np.concatenate([h[1] for h in histograms])
+    merged_bins, index = np.unique(bins, return_inverse=True)
+    merged_counts = np.zeros(len(merged_bins), dtype=np.uint64)
+    np.add.at(merged_counts, index, counts)
+    return (merged_bins, merged_counts)
+
+def get_job_histogram(job, direction):
+    fio_bins = job.get(direction, {}).get('clat_ns', {}).get('bins', {})
+    if len(fio_bins) == 0:
+        return empty_histogram()
+    bins = np.array([int(b) for b in fio_bins.keys()], dtype=np.uint64)
+    counts = np.array(list(fio_bins.values()), dtype=np.uint64)
+    order = np.argsort(bins)
+    return (bins[order], counts[order])
+
+# Histograms per direction, merged across all jobs with the given names (all
+# jobs if jobnames is None). With group_reporting fio already merges the bins
+# of a group into one job.
+def get_histograms(fio_json, jobnames=None):
+    jobs = [j for j in fio_json['jobs'] if jobnames is None or j['jobname'] in jobnames]
+    return {d: merge_histograms([get_job_histogram(j, d) for j in jobs]) for d in histogram_directions}
+
+def save_histograms(filename, histograms):
+    arrays = {}
+    for direction, (bins, counts) in histograms.items():
+        arrays[f"{direction}_bins_ns"] = bins
+        arrays[f"{direction}_counts"] = counts
+    np.savez_compressed(filename, **arrays)
+
+def load_histograms(filename):
+    with np.load(filename) as data:
+        return {d: (data[f"{d}_bins_ns"], data[f"{d}_counts"]) for d in histogram_directions}
+
+def merge_histogram_files(filenames):
+    loaded = [load_histograms(f) for f in filenames]
+    return {d: merge_histograms([h[d] for h in loaded]) for d in histogram_directions}
+
+# Latency (ns) of each percentile, as the value of the first bin whose
+# cumulative count reaches the percentile
+def get_percentiles(histogram, percentiles):
+    bins, counts = histogram
+    if len(bins) == 0 or np.sum(counts) == 0:
+        return [None] * len(percentiles)
+    cumulative = np.cumsum(counts)
+    targets = np.ceil(np.asarray(percentiles, dtype=float) / 100 * cumulative[-1])
+    index = np.searchsorted(cumulative, np.maximum(targets, 1))
+    return bins[np.minimum(index, len(bins) - 1)].tolist()
@@ -0,0 +1,157 @@
+import os
+import shlex
+from datetime import datetime, timedelta
+
+# fio command line parameters that apply to the whole fio invocation and are
+# therefore not copied into the job sections.
+invocation_params = ['output', 'output-format', 'name']
+
+def fio_params_to_job_options(fio_param):
+    options = []
+    tokens = shlex.split(fio_param)
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        i += 1
+        if not token.startswith('--'):
+            continue
+        token = token[2:]
+        if '=' in token:
+            key, value = token.split('=', 1)
+        elif i < len(tokens) and not tokens[i].startswith('-'):
+            key, value = token, tokens[i]
+            i += 1
+        else:
+            key, value = token, None
+        options.append((key, value))
+    return options
+
+def get_job_option(options, key, default=None):
+    for k, v in options:
+        if k == key:
+            return v
+    return default
+
+# Collects multiple fio jobs (sweep points) into one generated job file, so
+# that all of them are executed by a single fio (and container) invocation.
+# Every job is placed in its own stonewalled section, which also starts a new
+# reporting group. The per group terse results are afterwards split back into
+# the per job log files that are expected by the benchmark reports. The json
+# output is always requested as well, as it holds the start time of each job.
+class FioBatch(object):
+    def __init__(self, name):
+        self.name = name
+        self.jobs = []
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def add_job(self, section_name, fio_param, log_file=None, metadata=None):
+        options = fio_params_to_job_options(fio_param)
+        self.jobs.append((section_name, fio_param, options, log_file, metadata))
+
+    def get_job_file_content(self):
+        lines = []
+        for section_name, _, options, _, _ in self.jobs:
+            lines.append(f"[{section_name}]")
+            lines.append("stonewall")
+            for key, value in options:
+                if key in invocation_params:
+                    continue
+                if value is None:
+                    lines.append(key)
+                else:
+                    lines.append(f"{key}={value}")
+            lines.append("")
+        return "\n".join(lines)
+
+    def run(self, bench, dev, container, output_format):
+        job_file = f"{self.name}-batch.fio"
+        output_file = f"{self.name}-batch.out"
+        with open(os.path.join(bench.output, job_file), 'w') as f:
+            f.write(self.get_job_file_content())
+
+        batch_output_format = output_format
+        if 'json' not in output_format:
+            batch_output_format = f"{output_format},json"
+
+        print(f"About to start {len(self.jobs)} batched jobs from {job_file}")
+        fio_param = (f"{os.path.join(bench.result_path(), job_file)}"
+                     f" --output-format={batch_output_format}"
+                     f" --output {os.path.join(bench.result_path(), output_file)}")
+
+        batch_start_time = datetime.now()
+        cmd = bench.run_cmd(dev, container, 'fio', fio_param)
+
+        self.split_terse_output(bench, os.path.join(bench.output, output_file))
+        if 'json+' in output_format:
+            self.split_histograms(os.path.join(bench.output, output_file))
+        from benchs import fio_histogram
+        start_times = self.get_job_start_times(fio_histogram.load_json_output(os.path.join(bench.output, output_file)), batch_start_time)
+        # The command of a job is the one it would have been run with on its
+        # own, i.e. the batch command with the parameters of the job.
+        cmd_prefix = cmd[:len(cmd) - len(fio_param)] if cmd.endswith(fio_param) else ''
+        for section_name, job_fio_param, _, log_file, metadata in self.jobs:
+            if log_file is None:
+                continue
+            job_cmd = cmd_prefix + job_fio_param if cmd_prefix else ''
+            bench.safe_csv_metadata(os.path.basename(log_file) + "metadata",
+                                    [job_cmd, start_times.get(section_name, '')] + metadata)
+        print(f"Finished batched jobs of {job_file}")
+        return cmd
+
+    # Start time of each job section. Newer fio versions report the start of
+    # a job (ms since the epoch) in the json output. Otherwise the stonewalled
+    # jobs follow each other, so a job starts at the batch start plus the
+    # elapsed time of the jobs before it.
+    def get_job_start_times(self, fio_json, batch_start_time):
+        if fio_json is None:
+            print("No json output found to take the start times of the batched jobs from")
+            return {}
+        sections = {}
+        for job in fio_json.get('jobs', []):
+            sections.setdefault(job['jobname'], []).append(job)
+
+        start_times = {}
+        offset = timedelta(0)
+        for section_name, _, _, _, _ in self.jobs:
+            jobs = sections.get(section_name, [])
+            if len(jobs) == 0:
+                continue
+            job_starts = [j['job_start'] for j in jobs if j.get('job_start', 0) > 0]
+            if len(job_starts) > 0:
+                start_times[section_name] = str(datetime.fromtimestamp(min(job_starts) / 1000))
+            else:
+                start_times[section_name] = str(batch_start_time + offset)
+            offset += timedelta(seconds=max([j.get('elapsed', 0) for j in jobs]))
+        return start_times
+
+    def split_histograms(self, output_file):
+        from benchs import fio_histogram
+        fio_json = fio_histogram.load_json_output(output_file)
+        if fio_json is None:
+            print(f"No json+ output found in {output_file}")
+            return
+        for section_name, _, _, log_file, _ in self.jobs:
+            if log_file is None:
+                continue
+            hist_file = fio_histogram.histogram_filename(os.path.join(os.path.dirname(output_file), os.path.basename(log_file)))
+            fio_histogram.save_histograms(hist_file, fio_histogram.get_histograms(fio_json, [section_name]))
+
+    def split_terse_output(self, bench, output_file):
+        jobs = {}
+        for section_name, _, options, log_file, _ in self.jobs:
+            jobs[section_name] = (get_job_option(options, 'name', section_name), log_file)
+
+        with open(output_file, 'r') as f:
+            for line in f:
+                fields = line.strip().split(';')
+                if len(fields) < 3 or fields[0] != '3' or fields[2] not in jobs:
+                    continue
+                jobname, log_file = jobs[fields[2]]
+                if log_file is None:
+                    continue
+                # Report the job name as if the job had been run on its own
+                fields[2] = jobname
+                with open(os.path.join(bench.output, os.path.basename(log_file)), 'w') as f_log:
+                    f_log.write(";".join(fields) + "\n")
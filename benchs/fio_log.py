@@ -0,0 +1,92 @@
+import glob
+import itertools
+import os
+import numpy as np
+
+# Reader for fio's bandwidth, latency and IOPS logs (--write_bw_log,
+# --write_lat_log, --write_iops_log). Each line holds
+# "time (ms), value, data direction, block size, offset[, priority]". The
+# logs of long runs have millions of lines, so they are parsed in chunks
+# straight into numpy arrays.
+fio_log_chunk_lines = 1 << 20
+
+FIO_LOG_TIME = 0
+FIO_LOG_VALUE = 1
+FIO_LOG_DDIR = 2
+
+DDIR_READ = 0
+DDIR_WRITE = 1
+DDIR_TRIM = 2
+
+# Log files of a job, e.g. get_fio_log_files(path, "fio_zone_write", "bw")
+# returns fio_zone_write_bw.1.log, fio_zone_write_bw.2.log, ...
+def get_fio_log_files(path, prefix, kind):
+    files = glob.glob(os.path.join(path, f"{prefix}_{kind}.*.log"))
+    return sorted(files, key=lambda f: int(f.split('.')[-2]))
+
+# Yields (time_ms, value, ddir) arrays of up to chunk_lines lines
+def read_fio_log_chunks(filename, chunk_lines=fio_log_chunk_lines):
+    with open(filename, 'r') as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_lines))
+            if len(lines) == 0:
+                break
+            chunk = np.loadtxt(lines, delimiter=',', usecols=(FIO_LOG_TIME, FIO_LOG_VALUE, FIO_LOG_DDIR),
+                               dtype=np.int64, ndmin=2)
+            yield chunk[:, FIO_LOG_TIME], chunk[:, FIO_LOG_VALUE], chunk[:, FIO_LOG_DDIR]
+
+def read_fio_log(filename, ddir=None):
+    times, values = [], []
+    for t, v, d in read_fio_log_chunks(filename):
+        if ddir is not None:
+            t, v = t[d == ddir], v[d == ddir]
+        times.append(t)
+        values.append(v)
+    if len(times) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(times), np.concatenate(values)
+
+# Mean of the values within consecutive intervals of interval_ms. Intervals
+# without samples are left out.
+def bin_by_interval(times_ms, values, interval_ms):
+    if len(times_ms) == 0:
+        return np.zeros(0), np.zeros(0)
+    buckets = np.maximum(times_ms - 1, 0) // interval_ms
+    sums = np.bincount(buckets, weights=values)
+    counts = np.bincount(buckets)
+    nonempty = counts > 0
+    return (np.flatnonzero(nonempty) + 1) * interval_ms, sums[nonempty] / counts[nonempty]
+
+# Splits a bandwidth log (KiB/s samples) into nr_bins bins of equal written
+# data and returns the mean bandwidth of each bin. The data written in a
+# sample is its bandwidth times the time since the previous sample. Bins
+# without samples are 0.
+def bin_by_written(times_ms, bw_kibs, nr_bins):
+    if len(times_ms) == 0 or nr_bins == 0:
+        return np.zeros(nr_bins)
+    durations_sec = np.diff(times_ms, prepend=0) / 1000
+    written = bw_kibs * durations_sec
+    bin_size = np.sum(written) / nr_bins
+    if bin_size == 0:
+        return np.zeros(nr_bins)
+    # A sample belongs to the bin in which its data starts
+    buckets = np.minimum(((np.cumsum(written) - written) // bin_size).astype(np.int64), nr_bins - 1)
+    sums = np.bincount(buckets, weights=bw_kibs, minlength=nr_bins)
+    counts = np.bincount(buckets, minlength=nr_bins)
+    return np.divide(sums, counts, out=np.zeros(nr_bins), where=counts > 0)
+
+# Total of the per job interval means of the logs of all jobs of a job group,
+# e.g. the aggregated bandwidth of numjobs jobs
+def sum_logs_by_interval(log_files, interval_ms, ddir=None):
+    totals = np.zeros(0)
+    for log_file in log_files:
+        times_ms, values = read_fio_log(log_file, ddir)
+        interval_times_ms, means = bin_by_interval(times_ms, values, interval_ms)
+        if len(means) == 0:
+            continue
+        job_totals = np.zeros(int(interval_times_ms[-1] // interval_ms))
+        job_totals[(interval_times_ms // interval_ms).astype(np.int64) - 1] = means
+        if len(job_totals) > len(totals):
+            totals = np.concatenate((totals, np.zeros(len(job_totals) - len(totals))))
+        totals[:len(job_totals)] += job_totals
+    return totals
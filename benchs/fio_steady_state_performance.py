@@ -1,12 +1,15 @@
 import csv
 import sys
-import subprocess
 import re
 import glob
 import os
+import time
+import threading
+from statistics import mean
 from datetime import datetime
 from .base import base_benches, Bench, DeviceScheduler
 from benchs.base import is_dev_zoned
+from benchs.fio_jobfile import FioBatch
 
 operation_list = ["randwrite", "randwrite"]
 log_interval_sec = 10
@@ -20,7 +23,53 @@ device_cap = 0
 fio_metadata_header = ['cmd', 'fio_run_start_time', 'ioengine', 'direct', 'zonemode', 'output_format', 'max_open_zones', 'filename', 'rw', 'bs', 'offset_increment', 'iodepth', 'numjobs', 'name', 'size', 'time_based', 'ramp_time', 'runtime']
 fio_terse_header = ['terse_version_3', 'fio_version', 'jobname', 'groupid', 'error', 'read_kb', 'read_bandwidth_kb', 'read_iops', 'read_runtime_ms', 'read_slat_min_us', 'read_slat_max_us', 'read_slat_mean_us', 'read_slat_dev_us', 'read_clat_min_us', 'read_clat_max_us', 'read_clat_mean_us', 'read_clat_dev_us', 'read_clat_pct01', 'read_clat_pct02', 'read_clat_pct03', 'read_clat_pct04', 'read_clat_pct05', 'read_clat_pct06', 'read_clat_pct07', 'read_clat_pct08', 'read_clat_pct09', 'read_clat_pct10', 'read_clat_pct11', 'read_clat_pct12', 'read_clat_pct13', 'read_clat_pct14', 'read_clat_pct15', 'read_clat_pct16', 'read_clat_pct17', 'read_clat_pct18', 'read_clat_pct19', 'read_clat_pct20', 'read_tlat_min_us', 'read_lat_max_us', 'read_lat_mean_us', 'read_lat_dev_us', 'read_bw_min_kb', 'read_bw_max_kb', 'read_bw_agg_pct', 'read_bw_mean_kb', 'read_bw_dev_kb', 'write_kb', 'write_bandwidth_kb', 'write_iops', 'write_runtime_ms', 'write_slat_min_us', 'write_slat_max_us', 'write_slat_mean_us', 'write_slat_dev_us', 'write_clat_min_us', 'write_clat_max_us', 'write_clat_mean_us', 'write_clat_dev_us', 'write_clat_pct01', 'write_clat_pct02', 'write_clat_pct03', 'write_clat_pct04', 'write_clat_pct05', 'write_clat_pct06', 'write_clat_pct07', 'write_clat_pct08', 'write_clat_pct09', 'write_clat_pct10', 'write_clat_pct11', 'write_clat_pct12', 'write_clat_pct13', 'write_clat_pct14', 'write_clat_pct15', 'write_clat_pct16', 'write_clat_pct17', 'write_clat_pct18', 'write_clat_pct19', 'write_clat_pct20', 'write_tlat_min_us', 'write_lat_max_us', 'write_lat_mean_us', 'write_lat_dev_us', 'write_bw_min_kb', 'write_bw_max_kb', 'write_bw_agg_pct', 'write_bw_mean_kb', 'write_bw_dev_kb', 'cpu_user', 'cpu_sys', 'cpu_csw', 'cpu_mjf', 'cpu_minf', 'iodepth_1', 'iodepth_2', 'iodepth_4', 'iodepth_8', 'iodepth_16', 'iodepth_32', 'iodepth_64', 'lat_2us', 'lat_4us', 'lat_10us', 'lat_20us', 'lat_50us', 'lat_100us', 'lat_250us', 'lat_500us', 'lat_750us', 'lat_1000us', 'lat_2ms', 'lat_4ms', 'lat_10ms', 'lat_20ms', 'lat_50ms', 'lat_100ms', 'lat_250ms', 'lat_500ms', 'lat_750ms', 'lat_1000ms', 'lat_2000ms', 'lat_over_2000ms', 'disk_name', 'disk_read_iops', 'disk_write_iops', 'disk_read_merges', 'disk_write_merges', 'disk_read_ticks', 'write_ticks', 'disk_queue_time', 'disk_util']
 bw_log_header = ["time_sec", "write_bw_kB"]
-csv_header = bw_log_header
+ss_header = ["ss_in_window", "ss_verdict", "ss_window_avg_kB", "ss_window_range_pct", "ss_window_slope_pct"]
+csv_header = bw_log_header + ss_header
+# Column types in the results database (see data_collector)
+csv_column_types = {'time_sec': 'INTEGER', 'write_bw_kB': 'REAL', 'ss_in_window': 'INTEGER', 'ss_verdict': 'TEXT',
+                    'ss_window_avg_kB': 'INTEGER', 'ss_window_range_pct': 'REAL', 'ss_window_slope_pct': 'REAL'}
+
+# Steady state detection (-x steady_state) following the SNIA PTS criterion:
+# Within the measurement window the range of the write throughput must be
+# within ss_max_range_pct and the excursion of its least squares linear fit
+# within ss_max_slope_pct of the window average.
+# Window size in log_interval_sec samples
+ss_window_samples = 30
+ss_max_range_pct = 20.0
+ss_max_slope_pct = 10.0
+# Cap for drives that do not converge, in multiples of the device capacity
+ss_max_device_writes = 4
+ss_criterion_file = "steady_state_criterion.csv"
+ss_criterion_header = ["window_samples", "max_range_pct", "max_slope_pct", "max_device_writes"]
+
+def get_steady_state_window_stats(samples):
+    n = len(samples)
+    avg = mean(samples)
+    if avg == 0:
+        return avg, float('inf'), float('inf')
+
+    x_mean = (n - 1) / 2.0
+    slope = 0.0
+    if n > 1:
+        slope = (sum([(x - x_mean) * (y - avg) for x, y in enumerate(samples)]) /
+                 sum([(x - x_mean) ** 2 for x in range(n)]))
+    range_pct = (max(samples) - min(samples)) * 100.0 / avg
+    slope_pct = abs(slope) * (n - 1) * 100.0 / avg
+    return avg, range_pct, slope_pct
+
+# Returns the start of the first window in steady state, its statistics and the
+# verdict. If the samples never reach steady state, the last window is returned.
+def find_steady_state_window(samples, window_samples, max_range_pct, max_slope_pct):
+    if len(samples) == 0:
+        return 0, (0, float('inf'), float('inf')), False
+
+    for end in range(window_samples, len(samples) + 1):
+        stats = get_steady_state_window_stats(samples[end - window_samples:end])
+        if stats[1] <= max_range_pct and stats[2] <= max_slope_pct:
+            return end - window_samples, stats, True
+
+    start = max(0, len(samples) - window_samples)
+    return start, get_steady_state_window_stats(samples[start:]), False
 
 class Run(Bench):
     jobname = "fio_steady_state_performance"
@@ -34,6 +83,9 @@ class Run(Bench):
     def id(self):
         return self.jobname
 
+    def supports_sqlite_plot(self):
+        return True
+
     def setup(self, dev, container, output, arguments):
         global device_cap
         super(Run, self).setup(container, output, arguments)
@@ -41,13 +93,82 @@ class Run(Bench):
         device_cap = self.get_nvme_drive_capacity_gb(output)
         self.discard_dev(dev)
 
-    def required_host_tools(self):
-        return super().required_host_tools() | {'iostat'}
+    def get_steady_state_criterion(self):
+        return [int(self.get_argument('ss_window', ss_window_samples)),
+                float(self.get_argument('ss_range', ss_max_range_pct)),
+                float(self.get_argument('ss_slope', ss_max_slope_pct)),
+                int(self.get_argument('ss_max_writes', ss_max_device_writes))]
+
+    def read_steady_state_criterion(self, path):
+        criterion = [ss_window_samples, ss_max_range_pct, ss_max_slope_pct, ss_max_device_writes]
+        filename = os.path.join(path, ss_criterion_file)
+        if os.path.exists(filename):
+            with open(filename, 'r') as f:
+                r = csv.reader(f, delimiter=';')
+                next(r)
+                values = next(r)
+                criterion = [int(values[0]), float(values[1]), float(values[2]), int(values[3])]
+        return criterion
+
+    def get_written_sectors(self, dev):
+        from benchs.telemetry import read_block_stat, STAT_WRITE_SECTORS
+        return read_block_stat(dev.strip('/dev/'))[STAT_WRITE_SECTORS]
+
+    def run_until_steady_state(self, dev, container, fio_param, trigger_file):
+        window_samples, max_range_pct, max_slope_pct, _ = self.get_steady_state_criterion()
+        result = {}
+
+        def run_fio():
+            try:
+                result['cmd'] = self.run_cmd(dev, container, 'fio', fio_param)
+            except Exception as e:
+                result['exception'] = e
+
+        if os.path.exists(trigger_file):
+            os.remove(trigger_file)
+
+        fio_thread = threading.Thread(target=run_fio)
+        fio_thread.start()
+
+        samples = []
+        reached = False
+        prev_sectors = self.get_written_sectors(dev)
+        prev_time = time.monotonic()
+        while True:
+            fio_thread.join(log_interval_sec)
+            if not fio_thread.is_alive():
+                break
+            sectors = self.get_written_sectors(dev)
+            now = time.monotonic()
+            samples.append(((sectors - prev_sectors) * 512 / 1024) / (now - prev_time))
+            prev_sectors = sectors
+            prev_time = now
+
+            if len(samples) < window_samples:
+                continue
+            avg, range_pct, slope_pct = get_steady_state_window_stats(samples[-window_samples:])
+            if range_pct <= max_range_pct and slope_pct <= max_slope_pct:
+                print(f"Steady state reached after {len(samples) * log_interval_sec}s: "
+                      f"window avg {int(avg)} kB/s, range {range_pct:.1f}%, slope {slope_pct:.1f}%")
+                # fio stops all jobs once the trigger file exists
+                open(trigger_file, 'w').close()
+                reached = True
+                fio_thread.join()
+                break
+
+        if 'exception' in result:
+            raise result['exception']
+        if not reached:
+            print("Steady state was not reached before the overwrite cap")
+        if os.path.exists(trigger_file):
+            os.remove(trigger_file)
+        return result['cmd']
 
     def required_container_tools(self):
         return super().required_container_tools() |  {'fio'}
 
     def run(self, dev, container):
+        from benchs.telemetry import DiskStatsSampler
         global fio_runtime
         global fio_ramptime
         global device_cap
@@ -87,8 +208,11 @@ class Run(Bench):
         self.discard_dev(dev)
 
         print("About to prep the drive by completely filling it")
-        iostat_log_file = os.path.join(self.output, "iostat.log")
-        iostat_process = subprocess.Popen(f"exec iostat {log_interval_sec} -t > {iostat_log_file}", stdout=subprocess.PIPE,  shell=True)
+        # The report is generated from the block device telemetry
+        own_sampler = None
+        if not any([isinstance(s, DiskStatsSampler) for s in self.telemetry_samplers]):
+            own_sampler = DiskStatsSampler(dev, log_interval_sec)
+            own_sampler.start()
         init_param = (f"--ioengine={ioengine}"
                     f" --direct={direct}"
                     f" --zonemode={zonemode}"
@@ -110,12 +234,14 @@ class Run(Bench):
 
         fio_param = f"{init_param} {prep_param}"
 
-        fio_run_start_time = datetime.now()
-        cmd = self.run_cmd(dev, container, 'fio', fio_param)
+        batch = None
+        if self.has_argument('batch'):
+            if self.has_argument('steady_state'):
+                print("The batch mode can not be combined with the steady state mode")
+                sys.exit(1)
+            batch = FioBatch(self.jobname)
 
-        fio_run_metadata = [str(cmd),
-                            str(fio_run_start_time),
-                            str(ioengine),
+        fio_run_metadata = [str(ioengine),
                             str(direct),
                             str(zonemode),
                             str(output_format),
@@ -132,11 +258,33 @@ class Run(Bench):
                             str("0"),
                             str("0")
                             ]
-        self.safe_csv_metadata(os.path.basename(fio_output_log_file) + "metadata", fio_run_metadata)
-
-        print("Finished preping the drive")
 
-        for operation in operation_list:
+        if batch is not None:
+            batch.add_job("prep", fio_param, fio_output_log_file, fio_run_metadata)
+        else:
+            fio_run_start_time = datetime.now()
+            cmd = self.run_cmd(dev, container, 'fio', fio_param)
+            self.safe_csv_metadata(os.path.basename(fio_output_log_file) + "metadata", [str(cmd), str(fio_run_start_time)] + fio_run_metadata)
+
+            print("Finished preping the drive")
+
+        steady_state = self.has_argument('steady_state')
+        tmp_operation_list = operation_list
+        if steady_state:
+            # A single overwrite, which is stopped once steady state is reached
+            tmp_operation_list = ["randwrite"]
+            criterion = self.get_steady_state_criterion()
+            with open(os.path.join(self.output, ss_criterion_file), 'w') as f:
+                w = csv.writer(f, delimiter=';')
+                w.writerow(ss_criterion_header)
+                w.writerow(criterion)
+            trigger_file = "steady_state.trigger"
+            extra = (f"{extra}"
+                     f" --loops={criterion[3]}"
+                     f" --trigger-file={os.path.join(self.result_path(), trigger_file)}"
+                     f" --verify_state_save=0")
+
+        for i, operation in enumerate(tmp_operation_list):
 
             output_name = (f"{operation}-"
                         f"{number_parallel_jobs}-"
@@ -146,7 +294,7 @@ class Run(Bench):
 
             print(f"About to start job {output_name}")
             fio_output_log_file = os.path.join(self.result_path(), f"{output_name}.log")
-            fio_bw_log_file = os.path.join(self.result_path(), f"{operation}_bw")
+            fio_bw_log_file = os.path.join(self.result_path(), f"{operation}-{i}_bw")
             init_param = (f"--ioengine={ioengine}"
                         f" --direct={direct}"
                         f" --zonemode={zonemode}"
@@ -168,12 +316,7 @@ class Run(Bench):
 
             fio_param = f"{init_param} {exec_param}"
 
-            fio_run_start_time = datetime.now()
-            cmd = self.run_cmd(dev, container, 'fio', fio_param)
-
-            fio_run_metadata = [str(cmd),
-                                str(fio_run_start_time),
-                                str(ioengine),
+            fio_run_metadata = [str(ioengine),
                                 str(direct),
                                 str(zonemode),
                                 str(output_format),
@@ -190,39 +333,94 @@ class Run(Bench):
                                 str(fio_ramptime),
                                 str(fio_runtime)
                                 ]
-            self.safe_csv_metadata(os.path.basename(fio_output_log_file) + "metadata", fio_run_metadata)
-            print("Finished job")
-        iostat_process.kill()
+
+            if batch is not None:
+                batch.add_job(f"{output_name}-{i}", fio_param, fio_output_log_file, fio_run_metadata)
+            else:
+                fio_run_start_time = datetime.now()
+                if steady_state:
+                    cmd = self.run_until_steady_state(dev, container, fio_param, os.path.join(self.output, trigger_file))
+                else:
+                    cmd = self.run_cmd(dev, container, 'fio', fio_param)
+                self.safe_csv_metadata(os.path.basename(fio_output_log_file) + "metadata", [str(cmd), str(fio_run_start_time)] + fio_run_metadata)
+                print("Finished job")
+
+        if batch is not None:
+            batch.run(self, dev, container, output_format)
+        if own_sampler is not None:
+            own_sampler.stop()
+            own_sampler.save(self.output)
 
     def teardown(self, dev, container):
         pass
 
-    def report(self, path):
+    def get_write_bw_samples(self, path, dev):
+        from benchs.telemetry import load_telemetry, get_interval_means
+        telemetry = load_telemetry(path, dev)
+        if telemetry is not None:
+            return [int(x) for x in get_interval_means(telemetry, 'write_kBps', log_interval_sec)]
+
+        # Results from before the telemetry sampler was added
+        samples = []
         log = os.path.join(path, "iostat.log")
+        if os.path.exists(log):
+            with open(log, 'r') as f_data_log:
+                for line in f_data_log:
+                    if re.search(dev, line):
+                        line_columns = line.split()
+                        if len(line_columns) > 4:
+                            samples.append(int(line.split()[3].split('.')[0]))
+            return samples
+
+        # Without device statistics, the bandwidth logs of the fio jobs are used
+        from benchs.fio_log import get_fio_log_files, sum_logs_by_interval, DDIR_WRITE
+        prefixes = ["write_prep"] + [f"{operation}-{i}" for i, operation in enumerate(operation_list)]
+        for prefix in prefixes:
+            log_files = get_fio_log_files(path, prefix, "bw")
+            samples.extend([int(x) for x in sum_logs_by_interval(log_files, log_interval_sec * 1000, DDIR_WRITE)])
+        return samples
+
+    def report(self, path):
         dev = ""
         with open(os.path.join(path, "udevadm-info.txt")) as f:
             dev = f.readline().strip('\n').split('/')[-1]
 
+        samples = self.get_write_bw_samples(path, dev)
+
+        # The steady state window is searched after the sequential prep fill
+        prep_samples = int(self.get_prep_runtime_ms(path) / 1000 / log_interval_sec)
+        window_samples, max_range_pct, max_slope_pct, _ = self.read_steady_state_criterion(path)
+        start, stats, verdict = find_steady_state_window(samples[prep_samples:], window_samples, max_range_pct, max_slope_pct)
+        start += prep_samples
+        ss_columns = ["yes" if verdict else "no", str(int(stats[0])), "%0.2f" % stats[1], "%0.2f" % stats[2]]
+
         csv_file = os.path.join(path, self.jobname + ".csv")
         with open(csv_file, 'w') as f:
             w = csv.writer(f, delimiter=';')
-            w.writerow(bw_log_header)
-            with open(log, 'r') as f_data_log:
-                i = 1
-                for line in f_data_log:
-                    if re.search(dev, line):
-                        line_columns = line.split()
-                        if len(line_columns) > 4:
-                            w.writerow([str(i*log_interval_sec), str(int(line.split()[3].split('.')[0]))])
-                            i += 1
+            w.writerow(csv_header)
+            for i, sample in enumerate(samples):
+                in_window = "1" if start <= i < start + window_samples else "0"
+                w.writerow([str((i + 1) * log_interval_sec), str(sample), in_window] + ss_columns)
+        self.save_columnar_report(csv_file, ';')
+        print(f"  Steady state reached: {ss_columns[0]} (window avg {ss_columns[1]} kB/s, range {ss_columns[2]}%, slope {ss_columns[3]}%)")
 
         print(f"  Output written to: {csv_file}")
         return csv_file
 
+    def get_prep_runtime_ms(self, path):
+        prep_log = os.path.join(path, "write_prep.log")
+        if not os.path.exists(prep_log):
+            return 0
+        with open(prep_log, 'r') as f:
+            fio_data = next(csv.reader(f, delimiter=';'))
+            return int(fio_data[fio_terse_header.index('write_runtime_ms')])
+
     def plot(self, csv_files):
         from plotter import matplotlib_plotter
         plot = matplotlib_plotter.Plot(self.output, csv_files)
         plot.gen_FIO_STEADY_STATE_PERFORMANCE()
+        plot.gen_DASHBOARD()
+        plot.render()
         print("  Done generateing graphs")
 
 base_benches.append(Run())
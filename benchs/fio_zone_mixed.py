@@ -1,8 +1,28 @@
 import json
 import csv
+import os
+import re
+import sys
+import time
 from .base import base_benches, Bench, DeviceScheduler, spdk_bdev
 from benchs.base import is_dev_zoned, spdk_build
 
+# Write rates (MB/s) of the mixed jobs
+write_targets_mbs = [25, 50, 75, 100, 125, 150, 175, 200, 300, 400, 500, 600, 700, 800, 900, 1000]
+percentile_list = [1, 5, 10, 20, 30, 40, 50, 60, 70, 80, 90, 99, 99.9, 99.99, 99.999, 99.9999, 99.99999, 100]
+
+# SLO search (-x slo_search slo_lat_us=N): Instead of the write rates above,
+# bisect the write rate for the highest rate at which the read latency
+# percentile stays within slo_lat_us. A step only meets the SLO if the device
+# also sustains slo_sustained_ratio of the target write rate.
+slo_default_percentile = 99
+slo_default_rate_tolerance_mbs = 25
+slo_sustained_ratio = 0.95
+slo_criterion_file = "fio_zone_mixed_slo_criterion.csv"
+slo_criterion_header = ['slo_lat_us', 'slo_percentile', 'min_rate', 'max_rate', 'rate_tolerance']
+slo_steps_file = "fio_zone_mixed_slo_steps.csv"
+slo_steps_header = ['step', 'write_avg_mbs_target', 'write_avg_mbs', 'read_clat_slo_pct_us', 'meets_slo', 'duration_s']
+slo_result_file = "fio_zone_mixed_slo.csv"
 
 class Run(Bench):
     jobname = "fio_zone_mixed"
@@ -28,15 +48,11 @@ class Run(Bench):
         extra = ''
         max_open_zones = 14
 
-        if is_dev_zoned(dev):
-            # Zone Capacity (52% of zone size)
-            zonecap = 52
-        else:
+        if not is_dev_zoned(dev):
             # Zone Size = Zone Capacity on a conv. drive
-            zonecap = 100
             extra = '--zonesize=1102848k'
 
-        io_size = int(((self.get_dev_size(dev) * zonecap) / 100) * 2)
+        io_size = int(self.get_usable_dev_size(dev) * 2)
 
         if self.spdk_path:
            # SPDK specific args
@@ -54,7 +70,7 @@ class Run(Bench):
 
         init_param = (f" --direct=1"
                       f" --zonemode=zbd"
-                      f" --output-format=json"
+                      f" --output-format={self.get_output_format()}"
                       f" --max_open_zones={max_open_zones}"
                       f" --filename={dev}"
                       f" --rw=randwrite"
@@ -66,37 +82,136 @@ class Run(Bench):
                       f" --io_size={io_size}k"
                       f" --output {self.result_path()}/{self.jobname}.log")
 
-        mixs_param = ("--name=mix_0_r"
-                      " --wait_for_previous"
-                      " --rw=randread"
-                      " --norandommap"
-                      " --bs=4k"
-                      " --runtime=180"
-                      " --ramp_time=30"
-                      " --time_based"
-                      " --significant_figures=6"
-                      " --percentile_list=1:5:10:20:30:40:50:60:70:80:90:99:99.9:99.99:99.999:99.9999:99.99999:100")
-        for s in [25, 50, 75, 100, 125, 150, 175, 200, 300, 400, 500, 600, 700, 800, 900, 1000]:
-            mixs_param += (f" --name=mix_{s}_w"
-                           f" --wait_for_previous"
-                           f" --rate={s}m"
-                           f" --bs=64k"
-                           f" --runtime=180"
-                           f" --time_based"
-                           f" --name=mix_{s}_r"
-                           f" --rw=randread"
-                           f" --norandommap"
-                           f" --bs=4k"
-                           f" --runtime=180"
-                           f" --ramp_time=30"
-                           f" --time_based"
-                           f" --significant_figures=6"
-                           f" --percentile_list=1:5:10:20:30:40:50:60:70:80:90:99:99.9:99.99:99.999:99.9999:99.99999:100")
+        if self.has_argument('slo_search'):
+            fio_param = f"{init_param} {prep_param} {self.get_read_job_param('mix_0_r', True)}"
+            self.run_cmd(dev, container, 'fio', fio_param)
+            self.save_lat_trace(f"{self.jobname}-mix_0_r")
+            self.run_slo_search(dev, container, init_param)
+            return
+
+        read_jobs = ["mix_0_r"] + [f"mix_{s}_r" for s in write_targets_mbs]
+        mixs_param = self.get_read_job_param('mix_0_r', True)
+        for s in write_targets_mbs:
+            mixs_param += self.get_mix_job_param(s)
 
         fio_param = f"{init_param} {prep_param} {mixs_param}"
 
         self.run_cmd(dev, container, 'fio', fio_param)
 
+        for job in read_jobs:
+            self.save_lat_trace(f"{self.jobname}-{job}")
+
+    def get_percentile_list(self):
+        percentiles = list(percentile_list)
+        if self.has_argument('slo_search'):
+            slo_percentile = float(self.get_argument('slo_percentile', slo_default_percentile))
+            if slo_percentile not in percentiles:
+                percentiles = sorted(percentiles + [slo_percentile])
+        return ':'.join([str(p) for p in percentiles])
+
+    def get_read_job_param(self, name, wait_for_previous):
+        return (f" --name={name}"
+                f"{' --wait_for_previous' if wait_for_previous else ''}"
+                f" --rw=randread"
+                f" --norandommap"
+                f" --bs=4k"
+                f" --runtime=180"
+                f" --ramp_time=30"
+                f" --time_based"
+                f" --significant_figures=6"
+                f" --percentile_list={self.get_percentile_list()}"
+                f" {self.get_lat_trace_params(f'{self.jobname}-{name}')}")
+
+    # Random writes at the given rate (MB/s) next to random reads
+    def get_mix_job_param(self, rate):
+        return (f" --name=mix_{rate}_w"
+                f" --wait_for_previous"
+                f" --rate={rate}m"
+                f" --bs=64k"
+                f" --runtime=180"
+                f" --time_based"
+                f"{self.get_read_job_param(f'mix_{rate}_r', False)}")
+
+    def get_slo_criterion(self):
+        if self.get_argument('slo_lat_us') is None:
+            print("The SLO search needs the read latency SLO, e.g. -x slo_search slo_lat_us=500")
+            sys.exit(1)
+        return (float(self.get_argument('slo_lat_us')),
+                float(self.get_argument('slo_percentile', slo_default_percentile)),
+                int(self.get_argument('min_rate', min(write_targets_mbs))),
+                int(self.get_argument('max_rate', max(write_targets_mbs))),
+                int(self.get_argument('rate_tolerance', slo_default_rate_tolerance_mbs)))
+
+    # Returns (write MB/s, read latency percentile in us) of a mixed step
+    def get_step_result(self, log_file, rate, slo_percentile):
+        with open(log_file, 'r') as f:
+            data = json.load(f)
+        jobs = {job['jobname']: job for job in data['jobs']}
+        write_avg = jobs[f"mix_{rate}_w"]['write']['bw_mean'] / 1024
+        lat_us = jobs[f"mix_{rate}_r"]['read']['clat_ns']['percentile']["%0.6f" % slo_percentile] / 1000
+        return write_avg, lat_us
+
+    # Bisection over the write rate for the highest rate that the device
+    # sustains while the read latency percentile stays within the SLO. Each
+    # step is a separate fio run writing <jobname>-mix_<rate>.log.
+    def run_slo_search(self, dev, container, init_param):
+        criterion = self.get_slo_criterion()
+        slo_lat_us, slo_percentile, min_rate, max_rate, rate_tolerance = criterion
+        print(f"Searching the highest write rate between {min_rate} and {max_rate} MB/s with read p{slo_percentile:g} <= {slo_lat_us:g}us")
+
+        with open(os.path.join(self.output, slo_criterion_file), 'w') as f:
+            w = csv.writer(f, delimiter=',')
+            w.writerow(slo_criterion_header)
+            w.writerow(criterion)
+        steps_file = os.path.join(self.output, slo_steps_file)
+        with open(steps_file, 'w') as f:
+            w = csv.writer(f, delimiter=',')
+            w.writerow(slo_steps_header)
+
+        low = 0
+        high = max_rate
+        rate = max_rate
+        step = 0
+        while True:
+            step += 1
+            log_file = f"{self.jobname}-mix_{rate}.log"
+            fio_param = f"{init_param} --output {self.result_path()}/{log_file} {self.get_mix_job_param(rate)}"
+            start = time.time()
+            self.run_cmd(dev, container, 'fio', fio_param)
+            duration = time.time() - start
+            self.save_lat_trace(f"{self.jobname}-mix_{rate}_r")
+
+            write_avg, lat_us = self.get_step_result(os.path.join(self.output, log_file), rate, slo_percentile)
+            meets_slo = write_avg >= rate * slo_sustained_ratio and lat_us <= slo_lat_us
+            print(f"Step {step}: {rate} MB/s target, {write_avg:.0f} MB/s written, read p{slo_percentile:g} {lat_us:.1f}us: {'meets' if meets_slo else 'misses'} the SLO")
+            with open(steps_file, 'a') as f:
+                w = csv.writer(f, delimiter=',')
+                w.writerow([step, rate, "%0.1f" % write_avg, "%0.3f" % lat_us, "yes" if meets_slo else "no", "%0.1f" % duration])
+
+            if meets_slo:
+                low = rate
+            else:
+                high = rate
+            if high - low <= rate_tolerance:
+                break
+            rate = max(int((low + high) / 2), min_rate)
+            if rate == low or rate == high:
+                break
+
+    # json+ adds the latency histogram bins to the json output
+    def get_output_format(self):
+        if self.has_argument('histogram'):
+            return "json+"
+        return "json"
+
+    def save_histograms(self, path, data):
+        from benchs import fio_histogram
+        for job in data['jobs']:
+            if "_r" not in job['jobname'] or 'bins' not in job['read']['clat_ns']:
+                continue
+            hist_file = os.path.join(path, f"{self.jobname}-{job['jobname']}{fio_histogram.histogram_suffix}")
+            fio_histogram.save_histograms(hist_file, fio_histogram.get_histograms(data, [job['jobname']]))
+
     def teardown(self, dev, container):
         pass
 
@@ -105,6 +220,11 @@ class Run(Bench):
         csv_data = []
         with open(path + "/" + self.jobname + ".log", 'r') as f:
             data = json.load(f)
+        # The steps of the SLO search are measured points like the sweep
+        for rate, step_log in self.get_step_logs(path):
+            with open(step_log, 'r') as f:
+                data['jobs'].extend(json.load(f)['jobs'])
+        self.save_histograms(path, data)
 
         write_avg = 0
         for job in data['jobs']:
@@ -156,9 +276,49 @@ class Run(Bench):
                         'clat_p90_us', 'clat_p99_us','clat_p99.9_us','clat_p99.99_us', 'clat_p99.999_us', \
                         'clat_p99.9999_us', 'clat_p99.99999_us', 'clat_max_us'])
             w.writerows(csv_data)
+        self.save_columnar_report(csv_file)
+
+        if os.path.exists(os.path.join(path, slo_steps_file)):
+            self.report_slo_search(path)
 
         print(f"  Output written to: {csv_file}")
         return csv_file
 
+    # Logs of the SLO search steps as (rate, log) ordered by rate
+    def get_step_logs(self, path):
+        step_logs = []
+        for filename in os.listdir(path):
+            m = re.match(re.escape(self.jobname) + r'-mix_([0-9]+)\.log$', filename)
+            if m:
+                step_logs.append((int(m.group(1)), os.path.join(path, filename)))
+        return sorted(step_logs)
+
+    def report_slo_search(self, path):
+        with open(os.path.join(path, slo_criterion_file), 'r') as f:
+            criterion = list(csv.DictReader(f))[0]
+        with open(os.path.join(path, slo_steps_file), 'r') as f:
+            steps = list(csv.DictReader(f))
+        if len(steps) == 0:
+            print("  The SLO search has no completed steps")
+            return
+
+        passed = [int(step['write_avg_mbs_target']) for step in steps if step['meets_slo'] == 'yes']
+        found_rate = max(passed) if len(passed) > 0 else 0
+        search_time = sum([float(step['duration_s']) for step in steps])
+        # A sweep step takes as long as a search step
+        sweep_time = len(write_targets_mbs) * search_time / len(steps)
+
+        print(f"  Highest write rate with read p{float(criterion['slo_percentile']):g} <= {float(criterion['slo_lat_us']):g}us: {found_rate} MB/s")
+        print("  Read latency around it:")
+        for step in sorted(steps, key=lambda step: int(step['write_avg_mbs_target'])):
+            print(f"    {step['write_avg_mbs_target']:>5} MB/s target, {step['write_avg_mbs']:>7} MB/s written: {step['read_clat_slo_pct_us']}us ({'meets' if step['meets_slo'] == 'yes' else 'misses'} the SLO)")
+        print(f"  {len(steps)} steps took {search_time:.0f}s instead of about {sweep_time:.0f}s for the {len(write_targets_mbs)} sweep steps")
+
+        with open(os.path.join(path, slo_result_file), 'w') as f:
+            w = csv.writer(f, delimiter=',')
+            w.writerow(['slo_lat_us', 'slo_percentile', 'found_write_mbs', 'steps', 'search_time_s', 'sweep_time_estimate_s', 'time_saved_s'])
+            w.writerow([criterion['slo_lat_us'], criterion['slo_percentile'], found_rate, len(steps),
+                        "%0.0f" % search_time, "%0.0f" % sweep_time, "%0.0f" % (sweep_time - search_time)])
+
 
 base_benches.append(Run())
@@ -2,9 +2,14 @@ import csv
 import sys
 import glob
 import os
+import re
+import multiprocessing
 from datetime import datetime
 from .base import base_benches, Bench, DeviceScheduler, spdk_bdev
 from benchs.base import is_dev_zoned, spdk_build
+from benchs.fio_jobfile import FioBatch
+from benchs.report_cache import parse_files_cached, get_version
+from benchs.repetition import format_summary
 
 operation_list = ["read", "randread", "write"]
 number_parallel_jobs_list = [1, 2, 4, 8, 16, 32, 64, 128]
@@ -13,6 +18,7 @@ block_size_list = ["4K", "8K", "16K", "32K", "64K", "128K"]
 block_size_K_list = [str(x[:-1]) for x in block_size_list]
 fio_runtime = "30"
 fio_ramptime = "15"
+# Default number of runs per point (-x runs=N, see Bench.get_repetition)
 runs = 1
 size = "9z"
 
@@ -21,9 +27,115 @@ zonemode = "zbd"
 output_format = "terse"
 offset_increment = "0z"
 
-fio_metadata_header = ['cmd', 'fio_run_start_time', 'ioengine', 'direct', 'zonemode', 'output_format', 'max_open_zones', 'filename', 'rw', 'bs', 'offset_increment', 'iodepth', 'numjobs', 'name', 'size', 'time_based', 'ramp_time', 'runtime']
+fio_metadata_header = ['cmd', 'fio_run_start_time', 'ioengine', 'direct', 'zonemode', 'output_format', 'max_open_zones', 'filename', 'rw', 'bs', 'offset_increment', 'iodepth', 'numjobs', 'name', 'size', 'time_based', 'ramp_time', 'runtime', 'device']
 fio_terse_header = ['terse_version_3', 'fio_version', 'jobname', 'groupid', 'error', 'read_kb', 'read_bandwidth_kb', 'read_iops', 'read_runtime_ms', 'read_slat_min_us', 'read_slat_max_us', 'read_slat_mean_us', 'read_slat_dev_us', 'read_clat_min_us', 'read_clat_max_us', 'read_clat_mean_us', 'read_clat_dev_us', 'read_clat_pct01', 'read_clat_pct02', 'read_clat_pct03', 'read_clat_pct04', 'read_clat_pct05', 'read_clat_pct06', 'read_clat_pct07', 'read_clat_pct08', 'read_clat_pct09', 'read_clat_pct10', 'read_clat_pct11', 'read_clat_pct12', 'read_clat_pct13', 'read_clat_pct14', 'read_clat_pct15', 'read_clat_pct16', 'read_clat_pct17', 'read_clat_pct18', 'read_clat_pct19', 'read_clat_pct20', 'read_tlat_min_us', 'read_lat_max_us', 'read_lat_mean_us', 'read_lat_dev_us', 'read_bw_min_kb', 'read_bw_max_kb', 'read_bw_agg_pct', 'read_bw_mean_kb', 'read_bw_dev_kb', 'write_kb', 'write_bandwidth_kb', 'write_iops', 'write_runtime_ms', 'write_slat_min_us', 'write_slat_max_us', 'write_slat_mean_us', 'write_slat_dev_us', 'write_clat_min_us', 'write_clat_max_us', 'write_clat_mean_us', 'write_clat_dev_us', 'write_clat_pct01', 'write_clat_pct02', 'write_clat_pct03', 'write_clat_pct04', 'write_clat_pct05', 'write_clat_pct06', 'write_clat_pct07', 'write_clat_pct08', 'write_clat_pct09', 'write_clat_pct10', 'write_clat_pct11', 'write_clat_pct12', 'write_clat_pct13', 'write_clat_pct14', 'write_clat_pct15', 'write_clat_pct16', 'write_clat_pct17', 'write_clat_pct18', 'write_clat_pct19', 'write_clat_pct20', 'write_tlat_min_us', 'write_lat_max_us', 'write_lat_mean_us', 'write_lat_dev_us', 'write_bw_min_kb', 'write_bw_max_kb', 'write_bw_agg_pct', 'write_bw_mean_kb', 'write_bw_dev_kb', 'cpu_user', 'cpu_sys', 'cpu_csw', 'cpu_mjf', 'cpu_minf', 'iodepth_1', 'iodepth_2', 'iodepth_4', 'iodepth_8', 'iodepth_16', 'iodepth_32', 'iodepth_64', 'lat_2us', 'lat_4us', 'lat_10us', 'lat_20us', 'lat_50us', 'lat_100us', 'lat_250us', 'lat_500us', 'lat_750us', 'lat_1000us', 'lat_2ms', 'lat_4ms', 'lat_10ms', 'lat_20ms', 'lat_50ms', 'lat_100ms', 'lat_250ms', 'lat_500ms', 'lat_750ms', 'lat_1000ms', 'lat_2000ms', 'lat_over_2000ms', 'disk_name', 'disk_read_iops', 'disk_write_iops', 'disk_read_merges', 'disk_write_merges', 'disk_read_ticks', 'write_ticks', 'disk_queue_time', 'disk_util']
-csv_header = fio_terse_header + fio_metadata_header
+pruning_header = ['pruned', 'prune_reason']
+# Completion latency percentiles computed from the json+ histograms
+# (-x histogram), merged over all runs of a point
+hist_percentiles = [50, 90, 99, 99.9, 99.99, 99.999, 100]
+hist_header = ['hist_runs'] + ['hist_clat_p%s_us' % str(p).replace('.', '_') for p in hist_percentiles]
+# Throughput and completion latency over all runs of a point
+rep_header = ['rep_runs', 'rep_bw_mean_kb', 'rep_bw_stddev_kb', 'rep_bw_ci95_kb', 'rep_clat_mean_us', 'rep_clat_stddev_us', 'rep_clat_ci95_us']
+csv_header = fio_terse_header + fio_metadata_header + pruning_header + hist_header + rep_header
+
+# Column types in the results database (see data_collector), following the
+# terse format: sizes, bandwidths, IOPS, counts and min/max latencies are
+# integers, means, deviations and percentages are real numbers. The terse
+# completion latency percentiles ("99.000000%=1234") stay text.
+csv_text_columns = (['terse_version_3', 'fio_version', 'jobname', 'disk_name',
+                     'cmd', 'fio_run_start_time', 'ioengine', 'zonemode', 'output_format', 'filename', 'rw', 'bs',
+                     'offset_increment', 'name', 'size', 'time_based', 'device'] + pruning_header)
+csv_real_column_pattern = re.compile(r'(_mean_|_dev_|_agg_pct$|^cpu_(user|sys)$|^iodepth_[0-9]+$|^lat_|^disk_util$|^hist_clat_|^rep_(bw|clat)_)')
+
+def get_csv_column_type(column):
+    if column in csv_text_columns or re.search(r'_clat_pct[0-9]+$', column):
+        return 'TEXT'
+    if csv_real_column_pattern.search(column):
+        return 'REAL'
+    return 'INTEGER'
+
+csv_column_types = {column: get_csv_column_type(column) for column in csv_header}
+
+# Adaptive sweep (-x adaptive): Each (operation, block size) series is run with
+# increasing parallelism until the throughput gain stays below
+# adaptive_min_gain_pct for adaptive_plateau_steps steps, or the average
+# completion latency passes adaptive_max_lat_us (0 disables the ceiling).
+# The remaining points of the series are pruned.
+adaptive_min_gain_pct = 5.0
+adaptive_plateau_steps = 2
+adaptive_max_lat_us = 0
+
+# Precondition cache workload name of the sequential fill before the reads
+read_prep_workload = "fio_zone_throughput_avg_lat_read_prep"
+
+# Per-I/O latency logs of -x lat_trace that have not been converted yet
+lat_log_pattern = re.compile(r'_(c|s)?lat\.[0-9]+\.log$')
+
+def is_result_log(log):
+    return not log.endswith("prep.log") and lat_log_pattern.search(log) is None
+
+# Logs of a point are named <point>-<run>of<max runs>.log
+def get_point_name(log):
+    return re.sub(r'-[0-9]+of[0-9]+$', '', os.path.splitext(log)[0])
+
+def get_log_direction(log):
+    # Sharded runs prefix the logs with the device name
+    if re.search(r'(^|-)(rand)?read-', os.path.basename(log)):
+        return 'read'
+    return 'write'
+
+def get_point_log_files(log):
+    return sorted([l for l in glob.glob(get_point_name(log) + "-*of*.log") if is_result_log(l)])
+
+def get_point_histogram_files(log):
+    from benchs import fio_histogram
+    return glob.glob(get_point_name(log) + "-*of*" + fio_histogram.histogram_suffix)
+
+# Returns the (bandwidth kB/s, mean completion latency us) of a run
+def read_point_result(log, direction):
+    with open(log, 'r') as f:
+        fio_data = next(csv.reader(f, delimiter=';'))
+    bw = float(fio_data[fio_terse_header.index(f"{direction}_bandwidth_kb")])
+    lat = float(fio_data[fio_terse_header.index(f"{direction}_clat_mean_us")])
+    return bw, lat
+
+# Mean, standard deviation and 95% CI columns over all runs of the point of a log
+def get_point_repetition_row(log):
+    direction = get_log_direction(log)
+    results = [read_point_result(l, direction) for l in get_point_log_files(log)]
+    return [str(len(results))] + format_summary([r[0] for r in results]) + format_summary([r[1] for r in results])
+
+# Percentile columns of the histograms of all runs of the point of a log
+def get_point_histogram_row(log):
+    from benchs import fio_histogram
+    hist_files = get_point_histogram_files(log)
+    if len(hist_files) == 0:
+        return [''] * len(hist_header)
+    histogram = fio_histogram.merge_histogram_files(hist_files)[get_log_direction(log)]
+    lat_ns = fio_histogram.get_percentiles(histogram, hist_percentiles)
+    return [str(len(hist_files))] + ['' if l is None else "%0.3f" % (l / 1000) for l in lat_ns]
+
+# Report parsing, run in a process pool by the report (see report_cache.py)
+def get_report_row_dependencies(result_file):
+    if result_file.endswith(".pruned"):
+        return [result_file]
+    return [result_file, result_file + 'metadata'] + get_point_log_files(result_file) + get_point_histogram_files(result_file)
+
+def parse_report_row(result_file):
+    if result_file.endswith(".pruned"):
+        # Points skipped by the adaptive sweep
+        with open(result_file, 'r') as f_pruned:
+            pruned_data = next(csv.reader(f_pruned, delimiter=';'))
+        return [''] * len(fio_terse_header) + pruned_data[1:] + ['yes', pruned_data[0]] + [''] * len(hist_header + rep_header)
+
+    with open(result_file, 'r') as f_data_log:
+        fio_data = next(csv.reader(f_data_log, delimiter=';'))
+    with open(result_file + 'metadata', 'r') as f_meta_log:
+        fio_metadata = next(csv.reader(f_meta_log, delimiter=';'))
+    if len(fio_metadata) < len(fio_metadata_header):
+        # Results from before the device column was added
+        fio_metadata.append(fio_metadata[fio_metadata_header.index('filename')])
+    return fio_data + fio_metadata + ['no', ''] + get_point_histogram_row(result_file) + get_point_repetition_row(result_file)
 
 class Run(Bench):
     jobname = "fio_zone_throughput_avg_lat"
@@ -40,26 +152,138 @@ class Run(Bench):
     def setup(self, dev, container, output, arguments):
         super(Run, self).setup(container, output, arguments)
 
-        self.discard_dev(dev)
+        for d in self.get_devs(dev):
+            # The sweep starts with the read operations, which can reuse a
+            # read prep of an earlier run. Writes discard the device anyway.
+            if self.is_preconditioned(d, read_prep_workload):
+                continue
+            self.discard_dev(d)
 
     def required_container_tools(self):
         return super().required_container_tools() |  {'fio'}
 
+    def supports_multiple_devs(self):
+        return True
+
+    def supports_resume(self):
+        return True
+
+    def supports_sqlite_plot(self):
+        return True
+
+    def get_sweep_points(self, dev_number_zones):
+        points = []
+        for operation in operation_list:
+            tmp_number_parallel_jobs_list = number_parallel_jobs_list
+            if "randread" == operation:
+                tmp_number_parallel_jobs_list = [1]
+
+            for number_parallel_jobs in tmp_number_parallel_jobs_list:
+
+                for queue_depth in queue_depth_list:
+                    if number_parallel_jobs > queue_depth:
+                        continue
+
+                    if number_parallel_jobs * int(size[:-1]) > dev_number_zones:
+                        print(f"Skipping number_parallel_jobs={number_parallel_jobs} because the device is to small for size={size}.")
+                        continue
+
+                    if ("write" in operation or "read" == operation) and queue_depth > number_parallel_jobs:
+                        continue
+
+                    # Further runs are added while running if the results
+                    # of a point are not stable yet
+                    for block_size in block_size_list:
+                        for run in range(1, self.get_repetition(runs).min_runs + 1):
+                            points.append((operation, number_parallel_jobs, queue_depth, block_size, run))
+        return points
+
+    def shard_points(self, points, number_shards):
+        # Every device gets its share of each operation, so that each device
+        # preps itself for the read operations and the shards finish at about
+        # the same time. An adaptive series must run on a single device, and
+        # so must the runs of a point, which decide whether to add runs.
+        shards = [[] for _ in range(number_shards)]
+        for operation in operation_list:
+            op_points = [p for p in points if p[0] == operation]
+            if self.has_argument('adaptive'):
+                for block_size in block_size_list:
+                    shard = shards[block_size_list.index(block_size) % number_shards]
+                    shard.extend([p for p in op_points if p[3] == block_size])
+                continue
+            point_keys = list(dict.fromkeys([p[:4] for p in op_points]))
+            for i, key in enumerate(point_keys):
+                shards[i % number_shards].extend([p for p in op_points if p[:4] == key])
+        return shards
+
+    def get_output_name(self, operation, number_parallel_jobs, queue_depth, block_size, run):
+        return (f"{operation}-"
+                f"{number_parallel_jobs}-"
+                f"{queue_depth}-"
+                f"{block_size}-"
+                f"{self.jobname}-"
+                f"{run}of{self.get_repetition(runs).max_runs}")
+
+    # The json+ output follows the terse line in the log, so the reports and
+    # the adaptive sweep still read the terse line
+    def get_output_format(self):
+        if self.has_argument('histogram'):
+            return f"{output_format},json+"
+        return output_format
+
+    def save_point_histograms(self, log):
+        from benchs import fio_histogram
+        fio_json = fio_histogram.load_json_output(log)
+        if fio_json is None:
+            print(f"No json+ output found in {log}")
+            return
+        fio_histogram.save_histograms(fio_histogram.histogram_filename(log), fio_histogram.get_histograms(fio_json))
+
+    def get_read_prep_state(self, offset_increment, numjobs, block_size):
+        return {'rw': 'write',
+                'bs': block_size,
+                'offset_increment': offset_increment,
+                'numjobs': str(numjobs),
+                'zonemode': zonemode}
+
+    def get_adaptive_criterion(self):
+        return (float(self.get_argument('min_gain', adaptive_min_gain_pct)),
+                int(self.get_argument('plateau_steps', adaptive_plateau_steps)),
+                float(self.get_argument('max_lat_us', adaptive_max_lat_us)))
+
+    def get_point_result(self, log, operation):
+        return read_point_result(log, 'read' if 'read' in operation else 'write')
+
+    # Returns the reason for pruning the rest of the series, or '' to continue
+    def update_adaptive_series(self, series, parallelism):
+        min_gain_pct, plateau_steps, max_lat_us = self.get_adaptive_criterion()
+        bw = sum([r[0] for r in series['step_results']]) / len(series['step_results'])
+        lat = sum([r[1] for r in series['step_results']]) / len(series['step_results'])
+        series['step_results'] = []
+
+        if max_lat_us > 0 and lat > max_lat_us:
+            return f"latency {lat:.0f}us above {max_lat_us:.0f}us at parallelism {parallelism}"
+
+        if series['best_bw'] > 0 and (bw - series['best_bw']) * 100.0 / series['best_bw'] < min_gain_pct:
+            series['plateau_steps'] += 1
+        else:
+            series['plateau_steps'] = 0
+        series['best_bw'] = max(series['best_bw'], bw)
+
+        if series['plateau_steps'] >= plateau_steps:
+            return f"throughput gain below {min_gain_pct:.1f}% for {plateau_steps} steps at parallelism {parallelism}"
+        return ''
+
     def run(self, dev, container):
-        global fio_runtime
-        global fio_ramptime
-        extra = ''
-        numjobs = 1
-        iodepth = 1
-        # Backup the nvme dev as it's changed to spdk bdev for spdk runs
-        backup_dev = dev
+        devs = self.get_devs(dev)
 
-        if not is_dev_zoned(dev):
-            print("This test is ment to be run on a zoned dev")
-            sys.exit(1)
+        for d in devs:
+            if not is_dev_zoned(d):
+                print("This test is ment to be run on a zoned dev")
+                sys.exit(1)
 
-        dev_number_zones = self.get_number_of_zones(dev)
-        dev_max_open_zones = self.get_number_of_max_open_zones(dev)
+        dev_number_zones = min([self.get_number_of_zones(d) for d in devs])
+        dev_max_open_zones = min([self.get_number_of_max_open_zones(d) for d in devs])
 
         max_parallel_jobs = max(dev_max_open_zones, max(number_parallel_jobs_list))
         if dev_number_zones < max_parallel_jobs * int(size[:-1]):
@@ -73,26 +297,194 @@ class Run(Bench):
             sys.exit(1)
 
         if self.spdk_path:
+            if len(devs) > 1:
+                print("The SPDK fio plugin is only supported for a single device")
+                sys.exit(1)
+            if self.has_argument('batch'):
+                print("The batch mode is not supported with the SPDK fio plugin")
+                sys.exit(1)
             if container == 'no':
                 # Checkout and build SPDK for Host system
                 spdk_build("spdk/uring", self.spdk_path, dev)
 
+        if self.has_argument('batch') and self.has_argument('adaptive'):
+            print("The batch mode can not be combined with the adaptive mode")
+            sys.exit(1)
+
+        repetition = self.get_repetition(runs)
+        if self.has_argument('batch') and not repetition.is_fixed():
+            print(f"The batch mode runs all jobs at once and can not add runs, running {repetition.min_runs} run(s) per point")
+        else:
+            print(f"Running each point {repetition.describe()}")
+
+        points = self.get_sweep_points(dev_number_zones)
+
+        if len(devs) == 1:
+            self.run_points(dev, container, points, increment_size, number_prep_jobs, dev_max_open_zones, '')
+            return
+
+        shards = self.shard_points(points, len(devs))
+        print(f"Sharding {len(points)} jobs across {len(devs)} devices: {devs}")
+        with multiprocessing.Pool(len(devs)) as pool:
+            pool.starmap(self.run_points,
+                         [(d, container, shard, increment_size, number_prep_jobs, dev_max_open_zones, d.strip('/dev/') + '-')
+                          for d, shard in zip(devs, shards)])
+
+    def run_points(self, dev, container, points, increment_size, number_prep_jobs, dev_max_open_zones, log_prefix):
+        global fio_runtime
+        global fio_ramptime
+        extra = ''
+        numjobs = 1
+        iodepth = 1
+        # Backup the nvme dev as it's changed to spdk bdev for spdk runs
+        backup_dev = dev
+        zone_size_mb = self.get_zone_size_mb(dev)
+        histogram = self.has_argument('histogram')
+        fio_output_format = self.get_output_format()
+        repetition = self.get_repetition(runs)
+
         for operation in operation_list:
-            tmp_number_parallel_jobs_list = number_parallel_jobs_list
+            op_points = [p for p in points if p[0] == operation]
+            if len(op_points) == 0:
+                continue
+
+            if repetition.is_fixed() and all([self.is_point_done(self.get_output_name(*p)) for p in op_points]):
+                print(f"Skipping the {operation} jobs, they have been completed by an earlier attempt of the run")
+                continue
+
+            batch = None
+            batch_points = []
+            if self.has_argument('batch'):
+                batch = FioBatch(log_prefix + operation)
 
             if "read" in operation:
-                if "randread" == operation:
-                    tmp_number_parallel_jobs_list = [1]
                 extra = ''
                 offset_increment = f"{increment_size}z"
                 numjobs = int(number_prep_jobs)
                 iodepth = 1
                 ioengine = "psync"
                 block_size = "128K"
-                fio_output_log_file = os.path.join(self.result_path(), operation + "_prep.log")
+                fio_output_log_file = os.path.join(self.result_path(), log_prefix + operation + "_prep.log")
+
+                # The prep for the read operations is the same, so a device
+                # left in that state by an earlier operation or run is reused
+                prep_state = self.get_read_prep_state(offset_increment, numjobs, block_size)
+                preconditioned = self.is_preconditioned(dev, read_prep_workload, prep_state)
+
+                if not preconditioned:
+                    print(f"About to prep the drive {dev} for read job")
+                    self.discard_dev(dev)
+
+                    if self.spdk_path:
+                        #spdk specific args
+                        ioengine = f"{self.spdk_path}/spdk/build/fio/spdk_bdev"
+                        extra = extra + f" --spdk_json_conf={self.spdk_path}/spdk/bdev_zoned_uring.json --thread=1 "
+                        if container == 'no':
+                            dev = spdk_bdev
+
+                    init_param = (f" --ioengine={ioengine}"
+                                f" --direct={direct}"
+                                f" --zonemode={zonemode}"
+                                f" --output-format={output_format}"
+                                f" --filename={dev}"
+                                f" --offset_increment={offset_increment}"
+                                f" --job_max_open_zone=1"
+                                f" --max_open_zones={dev_max_open_zones}"
+                                f" --numjobs={numjobs}"
+                                f" --group_reporting"
+                                f" --rw=write"
+                                f" --norandommap"
+                                f" --bs={block_size}"
+                                f" {extra}")
+
+                    prep_param = (f"--name=prep"
+                                f" --size={offset_increment}"
+                                f" --output {fio_output_log_file}")
+
+                    fio_param = f"{init_param} {prep_param}"
+
+                    fio_run_metadata = [str(ioengine),
+                                        str(direct),
+                                        str(zonemode),
+                                        str(output_format),
+                                        str(dev_max_open_zones),
+                                        str(dev),
+                                        str("write"),
+                                        str(block_size),
+                                        str(offset_increment),
+                                        str(iodepth),
+                                        str(numjobs),
+                                        str("prep"),
+                                        str(size),
+                                        str("false"),
+                                        str("0"),
+                                        str("0"),
+                                        str(backup_dev)
+                                        ]
+
+                    if batch is not None:
+                        batch.add_job(log_prefix + operation + "_prep", fio_param, fio_output_log_file, fio_run_metadata)
+                    else:
+                        fio_run_start_time = datetime.now()
+                        cmd = self.run_cmd(dev, container, 'fio', fio_param)
+                        self.safe_csv_metadata(os.path.basename(fio_output_log_file) + "metadata", [str(cmd), str(fio_run_start_time)] + fio_run_metadata)
+                        self.record_precondition(backup_dev, read_prep_workload, prep_state)
+
+                        print("Finished preping the drive")
+
+            adaptive = self.has_argument('adaptive')
+            adaptive_series = {}
+            if adaptive:
+                # Run each (operation, block size) series with increasing parallelism
+                op_points.sort(key=lambda p: (block_size_list.index(p[3]), p[2], p[1], p[4]))
+
+            #Restore the physical nvme dev name
+            dev = backup_dev
+            point_results = []
+            i = 0
+            # Runs added to a point are inserted after its last run
+            while i < len(op_points):
+                (_, number_parallel_jobs, queue_depth, block_size, run) = op_points[i]
+                i += 1
+                prune_reason = ''
+                if adaptive:
+                    series = adaptive_series.setdefault(block_size, {'best_bw': 0.0, 'plateau_steps': 0, 'step_results': [], 'prune_reason': ''})
+                    prune_reason = series['prune_reason']
 
-                print("About to prep the drive for read job")
-                self.discard_dev(dev)
+                extra = ''
+                output_name = self.get_output_name(operation, number_parallel_jobs, queue_depth, block_size, run)
+                done = self.is_point_done(output_name)
+
+                ioengine = "io_uring"
+                offset_increment = "0z"
+                numjobs = 1
+                iodepth = queue_depth
+
+                extra = f" --iodepth={iodepth} "
+                if "randread" == operation:
+                    fio_runtime = "15"
+
+                if "write" == operation or "read" == operation:
+                    ioengine = "psync"
+                    iodepth = 1
+                    numjobs = queue_depth
+                    offset_increment = size
+                    extra = (f" --offset_increment={offset_increment}"
+                            f" --numjobs={numjobs}"
+                            f" --group_reporting ")
+
+                print(f"About to start job {output_name} on {dev}")
+                fio_output_log_file = os.path.join(self.result_path(), output_name + ".log")
+
+                if "write" in operation and not prune_reason and not done:
+                    if batch is not None:
+                        # Zone resets are issued by fio as trims on zoned devices
+                        batch.add_job(output_name + "-reset",
+                                      (f"--ioengine=psync --direct={direct} --zonemode={zonemode}"
+                                       f" --filename={dev} --rw=trim --bs={zone_size_mb}M"
+                                       f" --size={numjobs * int(size[:-1])}z --name=reset"))
+                    else:
+                        self.discard_dev(dev)
 
                 if self.spdk_path:
                     #spdk specific args
@@ -101,178 +493,107 @@ class Run(Bench):
                     if container == 'no':
                         dev = spdk_bdev
 
-                init_param = (f" --ioengine={ioengine}"
+                init_param = (f"--ioengine={ioengine}"
                             f" --direct={direct}"
                             f" --zonemode={zonemode}"
-                            f" --output-format={output_format}"
-                            f" --filename={dev}"
-                            f" --offset_increment={offset_increment}"
-                            f" --job_max_open_zone=1"
+                            f" --output-format={fio_output_format}"
                             f" --max_open_zones={dev_max_open_zones}"
-                            f" --numjobs={numjobs}"
-                            f" --group_reporting"
-                            f" --rw=write"
+                            f" --filename={dev}"
+                            f" --rw={operation}"
                             f" --norandommap"
                             f" --bs={block_size}"
-                            f" {extra}")
-
-                prep_param = (f"--name=prep"
-                            f" --size={offset_increment}"
+                            f" {extra}"
+                            f" {self.get_lat_trace_params(output_name)}")
+
+                exec_param = (f"--name={operation} "
+                            f" --size={size}"
+                            f" --time_based"
+                            f" --ramp_time={fio_ramptime}"
+                            f" --runtime={fio_runtime}"
                             f" --output {fio_output_log_file}")
 
-                fio_param = f"{init_param} {prep_param}"
-
-                fio_run_start_time = datetime.now()
-                cmd = self.run_cmd(dev, container, 'fio', fio_param)
+                fio_param = f"{init_param} {exec_param}"
 
-                fio_run_metadata = [str(cmd),
-                                    str(fio_run_start_time),
-                                    str(ioengine),
+                fio_run_metadata = [str(ioengine),
                                     str(direct),
                                     str(zonemode),
-                                    str(output_format),
+                                    str(fio_output_format),
                                     str(dev_max_open_zones),
                                     str(dev),
-                                    str("write"),
+                                    str(operation),
                                     str(block_size),
                                     str(offset_increment),
                                     str(iodepth),
                                     str(numjobs),
-                                    str("prep"),
+                                    str(operation),
                                     str(size),
-                                    str("false"),
-                                    str("0"),
-                                    str("0")
+                                    str("true"),
+                                    str(fio_ramptime),
+                                    str(fio_runtime),
+                                    str(backup_dev)
                                     ]
-                self.safe_csv_metadata(os.path.basename(fio_output_log_file) + "metadata", fio_run_metadata)
-
-                print("Finished preping the drive")
-
-            #Restore the physical nvme dev name
-            dev = backup_dev
-            for number_parallel_jobs in tmp_number_parallel_jobs_list:
-
-                for queue_depth in queue_depth_list:
-                    if number_parallel_jobs > queue_depth:
-                        continue
-
-                    if number_parallel_jobs * int(size[:-1]) > dev_number_zones:
-                        print(f"Skipping number_parallel_jobs={number_parallel_jobs} because the device is to small for size={size}.")
-                        continue
-
-                    if ("write" in operation or "read" == operation) and queue_depth > number_parallel_jobs:
-                        continue
-
-                    for block_size in block_size_list:
-                        for run in range(1, runs+1):
-                            extra = ''
-                            output_name = (f"{operation}-"
-                                        f"{number_parallel_jobs}-"
-                                        f"{queue_depth}-"
-                                        f"{block_size}-"
-                                        f"{self.jobname}-"
-                                        f"{run}of{runs}")
-
-                            ioengine = "io_uring"
-                            offset_increment = "0z"
-                            numjobs = 1
-                            iodepth = queue_depth
-
-                            extra = f" --iodepth={iodepth} "
-                            if "randread" == operation:
-                                fio_runtime = "15"
-
-                            if "write" == operation or "read" == operation:
-                                ioengine = "psync"
-                                iodepth = 1
-                                numjobs = queue_depth
-                                offset_increment = size
-                                extra = (f" --offset_increment={offset_increment}"
-                                        f" --numjobs={numjobs}"
-                                        f" --group_reporting ")
-
-                            print(f"About to start job {output_name}")
-                            fio_output_log_file = os.path.join(self.result_path(), output_name + ".log")
-
-                            if "write" in operation:
-                                self.discard_dev(dev)
-
-                            if self.spdk_path:
-                                #spdk specific args
-                                ioengine = f"{self.spdk_path}/spdk/build/fio/spdk_bdev"
-                                extra = extra + f" --spdk_json_conf={self.spdk_path}/spdk/bdev_zoned_uring.json --thread=1 "
-                                if container == 'no':
-                                    dev = spdk_bdev
-
-                            init_param = (f"--ioengine={ioengine}"
-                                        f" --direct={direct}"
-                                        f" --zonemode={zonemode}"
-                                        f" --output-format={output_format}"
-                                        f" --max_open_zones={dev_max_open_zones}"
-                                        f" --filename={dev}"
-                                        f" --rw={operation}"
-                                        f" --norandommap"
-                                        f" --bs={block_size}"
-                                        f" {extra}")
-
-                            exec_param = (f"--name={operation} "
-                                        f" --size={size}"
-                                        f" --time_based"
-                                        f" --ramp_time={fio_ramptime}"
-                                        f" --runtime={fio_runtime}"
-                                        f" --output {fio_output_log_file}")
-
-                            fio_param = f"{init_param} {exec_param}"
-
-                            fio_run_start_time = datetime.now()
-                            cmd = self.run_cmd(dev, container, 'fio', fio_param)
-
-                            fio_run_metadata = [str(cmd),
-                                                str(fio_run_start_time),
-                                                str(ioengine),
-                                                str(direct),
-                                                str(zonemode),
-                                                str(output_format),
-                                                str(dev_max_open_zones),
-                                                str(dev),
-                                                str(operation),
-                                                str(block_size),
-                                                str(offset_increment),
-                                                str(iodepth),
-                                                str(numjobs),
-                                                str(operation),
-                                                str(size),
-                                                str("true"),
-                                                str(fio_ramptime),
-                                                str(fio_runtime)
-                                                ]
-                            self.safe_csv_metadata(os.path.basename(fio_output_log_file) + "metadata", fio_run_metadata)
-                            print("Finished job")
-                            #Restore the physical nvme dev name for the next pass
-                            dev = backup_dev
 
+                if done:
+                    print(f"Skipping job {output_name}, it has been completed by an earlier attempt of the run")
+                elif prune_reason:
+                    print(f"Pruned job {output_name}: {prune_reason}")
+                    self.safe_csv_metadata(output_name + ".pruned", [prune_reason, '', ''] + fio_run_metadata)
+                    self.mark_point_done(output_name)
+                elif batch is not None:
+                    batch.add_job(output_name, fio_param, fio_output_log_file, fio_run_metadata)
+                    batch_points.append(output_name)
+                else:
+                    fio_run_start_time = datetime.now()
+                    cmd = self.run_cmd(dev, container, 'fio', fio_param)
+                    self.safe_csv_metadata(os.path.basename(fio_output_log_file) + "metadata", [str(cmd), str(fio_run_start_time)] + fio_run_metadata)
+                    if histogram:
+                        self.save_point_histograms(os.path.join(self.output, output_name + ".log"))
+                    self.save_lat_trace(output_name)
+                    self.mark_point_done(output_name)
+                    print("Finished job")
+
+                # Jobs completed by an earlier attempt are replayed from their
+                # logs, so runs are added and the series are pruned at the
+                # same points
+                if (adaptive or not repetition.is_fixed()) and not prune_reason and batch is None:
+                    if run == 1:
+                        point_results = []
+                    point_results.append(self.get_point_result(os.path.join(self.output, output_name + ".log"), operation))
+                    if run >= repetition.min_runs:
+                        if repetition.needs_more_runs(list(zip(*point_results))):
+                            op_points.insert(i, (operation, number_parallel_jobs, queue_depth, block_size, run + 1))
+                        else:
+                            if not repetition.is_fixed() and not repetition.is_stable(list(zip(*point_results))):
+                                print(f"Results of {output_name} not within {repetition.target_ci_pct:.1f}% after {run} runs")
+                            if adaptive:
+                                series['step_results'] = point_results
+                                series['prune_reason'] = self.update_adaptive_series(series, queue_depth)
+                #Restore the physical nvme dev name for the next pass
+                dev = backup_dev
+
+            if batch is not None:
+                batch.run(self, dev, container, fio_output_format)
+                for output_name in batch_points:
+                    self.save_lat_trace(output_name)
+                    self.mark_point_done(output_name)
+                if "read" in operation and not preconditioned:
+                    self.record_precondition(dev, read_prep_workload, prep_state)
 
     def teardown(self, dev, container):
         pass
 
     def report(self, path):
-        logs = glob.glob(path + "/*.log")
-        logs.sort()
+        logs = sorted([l for l in glob.glob(path + "/*.log") if is_result_log(l)])
+        result_files = logs + sorted(glob.glob(path + "/*.pruned"))
+        rows = parse_files_cached(path, self.jobname, get_version(csv_header), result_files,
+                                  get_report_row_dependencies, parse_report_row)
 
         csv_file = os.path.join(path, self.jobname + ".csv")
         with open(csv_file, 'w') as f:
             w = csv.writer(f, delimiter=';')
             w.writerow(csv_header)
-            for log in logs:
-                if log.endswith("prep.log"):
-                    continue
-                with open(log, 'r') as f_data_log:
-                    r_data = csv.reader(f_data_log, delimiter=';')
-                    with open(log + 'metadata', 'r') as f_meta_log:
-                        r_meta = csv.reader(f_meta_log, delimiter=';')
-                        fio_data = next(r_data)
-                        fio_metadata = next(r_meta)
-                        w.writerow(fio_data + fio_metadata)
+            w.writerows(rows)
+        self.save_columnar_report(csv_file, ';', csv_header, rows)
 
         print(f"  Output written to: {csv_file}")
         return csv_file
@@ -282,6 +603,7 @@ class Run(Bench):
         plot = matplotlib_plotter.Plot(self.output, csv_files)
         for op in operation_list:
             plot.gen_FIO_ZONE_THROUGHPUT_AVG_LAT(op)
+        plot.render()
         print("  Done generating graphs")
 
 base_benches.append(Run())
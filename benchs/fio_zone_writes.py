@@ -1,6 +1,6 @@
 import csv
+import os
 import sys
-from statistics import mean
 from .base import base_benches, Bench, DeviceScheduler, spdk_bdev
 from benchs.base import is_dev_zoned, spdk_build
 
@@ -30,15 +30,11 @@ class Run(Bench):
         extra = ''
         max_open_zones = 14
 
-        if is_dev_zoned(dev):
-            # Zone Capacity (52% of zone size)
-            zonecap = 52
-        else:
+        if not is_dev_zoned(dev):
             # Zone Size = Zone Capacity on a conv. drive
-            zonecap = 100
             extra = '--zonesize=1102848k'
 
-        io_size = int(((self.get_dev_size(dev) * zonecap) / 100) * self.loops)
+        io_size = int(self.get_usable_dev_size(dev) * self.loops)
 
         if self.spdk_path:
             #spdk specific args
@@ -74,39 +70,19 @@ class Run(Bench):
         pass
 
     def report(self, path):
+        from benchs.fio_log import read_fio_log, bin_by_written
 
         devcap = int(self.get_nvme_drive_capacity_gb(path))
         if devcap is None:
             print("Could not get drive capacity for report")
             sys.exit(1)
 
-        dp = []
-        dy = []
-
+        # Average throughput (MiB/s) per written GB of device capacity
         filename = (path + "/" + self.jobname + "_bw.1.log")
-        with open(filename, 'r') as f:
-            data = csv.reader(f, delimiter=',')
-            for n in data:
-                dy.append(int(n[1]) / 1024)
+        times_ms, bw_kibs = read_fio_log(filename)
+        dp = [int(x) for x in bin_by_written(times_ms, bw_kibs, devcap) / 1024]
 
         ds = range(0, devcap)
-        sum_max = sum(dy) / devcap
-
-        spill = 0
-        prev = 0
-        for i in enumerate(ds):
-            s = spill
-            new_prev = prev
-            while s < sum_max and new_prev < len(dy):
-                s = s + dy[new_prev]
-                if s < sum_max:
-                    new_prev += 1
-                else:
-                    spill = s - sum_max
-
-            dp.append(int(mean(dy[prev:new_prev])))
-            prev = new_prev + 1
-
         dsx = [i * self.loops for i in ds]
 
         csv_file = path + "/" + self.jobname + ".csv"
@@ -114,9 +90,25 @@ class Run(Bench):
             cw = csv.writer(csvfile, delimiter=',')
             cw.writerow(['written_gb', 'write_avg_mbs'])
             cw.writerows(list(map(list, zip(*[dsx, dp]))))
+        self.save_columnar_report(csv_file)
 
         print("  Output written to: %s" % csv_file)
         return csv_file
 
+    # Takes the csv file of report() or the csv files of --plot, of which only
+    # the directory of the first is used
+    def plot(self, csv_files):
+        from plotter import matplotlib_plotter
+        csv_file = csv_files if isinstance(csv_files, str) else csv_files[0]
+        path = os.path.dirname(csv_file)
+        log_file = os.path.join(path, self.jobname + "_bw.1.log")
+        if not os.path.exists(log_file):
+            print(f"Skipping the plot, no bandwidth log {log_file} found")
+            return
+        plot = matplotlib_plotter.RunPlot(path)
+        plot.gen_FIO_LOG_TIMELINE(log_file, "Write Throughput [MiB/s]", 1 / 1024)
+        plot.render()
+        print("  Done generating graphs")
+
 
 base_benches.append(Run())
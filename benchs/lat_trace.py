@@ -0,0 +1,212 @@
+import csv
+import glob
+import os
+import struct
+import zlib
+import numpy as np
+from benchs.fio_log import read_fio_log_chunks
+
+# Per-I/O latency traces (-x lat_trace). fio logs the latency of every I/O as
+# a text line when the latency logs are enabled with log_avg_msec=0, which
+# gives gigabytes of logs for a long job. The logs are converted into a
+# compact binary trace (<log>.lattrace) of zlib compressed chunks:
+#
+#   magic
+#   per chunk: header (samples, time of the first sample in ms, bytes per
+#              latency, compressed size), then the compressed time deltas
+#              (uint32 ms), latencies (uint32 or uint64 ns) and data
+#              directions (uint8)
+#
+# Percentiles are computed from a log-linear (HDR style) histogram while
+# streaming over the chunks, so memory use does not depend on the trace length.
+lat_trace_suffix = ".lattrace"
+lat_trace_magic = b"ZBDLAT1\n"
+lat_trace_kinds = ['clat', 'lat', 'slat']
+chunk_header = struct.Struct('<QqBI')
+
+# Latencies up to 2^(hist_sub_bucket_bits + 1) ns are counted exactly, larger
+# ones with a relative error below 2^-hist_sub_bucket_bits
+hist_sub_bucket_bits = 10
+default_window_ms = 1000
+trace_percentiles = [50, 90, 99, 99.9, 99.99, 99.999]
+window_percentiles = [99, 99.9, 99.99]
+ddir_names = {0: 'read', 1: 'write', 2: 'trim'}
+
+def lat_trace_filename(log_file):
+    return os.path.splitext(log_file)[0] + lat_trace_suffix
+
+def get_percentile_name(percentile):
+    return "p%s_us" % str(percentile).replace('.', '_')
+
+def encode_chunk(times_ms, lats_ns, ddirs):
+    order = np.argsort(times_ms, kind='stable')
+    times_ms, lats_ns, ddirs = times_ms[order], lats_ns[order], ddirs[order]
+    deltas = np.diff(times_ms, prepend=times_ms[0]).astype(np.uint32)
+    lat_dtype = np.dtype('<u4') if lats_ns.max() < 2**32 else np.dtype('<u8')
+    payload = zlib.compress(deltas.astype('<u4').tobytes() + lats_ns.astype(lat_dtype).tobytes() + ddirs.astype(np.uint8).tobytes(), 1)
+    return chunk_header.pack(len(times_ms), int(times_ms[0]), lat_dtype.itemsize, len(payload)) + payload
+
+# Converts a fio latency log into a trace and removes the text log
+def convert_fio_log(log_file):
+    trace_file = lat_trace_filename(log_file)
+    tmp_file = trace_file + ".tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(lat_trace_magic)
+        for times_ms, lats_ns, ddirs in read_fio_log_chunks(log_file):
+            f.write(encode_chunk(times_ms, lats_ns, ddirs))
+    os.replace(tmp_file, trace_file)
+    os.remove(log_file)
+    return trace_file
+
+# Converts the latency logs written with --write_lat_log=<prefix>
+def convert_fio_logs(prefix):
+    for kind in lat_trace_kinds:
+        for log_file in sorted(glob.glob(f"{prefix}_{kind}.*.log")):
+            before = os.path.getsize(log_file)
+            trace_file = convert_fio_log(log_file)
+            print(f"Converted {os.path.basename(log_file)} ({before} bytes) to {os.path.basename(trace_file)} ({os.path.getsize(trace_file)} bytes)")
+
+def get_trace_files(prefix, kind='clat'):
+    files = glob.glob(f"{prefix}_{kind}.*{lat_trace_suffix}")
+    return sorted(files, key=lambda f: int(f.split('.')[-2]))
+
+# Yields (times_ms, lats_ns, ddirs) chunks of a trace
+def read_lat_trace_chunks(trace_file):
+    with open(trace_file, 'rb') as f:
+        if f.read(len(lat_trace_magic)) != lat_trace_magic:
+            raise ValueError(f"{trace_file} is not a latency trace")
+        while True:
+            header = f.read(chunk_header.size)
+            if len(header) < chunk_header.size:
+                break
+            nr_samples, first_ms, lat_bytes, size = chunk_header.unpack(header)
+            payload = zlib.decompress(f.read(size))
+            deltas = np.frombuffer(payload, dtype='<u4', count=nr_samples)
+            lats_ns = np.frombuffer(payload, dtype=f"<u{lat_bytes}", count=nr_samples, offset=4 * nr_samples)
+            ddirs = np.frombuffer(payload, dtype=np.uint8, count=nr_samples, offset=(4 + lat_bytes) * nr_samples)
+            yield first_ms + np.cumsum(deltas, dtype=np.int64), lats_ns.astype(np.int64), ddirs
+
+class LatencyHistogram(object):
+    def __init__(self, sub_bucket_bits=hist_sub_bucket_bits):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = None
+
+    # Values below 2^(sub_bucket_bits + 1) have their own bucket. Above, each
+    # power of two range is split into 2^sub_bucket_bits buckets.
+    def bucket_index(self, values_ns):
+        values_ns = np.maximum(values_ns, 0).astype(np.int64)
+        _, exponents = np.frexp(values_ns.astype(np.float64))
+        shifts = np.maximum(exponents.astype(np.int64) - 1 - self.sub_bucket_bits, 0)
+        return (shifts << self.sub_bucket_bits) + (values_ns >> shifts)
+
+    # Highest value counted in a bucket
+    def bucket_value(self, index):
+        index = np.asarray(index, dtype=np.int64)
+        shifts = np.maximum((index >> self.sub_bucket_bits) - 1, 0)
+        return ((index - (shifts << self.sub_bucket_bits) + 1) << shifts) - 1
+
+    def add(self, values_ns):
+        if len(values_ns) == 0:
+            return
+        counts = np.bincount(self.bucket_index(values_ns))
+        if len(counts) > len(self.counts):
+            self.counts = np.concatenate((self.counts, np.zeros(len(counts) - len(self.counts), dtype=np.int64)))
+        self.counts[:len(counts)] += counts
+        self.total_ns += int(np.sum(values_ns))
+        self.min_ns = int(np.min(values_ns)) if self.min_ns is None else min(self.min_ns, int(np.min(values_ns)))
+        self.max_ns = int(np.max(values_ns)) if self.max_ns is None else max(self.max_ns, int(np.max(values_ns)))
+
+    def merge(self, other):
+        if other.count() == 0:
+            return
+        if len(other.counts) > len(self.counts):
+            self.counts = np.concatenate((self.counts, np.zeros(len(other.counts) - len(self.counts), dtype=np.int64)))
+        self.counts[:len(other.counts)] += other.counts
+        self.total_ns += other.total_ns
+        self.min_ns = other.min_ns if self.min_ns is None else min(self.min_ns, other.min_ns)
+        self.max_ns = other.max_ns if self.max_ns is None else max(self.max_ns, other.max_ns)
+
+    def count(self):
+        return int(np.sum(self.counts))
+
+    def mean(self):
+        return self.total_ns / self.count() if self.count() > 0 else None
+
+    def get_percentiles(self, percentiles):
+        total = self.count()
+        if total == 0:
+            return [None] * len(percentiles)
+        cumulative = np.cumsum(self.counts)
+        targets = np.maximum(np.ceil(np.asarray(percentiles, dtype=float) / 100 * total), 1)
+        values = self.bucket_value(np.searchsorted(cumulative, targets))
+        return np.minimum(values, self.max_ns).tolist()
+
+# Yields (window, lats_ns, ddirs) of consecutive time windows over the traces
+# of all jobs of a job group. Only one chunk per trace is held in memory.
+def iter_trace_windows(trace_files, window_ms):
+    readers = [read_lat_trace_chunks(f) for f in trace_files]
+    buffers = [None] * len(readers)
+
+    def refill(i):
+        while buffers[i] is None or len(buffers[i][0]) == 0:
+            try:
+                buffers[i] = next(readers[i])
+            except StopIteration:
+                buffers[i] = False
+                return
+
+    for i in range(len(readers)):
+        refill(i)
+    while True:
+        active = [i for i in range(len(readers)) if buffers[i] is not False]
+        if len(active) == 0:
+            break
+        window = min([int(buffers[i][0][0]) // window_ms for i in active])
+        end_ms = (window + 1) * window_ms
+        lats, ddirs = [], []
+        for i in active:
+            while buffers[i] is not False and buffers[i][0][0] < end_ms:
+                times_ms, lats_ns, chunk_ddirs = buffers[i]
+                n = np.searchsorted(times_ms, end_ms)
+                lats.append(lats_ns[:n])
+                ddirs.append(chunk_ddirs[:n])
+                buffers[i] = (times_ms[n:], lats_ns[n:], chunk_ddirs[n:])
+                refill(i)
+        yield window, np.concatenate(lats), np.concatenate(ddirs)
+
+def format_us(value_ns):
+    return '' if value_ns is None else "%0.3f" % (value_ns / 1000)
+
+# Writes <prefix>_clat_windows.csv with the tail latency percentiles of each
+# time window and <prefix>_clat_percentiles.csv with the percentiles of the
+# whole job, per data direction
+def save_lat_trace_report(prefix, window_ms=default_window_ms):
+    trace_files = get_trace_files(prefix)
+    if len(trace_files) == 0:
+        print(f"No completion latency traces found for {prefix}")
+        return None
+
+    histograms = {}
+    windows_file = f"{prefix}_clat_windows.csv"
+    with open(windows_file, 'w') as f:
+        w = csv.writer(f, delimiter=',')
+        w.writerow(['time_s', 'ddir', 'samples'] + [get_percentile_name(p) for p in window_percentiles])
+        for window, lats_ns, ddirs in iter_trace_windows(trace_files, window_ms):
+            for ddir in np.unique(ddirs).tolist():
+                window_histogram = LatencyHistogram()
+                window_histogram.add(lats_ns[ddirs == ddir])
+                histograms.setdefault(ddir, LatencyHistogram()).merge(window_histogram)
+                w.writerow(["%0.3f" % ((window + 1) * window_ms / 1000), ddir_names.get(ddir, str(ddir)), window_histogram.count()]
+                           + [format_us(l) for l in window_histogram.get_percentiles(window_percentiles)])
+
+    percentiles_file = f"{prefix}_clat_percentiles.csv"
+    with open(percentiles_file, 'w') as f:
+        w = csv.writer(f, delimiter=',')
+        w.writerow(['ddir', 'samples', 'min_us', 'mean_us'] + [get_percentile_name(p) for p in trace_percentiles] + ['max_us'])
+        for ddir, histogram in sorted(histograms.items()):
+            w.writerow([ddir_names.get(ddir, str(ddir)), histogram.count(), format_us(histogram.min_ns), format_us(histogram.mean())]
+                       + [format_us(l) for l in histogram.get_percentiles(trace_percentiles)] + [format_us(histogram.max_ns)])
+    return percentiles_file
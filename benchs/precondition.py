@@ -0,0 +1,86 @@
+import fcntl
+import hashlib
+import json
+import os
+from datetime import datetime
+from benchs.zbd import report_zones
+
+# Fingerprints of the device state left behind by a benchmark prep, kept per
+# device in the results directory. A later run can skip its prep if the
+# device still matches the fingerprint of the same workload.
+precondition_cache_file = "precondition-cache.json"
+
+def get_dev_serial(dev):
+    devname = dev.strip('/dev/')
+    for attr in ['wwid', 'device/serial']:
+        try:
+            with open(f"/sys/block/{devname}/{attr}", 'r') as f:
+                serial = f.readline().strip()
+                if serial:
+                    return serial
+        except OSError:
+            pass
+    return None
+
+# Digest over the write pointers and conditions of all zones. Any write,
+# reset or finish of a zone changes the digest.
+def get_zone_digest(dev):
+    zones = report_zones(dev)
+    h = hashlib.sha256()
+    h.update(zones['wp'].tobytes())
+    h.update(zones['cond'].tobytes())
+    return h.hexdigest()
+
+class PreconditionCache(object):
+    def __init__(self, path):
+        self.filename = os.path.join(path, precondition_cache_file)
+
+    def update(self, func):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        # The cache is shared between the processes of a sharded run
+        with open(self.filename, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            content = f.read()
+            entries = json.loads(content) if content else {}
+            res = func(entries)
+            f.seek(0)
+            f.truncate()
+            json.dump(entries, f, indent=2, sort_keys=True)
+            return res
+
+    def get(self, serial):
+        if not os.path.exists(self.filename):
+            return None
+        with open(self.filename, 'r') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            content = f.read()
+        if not content:
+            return None
+        return json.loads(content).get(serial)
+
+    def record(self, dev, workload, params):
+        serial = get_dev_serial(dev)
+        if serial is None:
+            print(f"Not recording the precondition state of {dev}, the device has no serial")
+            return
+        entry = {'dev': dev,
+                 'workload': workload,
+                 'params': params,
+                 'zone_digest': get_zone_digest(dev),
+                 'time': str(datetime.now())}
+        self.update(lambda entries: entries.__setitem__(serial, entry))
+        print(f"Recorded precondition state '{workload}' of {dev}")
+
+    # A params value of None matches any workload parameters
+    def matches(self, dev, workload, params=None):
+        serial = get_dev_serial(dev)
+        if serial is None:
+            return False
+        entry = self.get(serial)
+        if entry is None or entry['workload'] != workload:
+            return False
+        if params is not None and entry['params'] != params:
+            return False
+        return entry['zone_digest'] == get_zone_digest(dev)
+
@@ -0,0 +1,83 @@
+import math
+import statistics
+
+# Repetition of benchmark points. Each point is run at least min_runs times.
+# Further runs are added, up to max_runs, until the half-width of the 95%
+# confidence interval of the mean of each tracked metric (e.g. throughput and
+# latency) is below target_ci_pct percent of the mean.
+default_ci_target_pct = 5.0
+
+# Two-sided 95% critical values of Student's t distribution by degrees of
+# freedom. Larger degrees of freedom use the next smaller entry, which is
+# slightly conservative.
+t_critical_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447,
+                 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228, 11: 2.201, 12: 2.179,
+                 13: 2.160, 14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101,
+                 19: 2.093, 20: 2.086, 21: 2.080, 22: 2.074, 23: 2.069, 24: 2.064,
+                 25: 2.060, 26: 2.056, 27: 2.052, 28: 2.048, 29: 2.045, 30: 2.042,
+                 40: 2.021, 60: 2.000, 120: 1.980}
+
+def get_t_critical_95(dof):
+    return t_critical_95[max([d for d in t_critical_95.keys() if d <= dof])]
+
+# Returns (mean, sample standard deviation, 95% CI half-width). The spread
+# of a single sample is unknown (None).
+def summarize(samples):
+    samples = [float(s) for s in samples]
+    if len(samples) == 0:
+        return None, None, None
+    mean = statistics.mean(samples)
+    if len(samples) < 2:
+        return mean, None, None
+    stddev = statistics.stdev(samples)
+    return mean, stddev, get_t_critical_95(len(samples) - 1) * stddev / math.sqrt(len(samples))
+
+# Same as summarize() from the number of samples, their mean and the mean of
+# their squares, e.g. aggregated in SQL
+def summarize_moments(count, mean, mean_of_squares):
+    if count == 0:
+        return None, None, None
+    if count < 2:
+        return mean, None, None
+    stddev = math.sqrt(max(mean_of_squares - mean * mean, 0.0) * count / (count - 1))
+    return mean, stddev, get_t_critical_95(count - 1) * stddev / math.sqrt(count)
+
+def get_ci_pct(samples):
+    mean, _, ci = summarize(samples)
+    if ci is None:
+        return math.inf
+    if mean == 0:
+        return 0.0 if ci == 0 else math.inf
+    return ci * 100.0 / abs(mean)
+
+# Summary columns of a metric as strings, empty if unknown
+def format_summary(samples, fmt="%0.3f"):
+    return ['' if v is None else fmt % v for v in summarize(samples)]
+
+class Repetition(object):
+    def __init__(self, min_runs, max_runs, target_ci_pct):
+        self.min_runs = max(1, min_runs)
+        self.max_runs = max(self.min_runs, max_runs)
+        self.target_ci_pct = target_ci_pct
+
+    # Whether the number of runs is fixed (no runs are added)
+    def is_fixed(self):
+        return self.min_runs == self.max_runs
+
+    def is_stable(self, metrics):
+        return all([get_ci_pct(samples) <= self.target_ci_pct for samples in metrics])
+
+    # Whether another run is needed given the samples of each metric of the
+    # runs so far
+    def needs_more_runs(self, metrics):
+        nr_runs = min([len(samples) for samples in metrics])
+        if nr_runs < self.min_runs:
+            return True
+        if nr_runs >= self.max_runs:
+            return False
+        return not self.is_stable(metrics)
+
+    def describe(self):
+        if self.is_fixed():
+            return f"{self.min_runs} run(s)"
+        return f"{self.min_runs} to {self.max_runs} runs until the 95% CI is within {self.target_ci_pct:.1f}% of the mean"
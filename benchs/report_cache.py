@@ -0,0 +1,94 @@
+import hashlib
+import json
+import multiprocessing
+import os
+
+# Cache of parsed benchmark results within a run directory. Each result is
+# stored with the size and modification time of the files it was parsed
+# from, so a report only parses new or changed results. The cache is dropped
+# when the version (e.g. a hash of the csv header) changes.
+report_cache_file = ".report-cache-{name}.json"
+# Below this number of results, parsing in a process pool does not pay off
+min_pool_results = 64
+
+def get_version(content):
+    return hashlib.sha1(json.dumps(content).encode()).hexdigest()
+
+def get_files_signature(files):
+    signature = []
+    for filename in sorted(files):
+        try:
+            st = os.stat(filename)
+            signature.append([os.path.basename(filename), st.st_size, st.st_mtime_ns])
+        except FileNotFoundError:
+            pass
+    return signature
+
+class ReportCache(object):
+    def __init__(self, path, name, version):
+        self.filename = os.path.join(path, report_cache_file.format(name=name))
+        self.version = version
+        self.entries = {}
+        self.changed = False
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename, 'r') as f:
+                    content = json.load(f)
+                if content['version'] == version:
+                    self.entries = content['entries']
+            except (ValueError, KeyError):
+                print(f"  Ignoring the corrupt report cache {self.filename}")
+
+    def get(self, key, signature):
+        entry = self.entries.get(key)
+        if entry is None or entry['signature'] != signature:
+            return None
+        return entry['result']
+
+    def put(self, key, signature, result):
+        self.entries[key] = {'signature': signature, 'result': result}
+        self.changed = True
+
+    # Drops the results of files that no longer exist
+    def retain(self, keys):
+        removed = set(self.entries.keys()) - set(keys)
+        for key in removed:
+            del self.entries[key]
+        self.changed = self.changed or len(removed) > 0
+
+    def save(self):
+        if not self.changed:
+            return
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, 'w') as f:
+            json.dump({'version': self.version, 'entries': self.entries}, f)
+        os.replace(tmp_filename, self.filename)
+
+# Returns parse_func(file) for each of the files. Only files whose
+# dependencies (get_dependencies(file), which includes the file itself)
+# changed since the last report are parsed, in a process pool if there are
+# many. parse_func must be a module level function.
+def parse_files_cached(path, name, version, files, get_dependencies, parse_func):
+    cache = ReportCache(path, name, version)
+    keys = [os.path.basename(f) for f in files]
+    signatures = [get_files_signature(get_dependencies(f)) for f in files]
+
+    results = [cache.get(k, s) for k, s in zip(keys, signatures)]
+    misses = [i for i, r in enumerate(results) if r is None]
+
+    # Reports running in a process pool themselves (--report-tree) can not
+    # start another one
+    if len(misses) >= min_pool_results and not multiprocessing.current_process().daemon:
+        with multiprocessing.Pool() as pool:
+            parsed = pool.map(parse_func, [files[i] for i in misses])
+    else:
+        parsed = [parse_func(files[i]) for i in misses]
+
+    for i, result in zip(misses, parsed):
+        results[i] = result
+        cache.put(keys[i], signatures[i], result)
+    cache.retain(keys)
+    cache.save()
+
+    print(f"  Parsed {len(misses)} of {len(files)} results ({len(files) - len(misses)} cached)")
+    return results
@@ -1,8 +1,12 @@
 import csv
+import glob
+import os
 import sys
 from statistics import mean
 from .base import base_benches, Bench
 from benchs.base import is_dev_zoned
+from benchs.repetition import summarize
+from benchs import rocksdb_stats
 
 class RocksDBBase(Bench):
 
@@ -29,7 +33,15 @@ class RocksDBBase(Bench):
     key_size = '20'
     value_size = '800'
 
+    # The periodic dumps go to the info LOG, which ZenFS keeps in the aux
+    # path of the container. db_bench also reports each report_interval
+    # seconds to the output: the operations of each thread and, with
+    # --stats_per_interval, the same dump (see benchs/rocksdb_stats.py). It
+    # only reports per interval with --stats_interval, the number of
+    # operations of a thread between checks of the interval time.
     stats_dump_period = '15'
+    report_interval = '1'
+    stats_interval_ops = '1000'
     delete_obsolete_files_period = str(30 * 100000)
 
     # Overwrite benchmark
@@ -41,6 +53,10 @@ class RocksDBBase(Bench):
 
     write_limit = str(1024 * 1024 * 20) # 20MB/s
 
+    # Default number of runs per readwhilewriting workload (-x runs=N, see
+    # Bench.get_repetition)
+    runs = 3
+
     def required_container_tools(self):
         return super().required_container_tools() | {
             'zenfs',
@@ -65,8 +81,12 @@ class RocksDBBase(Bench):
                       " --max_background_compactions=8", \
                       " --use_direct_io_for_flush_and_compaction", \
                       " --stats_dump_period_sec=", self.stats_dump_period, \
+                      " --stats_interval=", self.stats_interval_ops, \
+                      " --stats_interval_seconds=", self.report_interval, \
+                      " --stats_per_interval=1", \
                       " --delete_obsolete_files_period_micros=", self.delete_obsolete_files_period, \
                       " --statistics", \
+                      " --histogram", \
                       ''.join(bench_params), \
                       " > ", self.result_path(), "/", name, ".txt 2>&1"
 
@@ -76,20 +96,50 @@ class RocksDBBase(Bench):
         try:
             with open(filename, 'x') as f:
                 w = csv.writer(f, delimiter=',')
-                w.writerow(("benchmark", "ops/s", "MB/s", "readwhilewrite_write_MB/s"))
+                w.writerow(("benchmark", "ops/s", "MB/s", "readwhilewrite_write_MB/s", "ops/s_stddev", "ops/s_ci95", "runs") + tuple(rocksdb_stats.summary_columns))
         except:
             pass
 
-    def get_result_from_test(self, filename, testname):
+    # Fields of the first (or last) line of the output containing testname
+    def get_result_from_test(self, filename, testname, last=False):
         with open(filename, 'r') as f:
             lines = f.readlines()
 
-            for line in lines:
+            for line in (reversed(lines) if last else lines):
                 if testname not in line:
                     continue
 
                 return [i for i in line.split(' ') if i]
 
+    # Time series of the statistics dumps and the ops/s of each second of a
+    # db_bench output, written next to rocksdb.csv
+    def save_stats_series(self, filename):
+        stats_file = rocksdb_stats.save_stats_series(filename)
+        if stats_file is not None:
+            print("  Statistics time series written to: %s" % stats_file)
+        intervals_file = rocksdb_stats.save_interval_series(filename)
+        if intervals_file is not None:
+            print("  Throughput time series written to: %s" % intervals_file)
+
+    # Takes the csv file of report() or the csv files of --plot
+    def plot(self, csv_files):
+        if not csv_files:
+            return
+        from plotter import matplotlib_plotter
+        if isinstance(csv_files, str):
+            csv_files = [csv_files]
+        for csv_file in csv_files:
+            if not csv_file:
+                continue
+            path = os.path.dirname(csv_file)
+            plot = matplotlib_plotter.RunPlot(path)
+            for output_file in sorted(glob.glob(os.path.join(path, f"{self.jobname}*.txt"))):
+                plot.gen_DB_BENCH_PHASE(output_file)
+            for stats_file in sorted(glob.glob(os.path.join(path, "*" + rocksdb_stats.stats_series_suffix))):
+                plot.gen_ROCKSDB_STATS(stats_file)
+            plot.render()
+        print("  Done generating graphs")
+
     def report(self, path):
         devcap = self.get_nvme_drive_capacity_gb(path)
         if devcap is None:
@@ -102,26 +152,48 @@ class RocksDBBase(Bench):
 class RocksDBFillPrep(RocksDBBase):
     def __init__(self):
         self.jobname = "rocksdb_fillprep"
-        pass
+        self.preconditioned = False
+
+    # Parameters that determine the database left behind by the fill
+    def get_fill_state(self, dev):
+        return {'num': str(self.scale_num),
+                'key_size': self.key_size,
+                'value_size': self.value_size,
+                'target_file_size_base': self.get_target_fz_base(dev),
+                'write_buffer_size': self.wb_size,
+                'max_bytes_for_level_base': self.max_bytes_for_level_base}
 
     def setup(self, dev, container, output, arguments):
         super(RocksDBFillPrep, self).setup(container, output, arguments)
 
+        self.preconditioned = self.is_preconditioned(dev, self.jobname, self.get_fill_state(dev))
+        if self.preconditioned:
+            print("Skipping the fill, the database of an earlier fill is still on the device")
+            return
+
         self.discard_dev(dev)
 
         devname = dev.strip('/dev/')
         self.run_cmd(dev, container, 'zenfs', f'mkfs --zbd={devname} --finish_threshold=20 --aux_path=/tmp/zenfs_aux')
 
     def run(self, dev, container):
+        if self.preconditioned:
+            return
+
         num = str(self.scale_num)
 
         bench_params = " --benchmarks=fillrandom,stats",  \
                        " --num=", num
 
         self.run_cmd(dev, container, 'db_bench', self.get_run_string(dev, bench_params, self.jobname))
+        self.record_precondition(dev, self.jobname, self.get_fill_state(dev))
 
     def report(self, path):
         filename = path + "/" + self.jobname + ".txt"
+        if not os.path.exists(filename):
+            print("  No fill results, the fill was skipped for an already filled device")
+            return
+
         entries = self.get_result_from_test(filename, 'fillrandom')
 
         csv_file = path + "/rocksdb.csv"
@@ -129,9 +201,12 @@ class RocksDBFillPrep(RocksDBBase):
 
         with open(csv_file, 'a') as f:
             w = csv.writer(f, delimiter=',')
-            w.writerow((entries[0], entries[4], entries[6]))
+            w.writerow([entries[0], entries[4], entries[6], '', '', '', 1] + rocksdb_stats.get_run_summary([filename]))
+        self.save_columnar_report(csv_file)
+        self.save_stats_series(filename)
 
         print("  Output written to: %s" % csv_file)
+        return csv_file
 
 
 class RocksDBOverwrite(RocksDBBase):
@@ -161,9 +236,12 @@ class RocksDBOverwrite(RocksDBBase):
 
         with open(csv_file, 'a') as f:
             w = csv.writer(f, delimiter=',')
-            w.writerow((entries[0], entries[4], entries[6]))
+            w.writerow([entries[0], entries[4], entries[6], '', '', '', 1] + rocksdb_stats.get_run_summary([filename]))
+        self.save_columnar_report(csv_file)
+        self.save_stats_series(filename)
 
         print("  Output written to: %s" % csv_file)
+        return csv_file
 
 class RocksDBReadwhilewriting(RocksDBBase):
     def __init__(self):
@@ -173,27 +251,42 @@ class RocksDBReadwhilewriting(RocksDBBase):
     def setup(self, dev, container, output, arguments):
         super(RocksDBReadwhilewriting, self).setup(container, output, arguments)
 
-    def run(self, dev, container):
-
-        for runid in [1, 2, 3]:
-            bench_params = " --benchmarks=readrandom,stats", \
-                           " --use_existing_db --histogram --threads=32",  \
-                           " --duration=", self.read_duration
-
-            self.run_cmd(dev, container, 'db_bench', self.get_run_string(dev, bench_params, "rocksdb_readwhilewriting_readrandom_%s" % runid))
+    # (file name, db_bench benchmark, db_bench parameters) of the workloads
+    def get_workloads(self):
+        return [("readrandom", "readrandom",
+                 (" --benchmarks=readrandom,stats",
+                  " --use_existing_db --threads=32",
+                  " --duration=", self.read_duration)),
+                ("write", "readwhilewriting",
+                 (" --benchmarks=readwhilewriting,stats",
+                  " --use_existing_db --threads=32",
+                  " --duration=", self.read_duration)),
+                ("writelimit", "readwhilewriting",
+                 (" --benchmarks=readwhilewriting,stats",
+                  " --use_existing_db --threads=32",
+                  " --duration=", self.read_duration,
+                  " --benchmark_write_rate_limit=", self.write_limit))]
+
+    def get_run_files(self, path, file_bench):
+        files = glob.glob(os.path.join(path, f"{self.jobname}_{file_bench}_[0-9]*.txt"))
+        return sorted(files, key=lambda f: int(f.split('_')[-1][:-len(".txt")]))
+
+    def get_ops_samples(self, path, file_bench, bench):
+        return [float(self.get_result_from_test(f, bench)[4]) for f in self.get_run_files(path, file_bench)]
 
-            bench_params = " --benchmarks=readwhilewriting,stats", \
-                           " --use_existing_db --histogram --threads=32",  \
-                           " --duration=", self.read_duration
-
-            self.run_cmd(dev, container, 'db_bench', self.get_run_string(dev, bench_params, "rocksdb_readwhilewriting_write_%s" % runid))
-
-            bench_params = " --benchmarks=readwhilewriting,stats", \
-                           " --use_existing_db --histogram --threads=32",  \
-                           " --duration=", self.read_duration, \
-                           " --benchmark_write_rate_limit=", self.write_limit
-
-            self.run_cmd(dev, container, 'db_bench', self.get_run_string(dev, bench_params, "rocksdb_readwhilewriting_writelimit_%s" % runid))
+    def run(self, dev, container):
+        repetition = self.get_repetition(self.runs)
+        print(f"Running each workload {repetition.describe()}")
+
+        # The workloads are interleaved in each round of runs. Workloads
+        # whose throughput is stable do not take part in further rounds.
+        workloads = self.get_workloads()
+        runid = 1
+        while len(workloads) > 0:
+            for file_bench, _, bench_params in workloads:
+                self.run_cmd(dev, container, 'db_bench', self.get_run_string(dev, bench_params, "%s_%s_%s" % (self.jobname, file_bench, runid)))
+            runid += 1
+            workloads = [w for w in workloads if repetition.needs_more_runs([self.get_ops_samples(self.output, w[0], w[1])])]
 
     def report_bench(self, path, file_bench, bench):
         csv_file = path + "/rocksdb.csv"
@@ -202,19 +295,23 @@ class RocksDBReadwhilewriting(RocksDBBase):
         with open(csv_file, 'a') as f:
             results = []
 
-            for runid in [1, 2, 3]:
-                filename = path + "/" + self.jobname + "_" + file_bench + "_" + str(runid) + ".txt"
+            for filename in self.get_run_files(path, file_bench):
                 entries = self.get_result_from_test(filename, bench)
-                writes = self.get_result_from_test(filename, 'Cumulative writes')
+                # The last dump is the one of the stats benchmark at the end
+                writes = self.get_result_from_test(filename, 'Cumulative writes', last=True)
 
                 results.append((file_bench, float(entries[4]), float(entries[6]), float(writes[17])))
+                self.save_stats_series(filename)
 
-            micros = mean(list(zip(*results))[1])
-            ops = mean(list(zip(*results))[2])
-            mbs = mean(list(zip(*results))[3])
+            ops, ops_stddev, ops_ci = summarize(list(zip(*results))[1])
+            mbs = mean(list(zip(*results))[2])
+            write_mbs = mean(list(zip(*results))[3])
 
             w = csv.writer(f, delimiter=',')
-            w.writerow(('readwhilewriting_' + file_bench, micros, ops, mbs))
+            w.writerow(['readwhilewriting_' + file_bench, ops, mbs, write_mbs,
+                        '' if ops_stddev is None else ops_stddev, '' if ops_ci is None else ops_ci, len(results)]
+                       + rocksdb_stats.get_run_summary(self.get_run_files(path, file_bench)))
+        self.save_columnar_report(csv_file)
 
         return csv_file
 
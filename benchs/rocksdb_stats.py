@@ -0,0 +1,358 @@
+import csv
+import os
+import re
+
+# Parser for the statistics dumps of RocksDB in the db_bench output. With
+# --stats_interval, --stats_interval_seconds and --stats_per_interval
+# db_bench prints the rocksdb.stats property (the same dump that
+# --stats_dump_period_sec writes to the info LOG) at each interval, and with
+# --statistics the tickers at the end. Each dump becomes a row of
+# <output>_stats.csv:
+#
+#   uptime_sec, interval_sec    time of the dump
+#   ingest_gb, wal_written_gb   cumulative user writes and WAL writes
+#   flush_gb                    cumulative flushed data
+#   stall_micros, stall_pct     cumulative write stall time and its share of
+#                               the uptime, interval_stall_pct of the interval
+#   compaction_read_gb, compaction_write_gb
+#                               cumulative compaction I/O
+#   L<n>_files, L<n>_read_gb, L<n>_write_gb
+#                               files and cumulative compaction I/O per level
+#   stalls_<cause>              write stall counts by cause
+#   rocksdb.<ticker>            tickers of --statistics (usually only in the
+#                               last dump)
+#
+# The output is read line by line, so the output of multi hour runs is not
+# held in memory.
+#
+# Each thread also prints its operations of the interval with
+# --stats_interval and --stats_interval_seconds. The report file of db_bench
+# (--report_file) is not used, it is written through the Env of the database
+# and so ends up inside ZenFS. The interval lines of all threads are summed
+# into the ops/s of each second of <output>_intervals.csv (secs_elapsed,
+# ops/s). The latency histograms of --histogram ("Microseconds per <op>:") are
+# in the output as well. The histograms of repeated runs are merged bucket by
+# bucket, so the percentiles of a workload are those of all its operations.
+stats_series_suffix = "_stats.csv"
+interval_series_suffix = "_intervals.csv"
+
+db_stats_start = "** DB Stats **"
+uptime_pattern = re.compile(r'^Uptime\(secs\): ([0-9.]+) total, ([0-9.]+) interval')
+ingest_pattern = re.compile(r'^Cumulative writes: .*ingest: ([0-9.]+) ([KMGT]?B)')
+wal_pattern = re.compile(r'^Cumulative WAL: .*written: ([0-9.]+) ([KMGT]?B)')
+stall_pattern = re.compile(r'^(Cumulative|Interval) stall: ([0-9]+):([0-9]+):([0-9.]+) H:M:S, ([0-9.]+) percent')
+flush_pattern = re.compile(r'^Flush\(GB\): cumulative ([0-9.]+)')
+compaction_pattern = re.compile(r'^Cumulative compaction: ([0-9.]+) GB write, .* ([0-9.]+) GB read')
+level_pattern = re.compile(r'^\s*L([0-9]+)\s+([0-9]+)/([0-9]+)\s+[0-9.]+\s*(?:[KMGT]?B\s+)?(.*)$')
+stalls_pattern = re.compile(r'([0-9]+) ([a-z0-9_ ]+?)(?:,|$)')
+ticker_pattern = re.compile(r'^(rocksdb\.[a-z0-9._-]+) COUNT : ([0-9]+)$')
+
+interval_pattern = re.compile(r'thread ([0-9]+): \(([0-9]+),([0-9]+)\) ops and \([0-9.]+,[0-9.]+\) ops/second in \(([0-9.]+),([0-9.]+)\) seconds')
+histogram_start_pattern = re.compile(r'^Microseconds per ([a-z]+):')
+histogram_minmax_pattern = re.compile(r'^Min: ([0-9.]+)\s+Median: [0-9.]+\s+Max: ([0-9.]+)')
+histogram_bucket_pattern = re.compile(r'^[\[(]\s*([0-9.]+),\s*([0-9.]+)\s*[\])]\s+([0-9]+)\s')
+histogram_lines = ("Count:", "Percentiles:", "---")
+
+histogram_ops = ['read', 'write']
+histogram_percentiles = [50, 99, 99.9, 99.99]
+
+size_units_gb = {'B': 1 / 1024**3, 'KB': 1 / 1024**2, 'MB': 1 / 1024, 'GB': 1, 'TB': 1024}
+
+def stats_series_filename(output_file):
+    return os.path.splitext(output_file)[0] + stats_series_suffix
+
+def interval_series_filename(output_file):
+    return os.path.splitext(output_file)[0] + interval_series_suffix
+
+# Columns of the level table of a compaction stats header after the size
+def get_level_columns(header_line):
+    columns = header_line.split()
+    return columns[columns.index('Score'):] if 'Score' in columns else None
+
+def parse_level_row(m, level_columns, dump):
+    level = m.group(1)
+    dump[f"L{level}_files"] = int(m.group(2))
+    values = dict(zip(level_columns, m.group(4).split()))
+    for name, column in [('read_gb', 'Read(GB)'), ('write_gb', 'Write(GB)')]:
+        if column in values:
+            dump[f"L{level}_{name}"] = float(values[column])
+
+# Yields the dumps of a db_bench output as {column: value}. A dump consists
+# of a DB stats section and the compaction stats of the column families, in
+# either order (the LOG and the rocksdb.stats property differ), so a dump
+# ends where a section that it already has starts again.
+def iter_stats_dumps(output_file):
+    dump = {}
+    sections = set()
+    default_cf = False
+    level_columns = None
+
+    def start_section(section):
+        nonlocal dump, sections
+        finished = None
+        if section in sections:
+            finished = dump
+            dump, sections = {}, set()
+        sections.add(section)
+        return finished
+
+    with open(output_file, 'r', errors='replace') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            finished = None
+            if line.startswith(db_stats_start):
+                finished = start_section('db')
+                level_columns = None
+            elif line.startswith("** Compaction Stats"):
+                # Only the default column family is followed
+                default_cf = "[default]" in line
+                level_columns = None
+            elif line.startswith("Level ") and default_cf:
+                finished = start_section('cf')
+                level_columns = get_level_columns(line)
+            if finished is not None:
+                yield finished
+            if len(sections) == 0:
+                continue
+
+            m = ticker_pattern.match(line)
+            if m is not None:
+                dump[m.group(1)] = int(m.group(2))
+                continue
+            if level_columns is not None:
+                m = level_pattern.match(line)
+                if m is not None:
+                    parse_level_row(m, level_columns, dump)
+                    continue
+
+            m = uptime_pattern.match(line)
+            if m is not None:
+                dump.setdefault('uptime_sec', float(m.group(1)))
+                dump.setdefault('interval_sec', float(m.group(2)))
+                continue
+            m = ingest_pattern.match(line)
+            if m is not None:
+                dump['ingest_gb'] = float(m.group(1)) * size_units_gb[m.group(2)]
+                continue
+            m = wal_pattern.match(line)
+            if m is not None:
+                dump['wal_written_gb'] = float(m.group(1)) * size_units_gb[m.group(2)]
+                continue
+            m = stall_pattern.match(line)
+            if m is not None:
+                if m.group(1) == 'Cumulative':
+                    seconds = int(m.group(2)) * 3600 + int(m.group(3)) * 60 + float(m.group(4))
+                    dump['stall_micros'] = int(round(seconds * 1000000))
+                    dump['stall_pct'] = float(m.group(5))
+                else:
+                    dump['interval_stall_pct'] = float(m.group(5))
+                continue
+            if not default_cf:
+                continue
+            m = flush_pattern.match(line)
+            if m is not None:
+                dump['flush_gb'] = float(m.group(1))
+                continue
+            m = compaction_pattern.match(line)
+            if m is not None:
+                dump['compaction_write_gb'] = float(m.group(1))
+                dump['compaction_read_gb'] = float(m.group(2))
+                continue
+            if line.startswith("Stalls(count):"):
+                for count, cause in stalls_pattern.findall(line[len("Stalls(count):"):]):
+                    cause = cause.strip().replace(' ', '_')
+                    dump[f"stalls_{cause}"] = int(count)
+    if len(sections) > 0:
+        yield dump
+
+# Orders the columns: the fixed ones, the levels and the tickers
+def get_column_order(column):
+    fixed = ['uptime_sec', 'interval_sec', 'ingest_gb', 'wal_written_gb', 'flush_gb', 'stall_micros', 'stall_pct',
+             'interval_stall_pct', 'compaction_read_gb', 'compaction_write_gb']
+    if column in fixed:
+        return (0, fixed.index(column), '')
+    m = re.match(r'^L([0-9]+)_(.*)$', column)
+    if m is not None:
+        return (1, int(m.group(1)), m.group(2))
+    if column.startswith('stalls_'):
+        return (2, 0, column)
+    return (3, 0, column)
+
+# Writes the dumps of a db_bench output to <output>_stats.csv. Returns the
+# file name, or None if the output holds no dumps.
+def save_stats_series(output_file):
+    if not os.path.exists(output_file):
+        return None
+    dumps = [d for d in iter_stats_dumps(output_file) if 'uptime_sec' in d]
+    if len(dumps) == 0:
+        return None
+    columns = sorted(set([c for d in dumps for c in d.keys()]), key=get_column_order)
+    csv_file = stats_series_filename(output_file)
+    with open(csv_file, 'w') as f:
+        w = csv.writer(f, delimiter=',')
+        w.writerow(columns)
+        w.writerows([[d.get(c, '') for c in columns] for d in dumps])
+    return csv_file
+
+# Returns the (secs_elapsed, ops/s) of each second of a db_bench output from
+# the interval lines of its threads. The operations of an interval are spread
+# evenly over the seconds it covers, as the intervals of the threads neither
+# last exactly one second nor are aligned. Only the seconds that all threads
+# have reported are returned.
+def read_intervals(output_file):
+    ops = {}
+    thread_ends = {}
+    if not os.path.exists(output_file):
+        return []
+    with open(output_file, 'r', errors='replace') as f:
+        for line in f:
+            m = interval_pattern.search(line)
+            if m is None:
+                continue
+            interval_ops, interval_sec, elapsed_sec = int(m.group(2)), float(m.group(4)), float(m.group(5))
+            thread_ends[m.group(1)] = elapsed_sec
+            if interval_sec <= 0:
+                continue
+            start_sec = elapsed_sec - interval_sec
+            second = int(start_sec)
+            while second < elapsed_sec:
+                overlap = min(elapsed_sec, second + 1) - max(start_sec, second)
+                ops[second] = ops.get(second, 0.0) + interval_ops * overlap / interval_sec
+                second += 1
+    if len(thread_ends) == 0:
+        return []
+    return [(second + 1, ops.get(second, 0.0)) for second in range(int(min(thread_ends.values())))]
+
+# Writes the ops/s of each second of a db_bench output to
+# <output>_intervals.csv. Returns the file name, or None if the output has no
+# interval lines.
+def save_interval_series(output_file):
+    intervals = read_intervals(output_file)
+    if len(intervals) == 0:
+        return None
+    csv_file = interval_series_filename(output_file)
+    with open(csv_file, 'w') as f:
+        w = csv.writer(f, delimiter=',')
+        w.writerow(['secs_elapsed', 'ops/s'])
+        w.writerows([[t, "%0.1f" % qps] for t, qps in intervals])
+    return csv_file
+
+def read_interval_series(csv_file):
+    with open(csv_file, 'r') as f:
+        rows = list(csv.reader(f))[1:]
+    return [(float(row[0]), float(row[1])) for row in rows]
+
+# Minimum and 5th percentile of the ops/s of the intervals, which show the
+# throughput drops that the average over the run hides
+def summarize_intervals(intervals):
+    if len(intervals) == 0:
+        return None, None
+    ops = sorted([qps for _, qps in intervals])
+    return ops[0], ops[int(0.05 * (len(ops) - 1))]
+
+class DbBenchHistogram(object):
+    def __init__(self):
+        # Right bucket limit: (left bucket limit, count)
+        self.buckets = {}
+        self.min_us = None
+        self.max_us = None
+
+    def add_bucket(self, left, right, count):
+        _, previous = self.buckets.get(right, (left, 0))
+        self.buckets[right] = (left, previous + count)
+
+    def set_range(self, min_us, max_us):
+        self.min_us = min_us if self.min_us is None else min(self.min_us, min_us)
+        self.max_us = max_us if self.max_us is None else max(self.max_us, max_us)
+
+    def merge(self, other):
+        for right, (left, count) in other.buckets.items():
+            self.add_bucket(left, right, count)
+        if other.min_us is not None:
+            self.set_range(other.min_us, other.max_us)
+
+    def count(self):
+        return sum([count for _, count in self.buckets.values()])
+
+    # Interpolated within the bucket and bounded by min and max, as
+    # HistogramStat::Percentile of RocksDB does
+    def get_percentile(self, percentile):
+        total = self.count()
+        if total == 0:
+            return None
+        threshold = total * percentile / 100.0
+        cumulative = 0
+        for right in sorted(self.buckets.keys()):
+            left, count = self.buckets[right]
+            cumulative += count
+            if cumulative >= threshold:
+                pos = (threshold - (cumulative - count)) / count if count > 0 else 0
+                value = left + (right - left) * pos
+                if self.min_us is not None:
+                    value = min(max(value, self.min_us), self.max_us)
+                return value
+        return self.max_us
+
+# Returns the histograms of a db_bench output by operation (read, write, ...).
+# Histograms of the same operation, e.g. of several benchmarks in one run, are
+# merged.
+def read_histograms(output_file):
+    histograms = {}
+    op, current = None, None
+    if not os.path.exists(output_file):
+        return histograms
+
+    def finish():
+        if current is not None:
+            histograms.setdefault(op, DbBenchHistogram()).merge(current)
+
+    with open(output_file, 'r', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            m = histogram_start_pattern.match(line)
+            if m is not None:
+                finish()
+                op, current = m.group(1), DbBenchHistogram()
+                continue
+            if current is None:
+                continue
+            m = histogram_bucket_pattern.match(line)
+            if m is not None:
+                current.add_bucket(float(m.group(1)), float(m.group(2)), int(m.group(3)))
+                continue
+            m = histogram_minmax_pattern.match(line)
+            if m is not None:
+                current.set_range(float(m.group(1)), float(m.group(2)))
+                continue
+            if line == '' or line.startswith(histogram_lines):
+                continue
+            finish()
+            op, current = None, None
+    finish()
+    return histograms
+
+def get_percentile_column(op, percentile):
+    return "%s_p%s_us" % (op, str(percentile).replace('.', '_'))
+
+# Columns of the latency percentiles in the reports
+def get_percentile_columns():
+    return [get_percentile_column(op, p) for op in histogram_ops for p in histogram_percentiles]
+
+# Report fields of the interval reports and latency histograms of the runs of
+# a workload: the minimum and 5th percentile of the interval ops/s, and the
+# latency percentiles of the merged histograms (empty if unknown)
+def get_run_summary(output_files):
+    intervals = []
+    histograms = {}
+    for output_file in output_files:
+        intervals += read_intervals(output_file)
+        for op, histogram in read_histograms(output_file).items():
+            histograms.setdefault(op, DbBenchHistogram()).merge(histogram)
+    fields = ['' if v is None else "%0.1f" % v for v in summarize_intervals(intervals)]
+    for op in histogram_ops:
+        for p in histogram_percentiles:
+            value = histograms[op].get_percentile(p) if op in histograms else None
+            fields.append('' if value is None else "%0.2f" % value)
+    return fields
+
+summary_columns = ["ops/s_interval_min", "ops/s_interval_p5"] + get_percentile_columns()
@@ -126,6 +126,7 @@ class Run(Bench):
                         elif re.search("percentile:", line):
                             p95th_lat_ms = line.split()[-1]
                     cw.writerow([str(oltp_workload_log), str(transactions_per_s), str(min_lat_ms), str(avg_lat_ms), str(max_lat_ms), str(p95th_lat_ms)])
+        self.save_columnar_report(csv_file)
 
         print("  Output written to: %s" % csv_file)
         return csv_file
@@ -0,0 +1,116 @@
+import csv
+import os
+import threading
+import time
+import numpy as np
+
+# Block device telemetry sampled from the kernel I/O statistics
+telemetry_header = ['time_sec', 'read_iops', 'write_iops', 'read_kBps', 'write_kBps', 'avg_queue_depth', 'util_pct']
+min_telemetry_interval_sec = 0.1
+
+# Field indices of /sys/block/<dev>/stat (/proc/diskstats without the
+# major, minor and device name columns)
+STAT_READS = 0
+STAT_READ_SECTORS = 2
+STAT_WRITES = 4
+STAT_WRITE_SECTORS = 6
+STAT_IO_TICKS = 9
+STAT_TIME_IN_QUEUE = 10
+
+def read_block_stat(devname):
+    try:
+        with open(f"/sys/block/{devname}/stat", 'r') as f:
+            return [int(x) for x in f.readline().split()]
+    except FileNotFoundError:
+        with open("/proc/diskstats", 'r') as f:
+            for line in f:
+                fields = line.split()
+                if fields[2] == devname:
+                    return [int(x) for x in fields[3:]]
+    raise FileNotFoundError(f"No I/O statistics found for {devname}")
+
+def telemetry_filename(devname):
+    return f"telemetry-{devname}"
+
+# Samples the I/O statistics of a block device in a background thread into a
+# preallocated array, which is grown by doubling when full.
+class DiskStatsSampler(threading.Thread):
+    initial_samples = 4096
+
+    def __init__(self, dev, interval_sec):
+        super().__init__(daemon=True)
+        self.devname = dev.strip('/dev/')
+        self.interval_sec = max(interval_sec, min_telemetry_interval_sec)
+        self.samples = np.zeros((self.initial_samples, len(telemetry_header)))
+        self.nr_samples = 0
+        self.stop_event = threading.Event()
+
+    def add_sample(self, sample):
+        if self.nr_samples == len(self.samples):
+            self.samples = np.concatenate((self.samples, np.zeros_like(self.samples)))
+        self.samples[self.nr_samples] = sample
+        self.nr_samples += 1
+
+    def run(self):
+        start = time.monotonic()
+        prev_time = start
+        prev = read_block_stat(self.devname)
+        n = 1
+        # Sleep until fixed points in time, so the sampling does not drift
+        while not self.stop_event.wait(max(0, start + n * self.interval_sec - time.monotonic())):
+            n += 1
+            now = time.monotonic()
+            cur = read_block_stat(self.devname)
+            dt = now - prev_time
+            self.add_sample([now - start,
+                             (cur[STAT_READS] - prev[STAT_READS]) / dt,
+                             (cur[STAT_WRITES] - prev[STAT_WRITES]) / dt,
+                             (cur[STAT_READ_SECTORS] - prev[STAT_READ_SECTORS]) / 2 / dt,
+                             (cur[STAT_WRITE_SECTORS] - prev[STAT_WRITE_SECTORS]) / 2 / dt,
+                             (cur[STAT_TIME_IN_QUEUE] - prev[STAT_TIME_IN_QUEUE]) / 1000 / dt,
+                             (cur[STAT_IO_TICKS] - prev[STAT_IO_TICKS]) / 10 / dt])
+            prev = cur
+            prev_time = now
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    def get_samples(self):
+        return self.samples[:self.nr_samples]
+
+    # The samples of earlier attempts of a resumed run are kept. The time of
+    # this attempt continues after their last sample.
+    def save(self, output):
+        filename = os.path.join(output, telemetry_filename(self.devname))
+        samples = self.get_samples()
+        previous = load_telemetry(output, self.devname)
+        if previous is not None and len(previous) > 0:
+            samples = samples.copy()
+            samples[:, telemetry_header.index('time_sec')] += previous[-1, telemetry_header.index('time_sec')]
+            samples = np.concatenate((previous, samples))
+        np.save(filename + ".npy", samples)
+        with open(filename + ".csv", 'w') as f:
+            w = csv.writer(f, delimiter=';')
+            w.writerow(telemetry_header)
+            w.writerows([["%0.3f" % x for x in row] for row in samples])
+        print(f"  Telemetry written to: {filename}.csv")
+
+def load_telemetry(path, devname):
+    filename = os.path.join(path, telemetry_filename(devname))
+    if os.path.exists(filename + ".npy"):
+        return np.load(filename + ".npy")
+    if os.path.exists(filename + ".csv"):
+        return np.loadtxt(filename + ".csv", delimiter=';', skiprows=1, ndmin=2)
+    return None
+
+# Averages a telemetry column over consecutive intervals of interval_sec
+def get_interval_means(telemetry, column, interval_sec):
+    if len(telemetry) == 0:
+        return np.zeros(0)
+    times = telemetry[:, telemetry_header.index('time_sec')]
+    values = telemetry[:, telemetry_header.index(column)]
+    buckets = np.floor((times - 1e-9) / interval_sec).astype(int)
+    sums = np.bincount(buckets, weights=values)
+    counts = np.bincount(buckets)
+    return sums[counts > 0] / counts[counts > 0]
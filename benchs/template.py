@@ -65,6 +65,7 @@ class Run(Bench):
         plot = matplotlib_plotter.Plot(self.output, csv_files)
         #Implement plotting in plot.gen_TEMPLATE
         plot.gen_TEMPLATE()
+        plot.render()
 
 # Uncomment to enable benchmark
 #base_benches.append(Run())
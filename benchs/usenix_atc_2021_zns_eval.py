@@ -6,6 +6,7 @@ import os
 from statistics import mean
 from .base import base_benches, Bench
 from benchs.base import is_dev_zoned
+from benchs import rocksdb_stats
 
 class Run(Bench):
     tmp_output_path = ''
@@ -39,6 +40,13 @@ class Run(Bench):
     stats_dump_period = '15'
     delete_obsolete_files_period = str(30 * 1000000)
 
+    # db_bench reports the operations of each thread each report_interval
+    # seconds to the output (see benchs/rocksdb_stats.py). It only reports
+    # per interval with --stats_interval, the number of operations of a
+    # thread between checks of the interval time.
+    report_interval = '1'
+    stats_interval_ops = '1000'
+
     # Readwhilewriting benchmarks
     # Time in seconds per run
     read_duration = str(60 * 30)
@@ -76,6 +84,9 @@ class Run(Bench):
                       " --stats_dump_period_sec=", self.stats_dump_period, \
                       " --delete_obsolete_files_period_micros=", self.delete_obsolete_files_period, \
                       " --statistics", \
+                      " --histogram", \
+                      " --stats_interval=", self.stats_interval_ops, \
+                      " --stats_interval_seconds=", self.report_interval, \
                       ''.join(bench_params), \
                       " > ", os.path.join(self.tmp_output_path, name + ".txt"), " 2>&1"
 
@@ -85,7 +96,7 @@ class Run(Bench):
         try:
             with open(filename, 'x') as f:
                 w = csv.writer(f, delimiter=',')
-                w.writerow(("benchmark", "ops/s", "MB/s", "readwhilewrite_write_MB/s"))
+                w.writerow(("benchmark", "ops/s", "MB/s", "readwhilewrite_write_MB/s") + tuple(rocksdb_stats.summary_columns))
         except:
             pass
 
@@ -101,6 +112,7 @@ class Run(Bench):
 
     def report_bench(self, path, bench):
         results = []
+        output_files = []
         csv_filename = "%s.csv" % bench
         csv_file = os.path.join(path, csv_filename)
         self.create_csv_file(csv_file)
@@ -111,12 +123,14 @@ class Run(Bench):
                     entries = self.get_result_from_test(os.path.join(path, filename), bench)
                     with open(csv_file, 'a') as f:
                         w = csv.writer(f, delimiter=',')
-                        w.writerow((entries[0], entries[4], entries[6], '-'))
+                        w.writerow([entries[0], entries[4], entries[6], '-'] + rocksdb_stats.get_run_summary([os.path.join(path, filename)]))
+                    self.save_columnar_report(csv_file)
                     return csv_file
                 else:
                     entries = self.get_result_from_test(os.path.join(path, filename), bench.split('_')[0])
                     writes = self.get_result_from_test(os.path.join(path, filename), 'Cumulative writes')
                     results.append((bench, float(entries[4]), float(entries[6]), float(writes[17])))
+                    output_files.append(os.path.join(path, filename))
         if len(results) > 0:
             ops = mean(list(zip(*results))[1])
             mbs = mean(list(zip(*results))[2])
@@ -124,7 +138,8 @@ class Run(Bench):
 
             with open(csv_file, 'a') as f:
                 w = csv.writer(f, delimiter=',')
-                w.writerow((bench, ops, mbs, write_mbs))
+                w.writerow([bench, ops, mbs, write_mbs] + rocksdb_stats.get_run_summary(output_files))
+            self.save_columnar_report(csv_file)
         else:
             csv_file = ''
         return csv_file
@@ -151,36 +166,53 @@ class Run(Bench):
 
         self.run_cmd(dev, container, 'db_bench', self.get_run_string(dev, bench_params, "overwrite"), self.get_extra_container_params())
 
-    def read_workload(self, dev, container):
+    def get_read_workloads(self):
         num = str(self.scale_num)
+        workloads = []
 
         for runid in [1, 2]:
             bench_params = " --benchmarks=readwhilewriting,stats", \
-                           " --use_existing_db --histogram --threads=32",  \
+                           " --use_existing_db --threads=32",  \
                            " --num=", num, \
                            " --duration=", self.read_duration
 
-            self.run_cmd(dev, container, 'db_bench', self.get_run_string(dev, bench_params, "readwhilewriting_%s" % runid), self.get_extra_container_params())
+            workloads.append(("readwhilewriting_%s" % runid, bench_params))
 
             bench_params = " --benchmarks=readrandom,stats", \
-                           " --use_existing_db --histogram --threads=32",  \
+                           " --use_existing_db --threads=32",  \
                            " --num=", num, \
                            " --duration=", self.read_duration
 
-            self.run_cmd(dev, container, 'db_bench', self.get_run_string(dev, bench_params, "readrandom_%s" % runid), self.get_extra_container_params())
+            workloads.append(("readrandom_%s" % runid, bench_params))
 
             bench_params = " --benchmarks=readwhilewriting,stats", \
-                           " --use_existing_db --histogram --threads=32",  \
+                           " --use_existing_db --threads=32",  \
                            " --num=", num, \
                            " --duration=", self.read_duration, \
                            " --benchmark_write_rate_limit=", self.write_limit
 
-            self.run_cmd(dev, container, 'db_bench', self.get_run_string(dev, bench_params, "readwhilewriting_writelimit_%s" % runid), self.get_extra_container_params())
+            workloads.append(("readwhilewriting_writelimit_%s" % runid, bench_params))
+
+        return workloads
+
+    def read_workload(self, dev, container, filesystem):
+        for name, bench_params in self.get_read_workloads():
+            if self.is_point_done(f"{filesystem}/{name}"):
+                print(f"Skipping {name}, it has been completed by an earlier attempt of the run")
+                continue
+
+            self.run_cmd(dev, container, 'db_bench', self.get_run_string(dev, bench_params, name), self.get_extra_container_params())
+            self.mark_point_done(f"{filesystem}/{name}")
+
 
+    def supports_resume(self):
+        return True
 
     def setup(self, dev, container, output, arguments):
         super(Run, self).setup(container, output, arguments)
-        self.discard_dev(dev)
+        # A resumed run continues on the database left on the device
+        if not self.is_resumed():
+            self.discard_dev(dev)
         self.target_fz_base = self.get_target_fz_base(dev)
         if is_dev_zoned(dev):
             print("Running benchmark on a ZNS device")
@@ -190,7 +222,7 @@ class Run(Bench):
     def create_mountpoint(self, dev, filesystem):
         relative_mountpoint = "%s_%s" % (dev.strip('/dev/'), filesystem)
         mountpoint = os.path.join(self.tmp_output_path, relative_mountpoint)
-        os.mkdir(mountpoint)
+        os.makedirs(mountpoint, exist_ok=True)
         return mountpoint, relative_mountpoint
 
     def create_new_nullblk_dev_config_path(self):
@@ -221,11 +253,12 @@ class Run(Bench):
         dev_basename = os.path.basename(os.path.normpath(dev_config_path))
         return f'/dev/{dev_basename}'
 
-    def setup_zns(self, dev, container, filesystem):
+    def setup_zns(self, dev, container, filesystem, mkfs=True):
         devname = dev.strip('/dev/')
         self.conv_nullblk_dev = ''
         if filesystem == 'zenfs':
-            self.run_cmd(dev, container, 'zenfs', f'mkfs --zbd={devname} --finish_threshold=20 --aux_path=/tmp/zenfs_aux --force')
+            if mkfs:
+                self.run_cmd(dev, container, 'zenfs', f'mkfs --zbd={devname} --finish_threshold=20 --aux_path=/tmp/zenfs_aux --force')
             self.db_env_param = f'--fs_uri=zenfs://dev:{devname}'
             return ''
         elif filesystem == 'f2fs':
@@ -241,7 +274,7 @@ class Run(Bench):
             print("Filesystem %s is not currently not supported for ZNS drives in this benchmark" % filesystem)
             exit(1)
 
-    def setup_conventional(self, dev, container, filesystem):
+    def setup_conventional(self, dev, container, filesystem, mkfs=True):
         self.conv_nullblk_dev = ''
         mountpoint, relative_mountpoint = self.create_mountpoint(dev, filesystem)
         force_flag = '-f'
@@ -250,7 +283,8 @@ class Run(Bench):
         mount_opt = ''
         if filesystem == 'f2fs':
             mount_opt = '-o whint_mode=user-based'
-        self.run_cmd(dev, container, f'mkfs.{filesystem}' , f'{force_flag} {dev}')
+        if mkfs:
+            self.run_cmd(dev, container, f'mkfs.{filesystem}' , f'{force_flag} {dev}')
         subprocess.check_call(f'mount {mount_opt} {dev} {mountpoint}', shell=True)
         self.db_env_param = f'--db=/output/{filesystem}/{relative_mountpoint}/eval'
         return mountpoint
@@ -261,25 +295,45 @@ class Run(Bench):
         else:
             return self.conventional_filesystems
 
+    # The f2fs metadata of ZNS drives is kept on a memory backed null_blk
+    # device, so the file-system does not outlive a run
+    def is_filesystem_persistent(self, is_device_zoned, filesystem):
+        return not (is_device_zoned and filesystem == 'f2fs')
+
     def run(self, dev, container):
         root_output = self.output
         is_device_zoned = is_dev_zoned(dev)
         for filesystem in self.get_filesystems_to_test(is_device_zoned):
+            last_workload = self.get_read_workloads()[-1][0]
+            if self.is_point_done(f"{filesystem}/{last_workload}"):
+                print(f"Skipping {filesystem}, it has been completed by an earlier attempt of the run")
+                continue
+
+            # A resumed run reuses the database of an earlier attempt if it
+            # is still on the device, otherwise all phases restoring the
+            # device state are run again
+            reuse_db = (self.is_point_done(f"{filesystem}/fillrandom") and
+                        self.is_filesystem_persistent(is_device_zoned, filesystem))
+
             mountpoint = ''
             sub_output = os.path.join(root_output, filesystem)
-            os.makedirs(sub_output)
+            os.makedirs(sub_output, exist_ok=True)
             self.tmp_output_path = sub_output
             if is_device_zoned:
-                mountpoint = self.setup_zns(dev, container, filesystem)
+                mountpoint = self.setup_zns(dev, container, filesystem, not reuse_db)
             else:
-                mountpoint = self.setup_conventional(dev, container, filesystem)
+                mountpoint = self.setup_conventional(dev, container, filesystem, not reuse_db)
             try:
-                print("Starting to prepare the device with a fillrandom workload...")
-                self.fill_prep(dev, container)
-                print("Starting to prepare the device with an overwrite workload...")
-                self.overwrite(dev, container)
+                if not reuse_db:
+                    print("Starting to prepare the device with a fillrandom workload...")
+                    self.fill_prep(dev, container)
+                    self.mark_point_done(f"{filesystem}/fillrandom")
+                if not reuse_db or not self.is_point_done(f"{filesystem}/overwrite"):
+                    print("Starting to prepare the device with an overwrite workload...")
+                    self.overwrite(dev, container)
+                    self.mark_point_done(f"{filesystem}/overwrite")
                 print("Starting to issue the benchmark read workload...")
-                self.read_workload(dev, container)
+                self.read_workload(dev, container, filesystem)
             except Exception as e:
                 raise e
             finally:
@@ -305,9 +359,32 @@ class Run(Bench):
             self.report_bench(reportpath, 'readrandom')
             csv_file = self.report_bench(reportpath, 'readwhilewriting_writelimit')
             csv_files.append(csv_file)
+            for output_file in self.get_phase_outputs(reportpath):
+                rocksdb_stats.save_interval_series(output_file)
             print("  Output written to: %s" % (csv_file))
         return csv_files
 
+    # db_bench outputs of the phases run on a file system
+    def get_phase_outputs(self, path):
+        names = ['fillrandom', 'overwrite'] + [name for name, _ in self.get_read_workloads()]
+        return [f for f in [os.path.join(path, name + ".txt") for name in names] if os.path.exists(f)]
+
+    # Throughput and tail latency plots of each db_bench phase, per file
+    # system. Takes the csv files of report() or a single one (--plot).
+    def plot(self, csv_files):
+        from plotter import matplotlib_plotter
+        if isinstance(csv_files, str):
+            csv_files = [csv_files]
+        for csv_file in csv_files:
+            if not csv_file:
+                continue
+            path = os.path.dirname(csv_file)
+            plot = matplotlib_plotter.RunPlot(path)
+            for output_file in self.get_phase_outputs(path):
+                plot.gen_DB_BENCH_PHASE(output_file)
+            plot.render()
+        print("  Done generating graphs")
+
     def teardown(self, dev, container):
         pass
 
@@ -0,0 +1,250 @@
+import fcntl
+import os
+import struct
+import threading
+import time
+import numpy as np
+
+# Zone report ioctl, see include/uapi/linux/blkzoned.h
+# BLKREPORTZONE = _IOWR(0x12, 130, struct blk_zone_report)
+BLKREPORTZONE = 0xC0101282
+BLK_ZONE_REP_CAPACITY = 1
+
+# struct blk_zone_report { __u64 sector; __u32 nr_zones; __u32 flags; }
+blk_zone_report_fmt = '=QII'
+blk_zone_report_size = struct.calcsize(blk_zone_report_fmt)
+# struct blk_zone (64 bytes), all positions and lengths in 512B sectors
+blk_zone_dtype = np.dtype([('start', '=u8'),
+                           ('len', '=u8'),
+                           ('wp', '=u8'),
+                           ('type', 'u1'),
+                           ('cond', 'u1'),
+                           ('non_seq', 'u1'),
+                           ('reset', 'u1'),
+                           ('resv', 'V4'),
+                           ('capacity', '=u8'),
+                           ('reserved', 'V24')])
+
+BLK_ZONE_TYPE_CONVENTIONAL = 0x1
+BLK_ZONE_TYPE_SEQWRITE_REQ = 0x2
+BLK_ZONE_TYPE_SEQWRITE_PREF = 0x3
+
+BLK_ZONE_COND_NOT_WP = 0x0
+BLK_ZONE_COND_EMPTY = 0x1
+BLK_ZONE_COND_IMP_OPEN = 0x2
+BLK_ZONE_COND_EXP_OPEN = 0x3
+BLK_ZONE_COND_CLOSED = 0x4
+BLK_ZONE_COND_READONLY = 0xD
+BLK_ZONE_COND_FULL = 0xE
+BLK_ZONE_COND_OFFLINE = 0xF
+
+# Number of zones requested per ioctl call
+report_zones_chunk = 4096
+
+# Returns all zones of a zoned block device as a blk_zone_dtype array
+def report_zones(dev):
+    buf = bytearray(blk_zone_report_size + report_zones_chunk * blk_zone_dtype.itemsize)
+    chunks = []
+    sector = 0
+    fd = os.open(dev, os.O_RDONLY)
+    try:
+        while True:
+            struct.pack_into(blk_zone_report_fmt, buf, 0, sector, report_zones_chunk, 0)
+            fcntl.ioctl(fd, BLKREPORTZONE, buf, True)
+            nr_zones = struct.unpack_from(blk_zone_report_fmt, buf, 0)[1]
+            flags = struct.unpack_from(blk_zone_report_fmt, buf, 0)[2]
+            if nr_zones == 0:
+                break
+            zones = np.frombuffer(bytes(buf), dtype=blk_zone_dtype, count=nr_zones, offset=blk_zone_report_size)
+            if not (flags & BLK_ZONE_REP_CAPACITY):
+                # Kernels without zone capacity support: capacity = zone size
+                zones = zones.copy()
+                zones['capacity'] = zones['len']
+            chunks.append(zones)
+            sector = int(zones['start'][-1] + zones['len'][-1])
+    finally:
+        os.close(fd)
+
+    if len(chunks) == 0:
+        return np.zeros(0, dtype=blk_zone_dtype)
+    return np.concatenate(chunks)
+
+# Zone layout of a zoned block device, built once from the zone report. The
+# per-zone start, length, capacity, type and condition (at the time of the
+# report) are held in arrays, all positions and lengths in bytes.
+class ZoneGeometry(object):
+    def __init__(self, zones):
+        self.start = zones['start'].astype(np.uint64) * 512
+        self.len = zones['len'].astype(np.uint64) * 512
+        self.capacity = zones['capacity'].astype(np.uint64) * 512
+        self.type = zones['type'].copy()
+        self.cond = zones['cond'].copy()
+
+    def nr_zones(self):
+        return len(self.start)
+
+    def zone_size(self):
+        if self.nr_zones() == 0:
+            return 0
+        return int(np.max(self.len))
+
+    def is_conventional(self):
+        return self.type == BLK_ZONE_TYPE_CONVENTIONAL
+
+    def nr_conventional_zones(self):
+        return int(np.count_nonzero(self.is_conventional()))
+
+    def nr_sequential_zones(self):
+        return self.nr_zones() - self.nr_conventional_zones()
+
+    # Ranges of consecutive conventional zones as [first, last) zone indices
+    def conventional_zone_ranges(self):
+        conv = np.concatenate(([0], self.is_conventional().astype(np.int8), [0]))
+        edges = np.flatnonzero(np.diff(conv))
+        return list(zip(edges[0::2].tolist(), edges[1::2].tolist()))
+
+    # Bytes that can be written to the device, i.e. the sum of the zone
+    # capacities of all writable zones
+    def usable_capacity(self):
+        writable = (self.cond != BLK_ZONE_COND_READONLY) & (self.cond != BLK_ZONE_COND_OFFLINE)
+        return int(np.sum(self.capacity[writable]))
+
+    def usable_capacity_ratio(self):
+        total = int(np.sum(self.len))
+        if total == 0:
+            return 0
+        return self.usable_capacity() / total
+
+    # Capacity of the sequential zones (all zones if there are none)
+    def sequential_zone_capacity(self):
+        seq = ~self.is_conventional()
+        if not np.any(seq):
+            seq = np.ones(self.nr_zones(), dtype=bool)
+        return self.capacity[seq]
+
+    def min_zone_capacity(self):
+        capacity = self.sequential_zone_capacity()
+        if len(capacity) == 0:
+            return 0
+        return int(np.min(capacity))
+
+    # Distinct zone capacities and the number of zones with each capacity
+    def zone_capacity_distribution(self):
+        capacities, counts = np.unique(self.sequential_zone_capacity(), return_counts=True)
+        return dict(zip(capacities.tolist(), counts.tolist()))
+
+    def summary(self):
+        mb = 1024 * 1024
+        dist = ", ".join([f"{c / mb:g}MiB x {n}" for c, n in self.zone_capacity_distribution().items()])
+        return (f"{self.nr_zones()} zones ({self.nr_conventional_zones()} conventional)"
+                f" of {self.zone_size() / mb:g}MiB, zone capacity {dist},"
+                f" usable capacity {self.usable_capacity() / (1024 * mb):.2f}GiB")
+
+# The zone geometry does not change during a run, so it is read once per device
+zone_geometry_cache = {}
+
+def get_zone_geometry(dev):
+    if dev not in zone_geometry_cache:
+        zone_geometry_cache[dev] = ZoneGeometry(report_zones(dev))
+    return zone_geometry_cache[dev]
+
+def zone_samples_filename(devname):
+    return f"zone-samples-{devname}.npz"
+
+# Takes periodic zone report snapshots in a background thread. The zone
+# conditions and write pointers are stored per snapshot in (zones x samples)
+# arrays of at most max_samples snapshots. When they are full, every other
+# snapshot is dropped and the interval doubled, so the memory stays at
+# zones x max_samples x 9 bytes for runs of any length.
+class ZoneSampler(threading.Thread):
+    max_samples = 512
+
+    def __init__(self, dev, interval_sec):
+        super().__init__(daemon=True)
+        self.dev = dev
+        self.devname = dev.strip('/dev/')
+        self.interval_sec = interval_sec
+        self.zones = report_zones(dev)
+        nr_zones = len(self.zones)
+        # The pages of zeroed arrays are only allocated once written
+        self.times = np.zeros(self.max_samples)
+        self.cond = np.zeros((nr_zones, self.max_samples), dtype=np.uint8)
+        self.wp = np.zeros((nr_zones, self.max_samples), dtype=np.uint64)
+        self.nr_samples = 0
+        self.stop_event = threading.Event()
+
+    def downsample(self):
+        kept = (self.nr_samples + 1) // 2
+        self.times[:kept] = self.times[:self.nr_samples:2]
+        self.cond[:, :kept] = self.cond[:, :self.nr_samples:2]
+        self.wp[:, :kept] = self.wp[:, :self.nr_samples:2]
+        self.nr_samples = kept
+        self.interval_sec *= 2
+
+    def add_sample(self, sample_time, zones):
+        if self.nr_samples == self.max_samples:
+            self.downsample()
+        self.times[self.nr_samples] = sample_time
+        self.cond[:, self.nr_samples] = zones['cond']
+        self.wp[:, self.nr_samples] = zones['wp']
+        self.nr_samples += 1
+
+    # The snapshots stay on a grid of the (doubled) interval, as the kept
+    # snapshots are those at the even multiples of the previous interval.
+    def run(self):
+        start = time.monotonic()
+        self.add_sample(0, self.zones)
+        next_sample = self.interval_sec
+        while not self.stop_event.wait(max(0, start + next_sample - time.monotonic())):
+            self.add_sample(time.monotonic() - start, report_zones(self.dev))
+            next_sample += self.interval_sec
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    # The snapshots of earlier attempts of a resumed run are kept. The time
+    # of this attempt continues one interval after their last snapshot.
+    def save(self, output):
+        filename = os.path.join(output, zone_samples_filename(self.devname))
+        times = self.times[:self.nr_samples]
+        cond = self.cond[:, :self.nr_samples]
+        wp = self.wp[:, :self.nr_samples]
+        if os.path.exists(filename):
+            previous = load_zone_samples(filename)
+            if np.array_equal(previous['start'], self.zones['start']) and len(previous['times']) > 0:
+                times = np.concatenate((previous['times'], times + previous['times'][-1] + self.interval_sec))
+                cond = np.concatenate((previous['cond'], cond), axis=1)
+                wp = np.concatenate((previous['wp'], wp), axis=1)
+            else:
+                print(f"  The zone layout of {self.dev} changed, replacing the zone samples of the earlier attempts")
+        np.savez_compressed(filename,
+                            times=times,
+                            start=self.zones['start'],
+                            len=self.zones['len'],
+                            capacity=self.zones['capacity'],
+                            type=self.zones['type'],
+                            cond=cond,
+                            wp=wp)
+        print(f"  Zone samples written to: {filename}")
+
+def load_zone_samples(filename):
+    with np.load(filename) as data:
+        return {k: data[k] for k in data.files}
+
+# Per zone write throughput (MB/s) between consecutive snapshots. The kernel
+# reports the write pointer of a FULL zone at the zone end (start + len), so
+# it is clamped to the end of the writable zone capacity first.
+def get_zone_write_throughput(samples):
+    wp = np.minimum(samples['wp'], (samples['start'] + samples['capacity'])[:, None])
+    written = np.diff(wp.astype(np.int64), axis=1)
+    # A zone reset moves the write pointer back, which is not written data
+    written[written < 0] = 0
+    return written * 512 / (1000 * 1000) / np.diff(samples['times'])
+
+def get_open_zone_count(samples):
+    cond = samples['cond']
+    return np.count_nonzero((cond == BLK_ZONE_COND_IMP_OPEN) | (cond == BLK_ZONE_COND_EXP_OPEN), axis=0)
+
+def get_full_zone_count(samples):
+    return np.count_nonzero(samples['cond'] == BLK_ZONE_COND_FULL, axis=0)
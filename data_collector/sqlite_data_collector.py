@@ -1,11 +1,210 @@
 #!/usr/bin/env python3
 import csv
+from datetime import datetime
+import getpass
+import glob
+import hashlib
+import multiprocessing
+import re
 import sys
 import socket
 import os
 import sqlite3
 from sqlite3 import Error
 from benchs import fio_steady_state_performance, fio_zone_throughput_avg_lat
+from benchs import columnar
+
+# Benchmarks whose csv reports can be collected
+collected_benches = {
+    'fio_zone_throughput_avg_lat': fio_zone_throughput_avg_lat,
+    'fio_steady_state_performance': fio_steady_state_performance,
+}
+
+# Files that identify the results of a run. A run whose files have the same
+# content as an already collected run is not collected again, even if the
+# results directory has been copied or moved.
+run_content_files = ['benchmark.txt', 'benchmark_call.txt', 'zbdbench_version.txt',
+                     'user_annotation.txt', 'udevadm-info.txt']
+
+# Version of the database schema (PRAGMA user_version)
+# 0: all benchmark table columns are text
+# 1: typed benchmark table columns (csv_column_types of the benchmark), the
+#    block size in bytes (bs_bytes) and indexes for comparisons across runs
+# 2: date of the run (run_date of zbdbench_run)
+schema_version = 2
+
+# Columns of the benchmark tables that identify a point of a sweep
+point_columns = ['rw', 'bs_bytes', 'iodepth', 'numjobs']
+
+# Below this number of runs, parsing the reports of a results tree in a
+# process pool does not pay off
+min_pool_runs = 8
+
+def bs_to_bytes(bs):
+    if bs is None:
+        return None
+    m = re.match(r'^([0-9]+)([kmg]?)i?b?$', str(bs).strip().lower())
+    if m is None:
+        return None
+    return int(m.group(1)) * {'': 1, 'k': 1024, 'm': 1024**2, 'g': 1024**3}[m.group(2)]
+
+# Converts a csv value for a typed column. Empty values become NULL and the
+# percentages of the fio terse format lose their '%'. Values that are not
+# numbers are kept as they are.
+def normalize_value(value, column_type):
+    if column_type == 'TEXT' or value is None or isinstance(value, (int, float)):
+        return value
+    text = str(value).strip().rstrip('%')
+    if text == '':
+        return None
+    for convert in [int, float]:
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return value
+
+# (name, type) of the columns of a benchmark table
+def get_bench_columns(bench):
+    column_types = getattr(bench, 'csv_column_types', {})
+    columns = [(column, column_types.get(column, 'TEXT')) for column in bench.csv_header]
+    if 'bs' in bench.csv_header:
+        columns.append(('bs_bytes', 'INTEGER'))
+    return columns
+
+def get_bench_row(bench, columns, row):
+    values = [normalize_value(v, t) for v, (_, t) in zip(row, columns)]
+    if 'bs' in bench.csv_header:
+        values.append(bs_to_bytes(row[bench.csv_header.index('bs')]))
+    return values
+
+def get_hostname():
+    return socket.gethostname()
+
+def get_username():
+    try:
+        return os.getlogin()
+    except OSError:
+        # No controlling terminal, e.g. when collecting from a cron job
+        return getpass.getuser()
+
+def get_device_info_field(results_dir, info_field):
+    device_info_field = "Not found"
+    try:
+        with open(os.path.join(results_dir, "udevadm-info.txt"), 'r') as f:
+            for line in f.readlines():
+                if info_field in line:
+                    device_info_field = line.split("=")[-1].strip()
+                    break
+    except FileNotFoundError as e:
+        pass
+    return device_info_field
+
+def get_device_serial(results_dir):
+    return get_device_info_field(results_dir, "ID_SERIAL=")
+
+def get_device_fw(results_dir):
+    return get_device_info_field(results_dir, "ID_REVISION=")
+
+def get_file_content(results_dir, filename):
+    file_content = "Not found"
+    try:
+        with open(os.path.join(results_dir, filename), 'r') as f:
+            file_content = " ".join(f.readlines()).strip()
+    except FileNotFoundError as e:
+        pass
+    return file_content
+
+def get_benchmark(results_dir):
+    return get_file_content(results_dir, "benchmark.txt")
+
+def get_benchmark_call(results_dir):
+    return get_file_content(results_dir, "benchmark_call.txt")
+
+def get_zbdbench_version(results_dir):
+    return get_file_content(results_dir, "zbdbench_version.txt")
+
+def get_user_annotation(results_dir):
+    return get_file_content(results_dir, "user_annotation.txt")
+
+# Date of a run ("%Y-%m-%d %H:%M:%S") from the name of its results directory,
+# which run.py names after the start time, or else from the modification
+# time of its benchmark.txt
+def get_run_date(results_dir):
+    m = re.search(r'([0-9]{4}-[0-9]{2}-[0-9]{2})-([0-9]{2})([0-9]{2})([0-9]{2})', os.path.basename(os.path.normpath(results_dir)))
+    if m is not None:
+        return f"{m.group(1)} {m.group(2)}:{m.group(3)}:{m.group(4)}"
+    try:
+        return datetime.fromtimestamp(os.path.getmtime(os.path.join(results_dir, "benchmark.txt"))).strftime("%Y-%m-%d %H:%M:%S")
+    except FileNotFoundError:
+        return None
+
+def get_run_content_hash(results_dir, csv_file_path):
+    content_hash = hashlib.sha256()
+    for filename in run_content_files + [os.path.basename(csv_file_path)]:
+        content_hash.update(filename.encode())
+        try:
+            with open(os.path.join(results_dir, filename), 'rb') as f:
+                content_hash.update(f.read())
+        except FileNotFoundError:
+            content_hash.update(b"\0")
+    return content_hash.hexdigest()
+
+# Returns the header and rows of a report, from its typed columnar copy if
+# it is up to date and from the csv otherwise
+def read_report(csv_file_path):
+    columns = columnar.read_columnar(csv_file_path)
+    if columns is not None:
+        return list(columns.keys()), columnar.columnar_rows(columns)
+    with open(csv_file_path, 'r') as file:
+        reader = csv.reader(file, delimiter=';')
+        header = next(reader)
+        return header, [tuple(line) for line in reader]
+
+# Result of parsing the results directory of one run
+class ParsedRun(object):
+    def __init__(self, results_dir, status, message, benchmark=None, run_entry=None, rows=None):
+        self.results_dir = results_dir
+        # 'parsed', 'skipped' or 'failed'
+        self.status = status
+        self.message = message
+        self.benchmark = benchmark
+        # zbdbench_run columns, without the hostname and username
+        self.run_entry = run_entry
+        self.rows = rows
+
+# Reads and checks the report of a results directory. Does not touch the
+# database, so the runs of a results tree are parsed in a process pool.
+def parse_results_directory(results_dir):
+    benchmark = get_benchmark(results_dir)
+    if benchmark not in collected_benches:
+        return ParsedRun(results_dir, 'skipped', f"The data collection for benchmark '{benchmark}' is not implemented.")
+    bench_module = collected_benches[benchmark]
+    csv_file_path = os.path.join(results_dir, f"{benchmark}.csv")
+    if not os.path.exists(csv_file_path):
+        return ParsedRun(results_dir, 'skipped', f"No {benchmark} report found.")
+
+    try:
+        header, data = read_report(csv_file_path)
+    except (OSError, ValueError, StopIteration) as e:
+        return ParsedRun(results_dir, 'failed', f"Reading the {benchmark} report failed: {e!r}")
+    if header != bench_module.csv_header or any([len(row) != len(header) for row in data]):
+        return ParsedRun(results_dir, 'failed', f"Header expected for the {benchmark} is different form the actuall csv report.")
+
+    run_entry = (get_user_annotation(results_dir),
+                 results_dir,
+                 get_device_serial(results_dir),
+                 get_device_fw(results_dir),
+                 benchmark,
+                 get_benchmark_call(results_dir),
+                 get_zbdbench_version(results_dir),
+                 get_run_content_hash(results_dir, csv_file_path),
+                 get_run_date(results_dir))
+    return ParsedRun(results_dir, 'parsed', f"{len(data)} {benchmark} results", benchmark, run_entry, data)
+
+# Run directories below path, identified by their benchmark.txt
+def find_run_directories(path):
+    return sorted([os.path.dirname(f) for f in glob.glob(os.path.join(path, '**', 'benchmark.txt'), recursive=True)])
 
 class DatabaseConnection(object):
     sqlite_connection = None
@@ -13,10 +212,20 @@ class DatabaseConnection(object):
 
     def __init__(self, db_file_path):
         try:
-            self.sqlite_connection = sqlite3.connect(db_file_path)
-            print("Connected to sqlite db %s - Version %s" % (db_file_path, sqlite3.version))
+            # Transactions are started and committed explicitly
+            self.sqlite_connection = sqlite3.connect(db_file_path, isolation_level=None)
+            print("Connected to sqlite db %s - Version %s" % (db_file_path, sqlite3.sqlite_version))
+            self.sqlite_connection.create_function("zbdbench_normalize", 2, normalize_value)
+            self.sqlite_connection.create_function("zbdbench_bs_to_bytes", 1, bs_to_bytes)
+            self.sqlite_connection.create_function("zbdbench_run_date", 1, get_run_date)
             self.cursor = self.sqlite_connection.cursor()
+            self.hostname = get_hostname()
+            self.username = get_username()
+            # Readers (e.g. plots) are not blocked while results are collected
+            self.cursor.execute("PRAGMA journal_mode=WAL")
+            self.cursor.execute("BEGIN")
             self.create_required_tables_if_not_exists()
+            self.cursor.execute("COMMIT")
         except Error as e:
             print(e)
             if self.cursor:
@@ -26,62 +235,24 @@ class DatabaseConnection(object):
             exit(1)
 
     def __del__(self):
-        if self.sqlite_connection:
-            self.sqlite_connection.commit()
         if self.cursor:
             self.cursor.close()
         if self.sqlite_connection:
             self.sqlite_connection.close()
 
-    def get_hostname(self):
-        return socket.gethostname()
-
-    def get_username(self):
-        return os.getlogin()
-
-    def get_device_info_field(self, results_dir, info_field):
-        device_info_field = "Not found"
-        try:
-            with open(os.path.join(results_dir, "udevadm-info.txt"), 'r') as f:
-                for line in f.readlines():
-                    if info_field in line:
-                        device_info_field = line.split("=")[-1].strip()
-                        break
-        except FileNotFoundError as e:
-            pass
-        return device_info_field
-
-    def get_device_serial(self, results_dir):
-        return self.get_device_info_field(results_dir, "ID_SERIAL=")
-
-    def get_device_fw(self, results_dir):
-        return self.get_device_info_field(results_dir, "ID_REVISION=")
-
-    def get_file_content(self, results_dir, filename):
-        file_content = "Not found"
-        try:
-            with open(os.path.join(results_dir, filename), 'r') as f:
-                file_content = " ".join(f.readlines()).strip()
-        except FileNotFoundError as e:
-            pass
-        return file_content
-
-    def get_benchmark(self, results_dir):
-        return self.get_file_content(results_dir, "benchmark.txt")
-
-    def get_benchmark_call(self, results_dir):
-        return self.get_file_content(results_dir, "benchmark_call.txt")
-
-    def get_zbdbench_version(self, results_dir):
-        return self.get_file_content(results_dir, "zbdbench_version.txt")
-
-    def get_user_annotation(self, results_dir):
-        return self.get_file_content(results_dir, "user_annotation.txt")
-
     def create_required_tables_if_not_exists(self):
         self.create_ZBDBENCH_RUN_table_if_not_exists()
-        self.create_bench_table_if_not_exists(fio_zone_throughput_avg_lat)
-        self.create_bench_table_if_not_exists(fio_steady_state_performance)
+        for bench in collected_benches.values():
+            self.create_bench_table_if_not_exists(bench)
+        self.cursor.execute(f"PRAGMA user_version = {schema_version}")
+
+    def get_schema_version(self):
+        self.cursor.execute("PRAGMA user_version")
+        return self.cursor.fetchone()[0]
+
+    def table_exists(self, table_name):
+        self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+        return self.cursor.fetchone() is not None
 
     #TODO: add benchmark itself in that table
     def create_ZBDBENCH_RUN_table_if_not_exists(self):
@@ -95,16 +266,20 @@ class DatabaseConnection(object):
                      "device_fw text NOT_NULL,"
                      "benchmark text NOT_NULL,"
                      "benchmark_call text NOT_NULL,"
-                     "zbdbench_version text NOT_NULL"
+                     "zbdbench_version text NOT_NULL,"
+                     "content_hash text,"
+                     "run_date text"
                      ");")
         self.cursor.execute(sql_query)
+        self.add_missing_bench_table_columns("zbdbench_run", [("content_hash", "text"), ("run_date", "text")])
+        self.cursor.execute("UPDATE zbdbench_run SET run_date = zbdbench_run_date(result_dir) WHERE run_date IS NULL")
+        self.cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS zbdbench_run_content_hash ON zbdbench_run (content_hash)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS zbdbench_run_device ON zbdbench_run (benchmark, device_serial, device_fw)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS zbdbench_run_date ON zbdbench_run (benchmark, run_date)")
 
-    def create_bench_table_if_not_exists(self, bench):
-        csv_header = bench.csv_header
-        table_fields = (", ".join(["%s text"] * len(csv_header))
-                        % tuple(csv_header))
-        bench_name = bench.__name__.split("benchs.")[-1]
-        sql_query = (f"CREATE TABLE IF NOT EXISTS {bench_name} ("
+    def create_bench_table(self, bench_name, columns, if_not_exists=True):
+        table_fields = ", ".join([f"{name} {column_type}" for name, column_type in columns])
+        sql_query = (f"CREATE TABLE {'IF NOT EXISTS ' if if_not_exists else ''}{bench_name} ("
                      f"id integer PRIMARY KEY,"
                      f"zbdbench_run_id integer NOT NULL,"
                      f"{table_fields},"
@@ -112,6 +287,52 @@ class DatabaseConnection(object):
                      f");")
         self.cursor.execute(sql_query)
 
+    def create_bench_table_if_not_exists(self, bench):
+        bench_name = bench.__name__.split("benchs.")[-1]
+        columns = get_bench_columns(bench)
+        if self.table_exists(bench_name) and self.get_schema_version() < 1:
+            self.migrate_bench_table(bench_name, columns)
+        else:
+            self.create_bench_table(bench_name, columns)
+        self.add_missing_bench_table_columns(bench_name, columns)
+
+        self.cursor.execute(f"CREATE INDEX IF NOT EXISTS {bench_name}_run ON {bench_name} (zbdbench_run_id)")
+        index_columns = [c for c in point_columns if c in [name for name, _ in columns]]
+        if len(index_columns) > 0:
+            self.cursor.execute(f"CREATE INDEX IF NOT EXISTS {bench_name}_point ON {bench_name} ({', '.join(index_columns)}, zbdbench_run_id)")
+
+    # Rebuilds a table of schema version 0 with typed columns
+    def migrate_bench_table(self, bench_name, columns):
+        print(f"Migrating the {bench_name} table to typed columns")
+        self.cursor.execute(f"PRAGMA table_info({bench_name})")
+        old_columns = [row[1] for row in self.cursor.fetchall() if row[1] not in ['id', 'zbdbench_run_id']]
+        # Columns that are no longer reported are kept
+        columns = columns + [(name, 'TEXT') for name in old_columns if name not in [c[0] for c in columns]]
+
+        values = []
+        for name, column_type in columns:
+            if name == 'bs_bytes' and 'bs' in old_columns:
+                values.append("zbdbench_bs_to_bytes(bs)")
+            elif name in old_columns:
+                values.append(f"zbdbench_normalize({name}, '{column_type}')")
+            else:
+                values.append("NULL")
+
+        untyped_name = f"{bench_name}_untyped"
+        self.cursor.execute(f"ALTER TABLE {bench_name} RENAME TO {untyped_name}")
+        self.create_bench_table(bench_name, columns, if_not_exists=False)
+        self.cursor.execute(f"INSERT INTO {bench_name} (id, zbdbench_run_id, {', '.join([c[0] for c in columns])}) "
+                            f"SELECT id, zbdbench_run_id, {', '.join(values)} FROM {untyped_name}")
+        self.cursor.execute(f"DROP TABLE {untyped_name}")
+
+    def add_missing_bench_table_columns(self, bench_name, columns):
+        # Tables created by an older zbdbench version lack newer csv columns
+        self.cursor.execute(f"PRAGMA table_info({bench_name})")
+        existing_columns = [row[1] for row in self.cursor.fetchall()]
+        for column, column_type in columns:
+            if column not in existing_columns:
+                self.cursor.execute(f"ALTER TABLE {bench_name} ADD COLUMN {column} {column_type}")
+
     def insert_entry_into_ZBDBENCH_RUN(self, content):
         sql_query = ("INSERT INTO zbdbench_run("
                      "user_annotation,"
@@ -122,70 +343,96 @@ class DatabaseConnection(object):
                      "device_fw,"
                      "benchmark,"
                      "benchmark_call,"
-                     "zbdbench_version"
+                     "zbdbench_version,"
+                     "content_hash,"
+                     "run_date"
                      ")"
-                     "VALUES(?,?,?,?,?,?,?,?,?)")
+                     "VALUES(?,?,?,?,?,?,?,?,?,?,?)")
         self.cursor.execute(sql_query, content)
         return self.cursor.lastrowid
 
-    def insert_entry_into_bench_table(self, bench, content):
-        csv_header = bench.csv_header
+    # Inserts the rows of a report (without the zbdbench_run_id) at once
+    def insert_entries_into_bench_table(self, bench, zbdbench_run_id, rows):
+        columns = get_bench_columns(bench)
         bench_name = bench.__name__.split("benchs.")[-1]
-        table_fields = (",".join(["%s"] * len(csv_header))
-                        % tuple(csv_header))
-        values_placeholder = ",".join(["?"] * (len(csv_header) + 1))
-        if len(csv_header) + 1 != len(content):
-            print(f"Header mismatch for the {bench_name} content attempted to be added to the DB. Exiting!")
-            exit(1)
+        table_fields = ",".join([name for name, _ in columns])
+        values_placeholder = ",".join(["?"] * (len(columns) + 1))
         sql_query = (f"INSERT INTO {bench_name}("
                      f"zbdbench_run_id,"
                      f"{table_fields}"
                      f")"
                      f"VALUES({values_placeholder})")
-        self.cursor.execute(sql_query, content)
-        return self.cursor.lastrowid
+        self.cursor.executemany(sql_query, [[zbdbench_run_id] + get_bench_row(bench, columns, row) for row in rows])
+
+    def get_collected_run_id(self, content_hash):
+        self.cursor.execute("SELECT id FROM zbdbench_run WHERE content_hash = ?", (content_hash,))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    # Stores a parsed run in one transaction. Returns 'new', 'skipped' (already
+    # collected) or 'failed' and a message.
+    def store_parsed_run(self, parsed_run):
+        if parsed_run.status != 'parsed':
+            return parsed_run.status, parsed_run.message
+
+        annotation, results_dir, serial, fw, benchmark, call, version, content_hash, run_date = parsed_run.run_entry
+        self.cursor.execute("BEGIN")
+        try:
+            collected_run_id = self.get_collected_run_id(content_hash)
+            if collected_run_id is not None:
+                self.cursor.execute("ROLLBACK")
+                return 'skipped', f"The results have already been collected (zbdbench_run id {collected_run_id})."
+
+            zbdbench_run_id = self.insert_entry_into_ZBDBENCH_RUN((annotation, results_dir, self.hostname, self.username,
+                                                                   serial, fw, benchmark, call, version, content_hash, run_date))
+            self.insert_entries_into_bench_table(collected_benches[benchmark], zbdbench_run_id, parsed_run.rows)
+            self.cursor.execute("COMMIT")
+        except Error as e:
+            self.cursor.execute("ROLLBACK")
+            return 'failed', f"Collecting the results failed, nothing collected: {e}"
+        return 'new', f"Collected {parsed_run.message} (zbdbench_run id {zbdbench_run_id})"
 
+    # Collects the csv report of a results directory in one transaction.
+    # Returns False if nothing has been collected.
     def collect_fio_results_from_directory(self, results_dir):
         if not os.path.isdir(results_dir):
             print("Can not collect results from non existing directory '%s'" % results_dir)
             sys.exit(1)
 
-        benchmark = self.get_benchmark(results_dir);
-        #TODO: check if that ZBDBENCH_RUN already exists
-        zbdbench_run_id = self.insert_entry_into_ZBDBENCH_RUN((self.get_user_annotation(results_dir),
-                                                               results_dir,
-                                                               self.get_hostname(),
-                                                               self.get_username(),
-                                                               self.get_device_serial(results_dir),
-                                                               self.get_device_fw(results_dir),
-                                                               benchmark,
-                                                               self.get_benchmark_call(results_dir),
-                                                               self.get_zbdbench_version(results_dir)))
-
-        if benchmark == "fio_zone_throughput_avg_lat":
-            csv_file_path = os.path.join(results_dir, "fio_zone_throughput_avg_lat.csv")
-            bench_module = fio_zone_throughput_avg_lat
-        if benchmark == "fio_steady_state_performance":
-            csv_file_path = os.path.join(results_dir, "fio_steady_state_performance.csv")
-            bench_module = fio_steady_state_performance
+        status, message = self.store_parsed_run(parse_results_directory(results_dir))
+        if status != 'new':
+            print(f"{message} Skipping {results_dir}." if status == 'skipped' else f"{message} Nothing collected from {results_dir}.")
+            return False
+        print(message)
+        return True
+
+    # Collects all runs below path. The reports are parsed in a process pool
+    # and stored through this connection, one transaction per run, so a
+    # broken run does not affect the others. Runs that have already been
+    # collected are skipped. Returns the number of new, skipped and failed
+    # runs.
+    def collect_results_from_tree(self, path):
+        if not os.path.isdir(path):
+            print("Can not collect results from non existing directory '%s'" % path)
+            sys.exit(1)
+
+        run_dirs = find_run_directories(path)
+        summary = {'new': 0, 'skipped': 0, 'failed': 0}
+        if len(run_dirs) >= min_pool_runs:
+            with multiprocessing.Pool() as pool:
+                self.store_parsed_runs(pool.imap_unordered(parse_results_directory, run_dirs, chunksize=4), summary)
         else:
-            #TODO: Remove zbdbench_run_id entry
-            print(f"The data collection for benchmark '{benchmark}' is not implemented. Skipping this step.")
-            exit(0)
-
-        with open(csv_file_path, 'r') as file:
-            try:
-                header = next(csv.reader(file, delimiter=';'))
-                if header != bench_module.csv_header:
-                    print(f"Header expected for the {benchmark} is different form the actuall csv report. Exiting!")
-                    exit(1)
-                data=[tuple(line) for line in csv.reader(file, delimiter=';')]
-                for dataline in data:
-                    content = tuple(str(zbdbench_run_id)) + dataline
-                    self.insert_entry_into_bench_table(bench_module, content)
-            except Error as e:
-                print(e)
+            self.store_parsed_runs(map(parse_results_directory, run_dirs), summary)
+
+        print(f"Collected {len(run_dirs)} runs below {path}: {summary['new']} new, {summary['skipped']} skipped, {summary['failed']} failed")
+        return summary
+
+    def store_parsed_runs(self, parsed_runs, summary):
+        for parsed_run in parsed_runs:
+            status, message = self.store_parsed_run(parsed_run)
+            summary[status] += 1
+            if status != 'new':
+                print(f"  {status.capitalize()} {parsed_run.results_dir}: {message}")
 
 if __name__ == "__main__":
     print("%s is not meant to run as a stand alone script." % os.path.basename(__file__))
-
@@ -0,0 +1,369 @@
+import base64
+import functools
+import glob
+import html
+import json
+import os
+import warnings
+import numpy as np
+
+# Self-contained HTML dashboard of time series (throughput, latency, queue
+# depth, ...) for long runs. The series are not embedded point by point.
+# Each series is reduced to a pyramid of min/max/mean buckets: the finest
+# level has at most dashboard_max_buckets buckets and each coarser level
+# merges pyramid_factor buckets of the level below. The page draws the
+# coarsest level that still has about one bucket per pixel of the visible
+# range, so a multi-million point log stays zoomable in the browser.
+dashboard_max_buckets = 1 << 14
+pyramid_factor = 4
+# Coarsest level
+pyramid_min_buckets = 512
+# Series per panel, which keeps the page size bounded for runs with many logs
+dashboard_max_series = 16
+# Width of the buckets before any merge, the resolution of fio logs
+base_bucket_sec = 0.001
+
+# Min/max/mean of a series in buckets of equal width, built while streaming
+# over the chunks of a log. When a sample falls beyond dashboard_max_buckets
+# buckets, neighbouring buckets are merged and the width is doubled.
+class SeriesPyramid(object):
+    def __init__(self, max_buckets=dashboard_max_buckets):
+        self.max_buckets = max_buckets
+        self.start_sec = None
+        self.width_sec = base_bucket_sec
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.totals = np.zeros(0)
+        self.mins = np.zeros(0)
+        self.maxs = np.zeros(0)
+
+    def merge_buckets(self):
+        if len(self.counts) % 2 == 1:
+            self.grow(len(self.counts) + 1)
+        self.counts = self.counts[0::2] + self.counts[1::2]
+        self.totals = self.totals[0::2] + self.totals[1::2]
+        self.mins = np.fmin(self.mins[0::2], self.mins[1::2])
+        self.maxs = np.fmax(self.maxs[0::2], self.maxs[1::2])
+        self.width_sec *= 2
+
+    def grow(self, nr_buckets):
+        extra = nr_buckets - len(self.counts)
+        if extra <= 0:
+            return
+        self.counts = np.concatenate((self.counts, np.zeros(extra, dtype=np.int64)))
+        self.totals = np.concatenate((self.totals, np.zeros(extra)))
+        self.mins = np.concatenate((self.mins, np.full(extra, np.nan)))
+        self.maxs = np.concatenate((self.maxs, np.full(extra, np.nan)))
+
+    def add(self, times_sec, values):
+        times_sec = np.asarray(times_sec, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if len(times_sec) == 0:
+            return
+        if self.start_sec is None:
+            self.start_sec = float(np.min(times_sec))
+        buckets = np.maximum(np.floor((times_sec - self.start_sec) / self.width_sec), 0).astype(np.int64)
+        while buckets.max() >= self.max_buckets:
+            self.merge_buckets()
+            buckets >>= 1
+        self.grow(int(buckets.max()) + 1)
+
+        order = np.argsort(buckets, kind='stable')
+        buckets, values = buckets[order], values[order]
+        starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+        indices = buckets[starts]
+        self.counts[indices] += np.diff(np.append(starts, len(buckets)))
+        self.totals[indices] += np.add.reduceat(values, starts)
+        self.mins[indices] = np.fmin(self.mins[indices], np.minimum.reduceat(values, starts))
+        self.maxs[indices] = np.fmax(self.maxs[indices], np.maximum.reduceat(values, starts))
+
+    # Levels from the finest to the coarsest as (bucket width, mins, maxs,
+    # means). Empty buckets are NaN.
+    def get_levels(self):
+        counts, totals, mins, maxs = self.counts, self.totals, self.mins, self.maxs
+        width_sec = self.width_sec
+        levels = []
+        while True:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means = np.where(counts > 0, totals / np.maximum(counts, 1), np.nan)
+            levels.append((width_sec, mins, maxs, means))
+            if len(counts) <= pyramid_min_buckets:
+                return levels
+            pad = -len(counts) % pyramid_factor
+            counts = np.concatenate((counts, np.zeros(pad, dtype=np.int64))).reshape(-1, pyramid_factor).sum(axis=1)
+            totals = np.concatenate((totals, np.zeros(pad))).reshape(-1, pyramid_factor).sum(axis=1)
+            with warnings.catch_warnings():
+                # Buckets without samples stay NaN
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                mins = np.nanmin(np.concatenate((mins, np.full(pad, np.nan))).reshape(-1, pyramid_factor), axis=1)
+                maxs = np.nanmax(np.concatenate((maxs, np.full(pad, np.nan))).reshape(-1, pyramid_factor), axis=1)
+            width_sec *= pyramid_factor
+
+def encode_array(values):
+    return base64.b64encode(np.asarray(values, dtype='<f4').tobytes()).decode()
+
+# Series of a panel as (label, SeriesPyramid) in a form that is pickled and
+# hashed cheaply: (label, start_sec, [(width_sec, mins, maxs, means), ...])
+def get_panel_series(series):
+    return [(label, pyramid.start_sec, pyramid.get_levels()) for label, pyramid in series if pyramid.start_sec is not None]
+
+# The series of a panel are listed as (name, load), where load() reads the
+# series into a SeriesPyramid. Only the series that are shown are read, so the
+# logs beyond dashboard_max_series of a panel are not decoded.
+
+def load_fio_log_pyramid(log_file, scale):
+    from benchs.fio_log import read_fio_log_chunks
+    from benchs.lat_trace import read_lat_trace_chunks, lat_trace_suffix
+    pyramid = SeriesPyramid()
+    reader = read_lat_trace_chunks if log_file.endswith(lat_trace_suffix) else read_fio_log_chunks
+    for chunk in reader(log_file):
+        times_ms, values = chunk[0], chunk[1]
+        pyramid.add(times_ms / 1000, values * scale)
+    return pyramid
+
+# fio logs of a kind (e.g. 'bw' or 'clat') in a run directory, one per job
+# log, from the latency traces if the logs have been converted
+def get_fio_log_series(path, kind, scale=1):
+    from benchs.lat_trace import lat_trace_suffix
+    log_files = sorted(glob.glob(os.path.join(path, f"*_{kind}.*.log")) + glob.glob(os.path.join(path, f"*_{kind}.*{lat_trace_suffix}")))
+    return [(os.path.splitext(os.path.basename(f))[0], functools.partial(load_fio_log_pyramid, f, scale)) for f in log_files]
+
+def load_telemetry_pyramid(path, devname, column, scale):
+    from benchs.telemetry import load_telemetry, telemetry_header
+    pyramid = SeriesPyramid()
+    telemetry = load_telemetry(path, devname)
+    if telemetry is not None and len(telemetry) > 0:
+        pyramid.add(telemetry[:, telemetry_header.index('time_sec')], telemetry[:, telemetry_header.index(column)] * scale)
+    return pyramid
+
+# A column of the block device telemetry of a run directory, one series per
+# device
+def get_telemetry_series(path, column, scale=1):
+    devnames = sorted(set([os.path.basename(os.path.splitext(f)[0])[len("telemetry-"):] for f in glob.glob(os.path.join(path, "telemetry-*.*"))]))
+    return [(devname, functools.partial(load_telemetry_pyramid, path, devname, column, scale)) for devname in devnames]
+
+def load_rocksdb_stats_pyramid(stats_file, columns):
+    pyramid = SeriesPyramid()
+    data = np.genfromtxt(stats_file, delimiter=',', skip_header=1, usecols=columns, ndmin=2)
+    pyramid.add(data[:, 0], data[:, 1])
+    return pyramid
+
+# A column of the RocksDB statistics time series of a run directory (see
+# benchs/rocksdb_stats.py), one series per db_bench run
+def get_rocksdb_stats_series(path, column):
+    from benchs.rocksdb_stats import stats_series_suffix
+    series = []
+    for stats_file in sorted(glob.glob(os.path.join(path, "*" + stats_series_suffix))):
+        with open(stats_file, 'r') as f:
+            header = f.readline().strip().split(',')
+        if column not in header:
+            continue
+        columns = (header.index('uptime_sec'), header.index(column))
+        series.append((os.path.basename(stats_file)[:-len(stats_series_suffix)], functools.partial(load_rocksdb_stats_pyramid, stats_file, columns)))
+    return series
+
+def load_db_bench_interval_pyramid(series_file):
+    from benchs.rocksdb_stats import read_interval_series
+    pyramid = SeriesPyramid()
+    intervals = read_interval_series(series_file)
+    if len(intervals) > 0:
+        pyramid.add(np.array([t for t, _ in intervals]), np.array([qps for _, qps in intervals]))
+    return pyramid
+
+# Throughput of each second of the db_bench runs of a run directory (see
+# benchs/rocksdb_stats.py), one series per db_bench run
+def get_db_bench_interval_series(path):
+    from benchs.rocksdb_stats import interval_series_suffix
+    series_files = sorted(glob.glob(os.path.join(path, "*" + interval_series_suffix)))
+    return [(os.path.basename(f)[:-len(interval_series_suffix)], functools.partial(load_db_bench_interval_pyramid, f)) for f in series_files]
+
+# Panels of a run directory as (title, [(label, load)])
+def get_run_panels(path, label=None):
+    prefix = "" if label is None else f"{label} "
+    panels = [("Device write throughput [MB/s]", get_telemetry_series(path, 'write_kBps', 1 / 1000)),
+              ("Device read throughput [MB/s]", get_telemetry_series(path, 'read_kBps', 1 / 1000)),
+              ("Device queue depth", get_telemetry_series(path, 'avg_queue_depth')),
+              ("fio bandwidth [MiB/s]", get_fio_log_series(path, 'bw', 1 / 1024)),
+              ("fio completion latency [us]", get_fio_log_series(path, 'clat', 1 / 1000)),
+              ("db_bench throughput [ops/s]", get_db_bench_interval_series(path)),
+              ("RocksDB write stall per interval [%]", get_rocksdb_stats_series(path, 'interval_stall_pct')),
+              ("RocksDB L0 files", get_rocksdb_stats_series(path, 'L0_files'))]
+    return [(title, [(prefix + name, load) for name, load in series]) for title, series in panels]
+
+# Merges the panels of several runs by title and reads the series that are
+# shown
+def merge_panels(runs_panels):
+    merged = {}
+    for panels in runs_panels:
+        for title, series in panels:
+            merged.setdefault(title, []).extend(series)
+    panels = []
+    for title, series in merged.items():
+        if len(series) > dashboard_max_series:
+            print(f"  Only the first {dashboard_max_series} of {len(series)} series of the dashboard panel '{title}' are shown")
+            del series[dashboard_max_series:]
+        panel_series = get_panel_series([(label, load()) for label, load in series])
+        if len(panel_series) > 0:
+            panels.append((title, panel_series))
+    return panels
+
+def write_dashboard(filename, title, panels):
+    data = []
+    for panel_title, series in panels:
+        data.append({'title': panel_title,
+                     'series': [{'label': label, 'start': start_sec,
+                                 'levels': [{'width': width_sec, 'min': encode_array(mins), 'max': encode_array(maxs), 'mean': encode_array(means)}
+                                            for width_sec, mins, maxs, means in levels]}
+                                for label, start_sec, levels in series]})
+    with open(filename, 'w') as f:
+        f.write(dashboard_template.replace('%TITLE%', html.escape(title)).replace('%DATA%', json.dumps(data).replace('</', '<\\/')))
+
+dashboard_template = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>%TITLE%</title>
+<style>
+body { font-family: sans-serif; margin: 1em; }
+.panel { margin-bottom: 1.5em; }
+.panel h3 { margin: 0.2em 0; }
+canvas { border: 1px solid #ccc; width: 100%; height: 300px; cursor: crosshair; }
+.legend span { margin-right: 1em; white-space: nowrap; }
+.legend i { display: inline-block; width: 1em; height: 0.6em; margin-right: 0.3em; }
+</style></head>
+<body>
+<h2>%TITLE%</h2>
+<p>Drag to zoom, mouse wheel to zoom around the cursor, double click to reset. The line is the mean and the band the min/max of each bucket.</p>
+<div id="panels"></div>
+<script>
+const data = %DATA%;
+const colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf'];
+
+function decode(b64) {
+  const bytes = Uint8Array.from(atob(b64), c => c.charCodeAt(0));
+  return new Float32Array(bytes.buffer);
+}
+
+function Panel(panel) {
+  const div = document.createElement('div');
+  div.className = 'panel';
+  div.innerHTML = '<h3></h3><canvas></canvas><div class="legend"></div>';
+  div.querySelector('h3').textContent = panel.title;
+  document.getElementById('panels').appendChild(div);
+  const canvas = div.querySelector('canvas');
+  const legend = div.querySelector('.legend');
+  const series = panel.series.map((s, i) => ({
+    label: s.label, start: s.start, color: colors[i % colors.length],
+    levels: s.levels.map(l => ({width: l.width, min: decode(l.min), max: decode(l.max), mean: decode(l.mean)}))
+  }));
+  series.forEach(s => {
+    const span = document.createElement('span');
+    span.innerHTML = '<i></i>';
+    span.querySelector('i').style.background = s.color;
+    span.appendChild(document.createTextNode(s.label));
+    legend.appendChild(span);
+  });
+  const fullStart = Math.min(...series.map(s => s.start));
+  const fullEnd = Math.max(...series.map(s => s.start + s.levels[0].width * s.levels[0].mean.length));
+  let view = [fullStart, fullEnd];
+  let drag = null;
+  const margin = {left: 60, right: 10, top: 10, bottom: 25};
+
+  // Coarsest level with at least one bucket per pixel in the view
+  function pickLevel(s, pixels) {
+    for (let i = s.levels.length - 1; i >= 0; i--) {
+      if ((view[1] - view[0]) / s.levels[i].width >= pixels) return s.levels[i];
+    }
+    return s.levels[0];
+  }
+
+  function draw() {
+    const dpr = window.devicePixelRatio || 1;
+    canvas.width = canvas.clientWidth * dpr;
+    canvas.height = canvas.clientHeight * dpr;
+    const ctx = canvas.getContext('2d');
+    ctx.scale(dpr, dpr);
+    const w = canvas.clientWidth - margin.left - margin.right;
+    const h = canvas.clientHeight - margin.top - margin.bottom;
+    const visible = series.map(s => {
+      const l = pickLevel(s, w);
+      const first = Math.max(0, Math.floor((view[0] - s.start) / l.width));
+      const last = Math.min(l.mean.length, Math.ceil((view[1] - s.start) / l.width) + 1);
+      return {s: s, l: l, first: first, last: last};
+    });
+    let ymin = Infinity, ymax = -Infinity;
+    visible.forEach(v => {
+      for (let i = v.first; i < v.last; i++) {
+        if (!isNaN(v.l.min[i])) { ymin = Math.min(ymin, v.l.min[i]); ymax = Math.max(ymax, v.l.max[i]); }
+      }
+    });
+    if (!isFinite(ymin)) { ymin = 0; ymax = 1; }
+    ymin = Math.min(ymin, 0);
+    if (ymax <= ymin) ymax = ymin + 1;
+    const x = t => margin.left + (t - view[0]) / (view[1] - view[0]) * w;
+    const y = v => margin.top + h - (v - ymin) / (ymax - ymin) * h;
+
+    ctx.font = '11px sans-serif';
+    ctx.strokeStyle = '#ddd';
+    ctx.fillStyle = '#333';
+    for (let i = 0; i <= 5; i++) {
+      const v = ymin + (ymax - ymin) * i / 5;
+      ctx.beginPath(); ctx.moveTo(margin.left, y(v)); ctx.lineTo(margin.left + w, y(v)); ctx.stroke();
+      ctx.fillText(v.toPrecision(4), 2, y(v) + 4);
+      const t = view[0] + (view[1] - view[0]) * i / 5;
+      ctx.fillText(t.toFixed(1) + ' s', Math.min(x(t), margin.left + w - 40), margin.top + h + 15);
+    }
+    ctx.save();
+    ctx.beginPath(); ctx.rect(margin.left, margin.top, w, h); ctx.clip();
+    visible.forEach(v => {
+      const l = v.l, s = v.s;
+      ctx.fillStyle = s.color;
+      ctx.globalAlpha = 0.25;
+      for (let i = v.first; i < v.last; i++) {
+        if (isNaN(l.min[i])) continue;
+        const x0 = x(s.start + i * l.width);
+        ctx.fillRect(x0, y(l.max[i]), Math.max(1, x(s.start + (i + 1) * l.width) - x0), Math.max(1, y(l.min[i]) - y(l.max[i])));
+      }
+      ctx.globalAlpha = 1;
+      ctx.strokeStyle = s.color;
+      ctx.beginPath();
+      let pen = false;
+      for (let i = v.first; i < v.last; i++) {
+        if (isNaN(l.mean[i])) { pen = false; continue; }
+        const px = x(s.start + (i + 0.5) * l.width), py = y(l.mean[i]);
+        if (pen) ctx.lineTo(px, py); else ctx.moveTo(px, py);
+        pen = true;
+      }
+      ctx.stroke();
+    });
+    ctx.restore();
+    if (drag && drag.to !== undefined) {
+      ctx.fillStyle = 'rgba(0, 0, 0, 0.1)';
+      ctx.fillRect(Math.min(drag.from, drag.to), margin.top, Math.abs(drag.to - drag.from), h);
+    }
+  }
+
+  function timeAt(event) {
+    const rect = canvas.getBoundingClientRect();
+    const w = canvas.clientWidth - margin.left - margin.right;
+    return view[0] + (event.clientX - rect.left - margin.left) / w * (view[1] - view[0]);
+  }
+  canvas.addEventListener('mousedown', e => { drag = {from: e.offsetX, t0: timeAt(e)}; });
+  canvas.addEventListener('mousemove', e => { if (drag) { drag.to = e.offsetX; draw(); } });
+  canvas.addEventListener('mouseup', e => {
+    const t1 = timeAt(e);
+    if (drag && Math.abs(e.offsetX - drag.from) > 3) view = [Math.min(drag.t0, t1), Math.max(drag.t0, t1)];
+    drag = null;
+    draw();
+  });
+  canvas.addEventListener('dblclick', () => { view = [fullStart, fullEnd]; draw(); });
+  canvas.addEventListener('wheel', e => {
+    e.preventDefault();
+    const t = timeAt(e), f = e.deltaY > 0 ? 1.25 : 0.8;
+    view = [Math.max(fullStart, t - (t - view[0]) * f), Math.min(fullEnd, t + (view[1] - t) * f)];
+    draw();
+  });
+  window.addEventListener('resize', draw);
+  draw();
+}
+
+data.forEach(Panel);
+</script>
+</body></html>
+"""
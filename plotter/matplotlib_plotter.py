@@ -1,20 +1,61 @@
 #!/usr/bin/env python3
 import csv
+import json
+import multiprocessing
 import os
 import sys
 import pandas as pd
 import numpy as np
+import matplotlib
+# Plots are only saved to files, also from the worker processes
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import hashlib
 from itertools import groupby
 from benchs import fio_steady_state_performance
+from benchs import zbd
+from benchs import columnar
+from benchs import repetition
+from benchs import rocksdb_stats
+from plotter import sqlite_source
+
+# Hashes of the inputs of each plot and table in a plot directory. An
+# artifact is only drawn again if its input hash changed (or the plotter
+# itself changed) or its files are missing.
+plot_hashes_file = ".plot-hashes.json"
+
+def update_input_hash(h, value):
+    if isinstance(value, np.ndarray):
+        h.update(f"{value.dtype}{value.shape}".encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        h.update(f"{type(value).__name__}{len(value)}".encode())
+        for v in value:
+            update_input_hash(h, v)
+    elif isinstance(value, dict):
+        update_input_hash(h, list(value.items()))
+    else:
+        h.update(repr(value).encode())
+
+def get_plotter_hash():
+    with open(__file__, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+# Draws an artifact in a worker process. Module level so it can be pickled.
+def render_artifact(plot, draw, args):
+    plot.reset_plot()
+    getattr(plot, draw)(*args)
 
 # Generic Plot class that supplies rudimentary matplotlib helper functions
 # Inspired by https://stackoverflow.com/questions/54965009/grouped-x-axis-variability-plot-in-python
 class Plot(object):
-    #TODO: Optionally use the data_collector as the plot source
+    # csv_files is a list of csv reports or a sqlite_source.SqlitePlotSource
     def __init__(self, output_base, csv_files):
         self.header = []
+        self.source = None
+        if isinstance(csv_files, sqlite_source.SqlitePlotSource):
+            self.source = csv_files
+            csv_files = []
         if not isinstance(csv_files, list):
             csv_files = [csv_files]
         self.csv_files = csv_files
@@ -28,15 +69,66 @@ class Plot(object):
                     print("The headers of the given csv_files are not compatible with each other. Exiting.")
                     exit(1)
 
-        desc = '\n'.join(self.csv_files)
+        desc = self.source.describe() if self.source is not None else '\n'.join(self.csv_files)
         desc_hash = hashlib.sha1(desc.encode()).hexdigest()[:10]
         self.output_dir = os.path.join(output_base, f"plot-{desc_hash}")
         if not os.path.exists(self.output_dir):
-            os.mkdir(self.output_dir)
+            os.makedirs(self.output_dir)
             with open(os.path.join(self.output_dir, 'plot-description.txt'), 'a') as comp_desc_file:
                 comp_desc_file.write(desc)
         else:
-            print(f"  Plots already exist. Overwriting the plots in {self.output_dir}.")
+            print(f"  Plots already exist. Updating the changed plots in {self.output_dir}.")
+        self.pending_artifacts = []
+
+    # The database connection of the source stays in the parent process
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['source'] = None
+        state['pending_artifacts'] = []
+        return state
+
+    def load_artifact_hashes(self):
+        try:
+            with open(os.path.join(self.output_dir, plot_hashes_file), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    # Queues draw (the name of a method of this class) with args, which
+    # writes the files of an artifact to the output directory. It is skipped
+    # if its inputs did not change since the files were written.
+    def add_artifact(self, filenames, draw, *args):
+        h = hashlib.sha1(get_plotter_hash().encode())
+        update_input_hash(h, [draw, os.getenv('PLOT_TITLE'), args])
+        input_hash = h.hexdigest()
+        hashes = self.load_artifact_hashes()
+        if all([hashes.get(f) == input_hash and os.path.exists(os.path.join(self.output_dir, f)) for f in filenames]):
+            print(f"Unchanged, skipping {', '.join([os.path.join(self.output_dir, f) for f in filenames])}")
+            return
+        self.pending_artifacts.append((filenames, draw, args, input_hash))
+
+    # Draws the queued artifacts, in a process pool if there are several
+    def render(self):
+        if len(self.pending_artifacts) == 0:
+            return
+        tasks = [(self, draw, args) for _, draw, args, _ in self.pending_artifacts]
+        processes = min(len(tasks), os.cpu_count() or 1)
+        if processes > 1:
+            with multiprocessing.Pool(processes) as pool:
+                pool.starmap(render_artifact, tasks)
+        else:
+            for task in tasks:
+                render_artifact(*task)
+
+        hashes = self.load_artifact_hashes()
+        for filenames, _, _, input_hash in self.pending_artifacts:
+            for f in filenames:
+                hashes[f] = input_hash
+        self.pending_artifacts = []
+        tmp_file = os.path.join(self.output_dir, plot_hashes_file + ".tmp")
+        with open(tmp_file, 'w') as f:
+            json.dump(hashes, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, os.path.join(self.output_dir, plot_hashes_file))
 
     def reset_plot(self):
         plt.cla()
@@ -92,18 +184,49 @@ class Plot(object):
     def get_user_annotation(self, results_dir):
         return self.get_file_content(results_dir, "user_annotation.txt")
 
+    # Loads a report from its typed columnar copy if it is up to date, and
+    # parses the csv otherwise (e.g. for results of older versions)
+    def load_table(self, csv_file, delimiter):
+        columns = columnar.read_columnar(csv_file)
+        if columns is None:
+            return pd.read_csv(csv_file, delimiter=delimiter)
+        return pd.DataFrame(columns)
+
+    # Labels of the runs selected from the database. Runs with the same
+    # annotation get the id of the run appended.
+    def get_run_labels(self, run_ids, annotations):
+        runs = dict(zip(run_ids, annotations))
+        return {i: a if annotations.count(a) == 1 else f"{a} ({i})" for i, a in runs.items()}
+
+    # Write throughput series of fio_steady_state_performance runs as
+    # (label, throughput in kB/s)
+    def get_steady_state_series(self):
+        if self.source is None:
+            return [(str(self.get_user_annotation(os.path.dirname(csv_file))), self.load_table(csv_file, ';')['write_bw_kB'])
+                    for csv_file in self.csv_files]
+
+        run_filter, params = self.source.get_run_filter()
+        df = self.source.read_frame("SELECT r.id AS run_id, r.user_annotation AS annotation, t.write_bw_kB AS write_bw_kB "
+                                    "FROM fio_steady_state_performance t JOIN zbdbench_run r ON r.id = t.zbdbench_run_id "
+                                    f"WHERE {run_filter} ORDER BY r.id, t.time_sec", params)
+        runs = df.drop_duplicates(subset=['run_id'])
+        labels = self.get_run_labels(runs['run_id'].tolist(), runs['annotation'].tolist())
+        return [(labels[run_id], run['write_bw_kB']) for run_id, run in df.groupby('run_id', sort=True)]
+
     def gen_FIO_STEADY_STATE_PERFORMANCE(self):
-        self.reset_plot()
         datapoints = {}
         time_step_sec = fio_steady_state_performance.log_interval_sec
         max_data_points = 0
 
         #Collect all datapoints in GB/s
-        for csv_file in self.csv_files:
-            max_data_points = max(max_data_points, sum(1 for _ in open(csv_file)) - 1)
-            tmp = pd.read_csv(csv_file, delimiter = ';')['write_bw_kB'].values.tolist()
-            data = [float(x/1000000.0) for x in tmp]
-            datapoints[str(self.get_user_annotation(os.path.dirname(csv_file)))] = data
+        for label, write_bw_kB in self.get_steady_state_series():
+            data = (write_bw_kB / 1000000.0).tolist()
+            max_data_points = max(max_data_points, len(data))
+            datapoints[label] = data
+
+        if max_data_points == 0:
+            print("Skipping the steady state performance plot because there is no data for it.")
+            return
 
         #Extend smaller data vectors
         for key, value in datapoints.items():
@@ -111,7 +234,10 @@ class Plot(object):
                 value.extend([np.nan]*(max_data_points - len(value)))
                 datapoints[key] = value
 
-        datapoints['time_sec'] = range(time_step_sec,(time_step_sec*max_data_points + 1),time_step_sec)
+        datapoints['time_sec'] = list(range(time_step_sec,(time_step_sec*max_data_points + 1),time_step_sec))
+        self.add_artifact(["steady-state-performance.pdf"], 'generate_graph_FIO_STEADY_STATE_PERFORMANCE', datapoints)
+
+    def generate_graph_FIO_STEADY_STATE_PERFORMANCE(self, datapoints):
         df = pd.DataFrame(datapoints)
         df = df.set_index(['time_sec'])
         ax = df.plot(figsize=(8,7))
@@ -121,58 +247,136 @@ class Plot(object):
         self.check_env_and_set_title(ax, "Sequential Fill + 2x Device Capacity Random Overwrite @ 64KiB, QD 16")
         self.save_graph_plt_in_output_dir(f"steady-state-performance.pdf")
 
+    # Runs of the dashboard as (results directory, label)
+    def get_dashboard_runs(self):
+        return [(os.path.dirname(f), str(self.get_user_annotation(os.path.dirname(f)))) for f in self.csv_files]
+
+    # Zoomable HTML dashboard (dashboard.html) of the device telemetry and the
+    # fio bandwidth and latency logs of the runs
+    def gen_DASHBOARD(self):
+        from plotter import dashboard
+        if self.source is not None:
+            print("Skipping the dashboard because the results database holds no time series.")
+            return
+        panels = dashboard.merge_panels([dashboard.get_run_panels(path, label) for path, label in self.get_dashboard_runs()])
+        if len(panels) == 0:
+            print("Skipping the dashboard because there are no time series.")
+            return
+        self.add_artifact(["dashboard.html"], 'generate_DASHBOARD', panels)
+
+    def generate_DASHBOARD(self, panels):
+        from plotter import dashboard
+        filename = os.path.join(self.output_dir, "dashboard.html")
+        print(f"Saving {filename}")
+        dashboard.write_dashboard(filename, os.getenv('PLOT_TITLE') or f"zbdbench {os.path.basename(os.path.normpath(self.output_dir))}", panels)
+
+    # Points of an operation of fio_zone_throughput_avg_lat runs as (label,
+    # frame with the columns bs, iodepth, numjobs, throughput_kb, ci_kb and
+    # latency_us)
+    def get_throughput_points(self, operation):
+        direction = 'read' if 'read' in operation else 'write'
+        if self.source is not None:
+            return self.get_collected_throughput_points(operation, direction)
+
+        points = []
+        for csv_file in self.csv_files:
+            df = self.load_table(csv_file, ';')
+            df = df[df['rw'] == operation]
+            if 'pruned' in df.columns:
+                df = df[df['pruned'] != 'yes']
+            throughput_column = f"{direction}_bandwidth_kb"
+            latency_column = f"{direction}_clat_mean_us"
+            ci = np.zeros(len(df))
+            if len(df) > 0 and 'rep_runs' in df.columns and pd.to_numeric(df['rep_runs'], errors='coerce').notna().all():
+                # Each run of a point holds the statistics over all its runs
+                df = df.drop_duplicates(subset=['bs', 'iodepth', 'numjobs'])
+                throughput_column = 'rep_bw_mean_kb'
+                latency_column = 'rep_clat_mean_us'
+                ci = pd.to_numeric(df['rep_bw_ci95_kb'], errors='coerce').fillna(0).to_numpy()
+            points.append((self.get_user_annotation(os.path.dirname(csv_file)),
+                           pd.DataFrame({'bs': df['bs'].to_numpy(),
+                                         'iodepth': df['iodepth'].astype(int).to_numpy(),
+                                         'numjobs': df['numjobs'].astype(int).to_numpy(),
+                                         'throughput_kb': df[throughput_column].astype(float).to_numpy(),
+                                         'ci_kb': ci,
+                                         'latency_us': df[latency_column].astype(float).to_numpy()})))
+        return points
+
+    # Points aggregated in SQL over all collected runs with the same
+    # annotation. Each run of a repeated point is a sample of the mean.
+    def get_collected_throughput_points(self, operation, direction):
+        run_filter, params = self.source.get_run_filter()
+        throughput_column = f"{direction}_bandwidth_kb"
+        pruned_filter = "AND coalesce(t.pruned, '') != 'yes' " if 'pruned' in self.source.get_table_columns('fio_zone_throughput_avg_lat') else ""
+        df = self.source.read_frame("SELECT r.user_annotation AS label, t.bs AS bs, t.iodepth AS iodepth, t.numjobs AS numjobs, "
+                                    f"count(*) AS samples, avg(t.{throughput_column}) AS throughput_kb, "
+                                    f"avg(t.{throughput_column} * t.{throughput_column}) AS throughput_sq_kb, "
+                                    f"avg(t.{direction}_clat_mean_us) AS latency_us "
+                                    "FROM fio_zone_throughput_avg_lat t JOIN zbdbench_run r ON r.id = t.zbdbench_run_id "
+                                    f"WHERE t.rw = ? AND t.{throughput_column} IS NOT NULL {pruned_filter}AND {run_filter} "
+                                    "GROUP BY r.user_annotation, t.bs_bytes, t.bs, t.iodepth, t.numjobs "
+                                    "ORDER BY r.user_annotation, t.bs_bytes, t.iodepth, t.numjobs", [operation] + params)
+        df['ci_kb'] = [repetition.summarize_moments(n, m, sq)[2] or 0.0
+                       for n, m, sq in zip(df['samples'], df['throughput_kb'], df['throughput_sq_kb'])]
+        df['iodepth'] = df['iodepth'].astype(int)
+        df['numjobs'] = df['numjobs'].astype(int)
+        return [(label, points.reset_index(drop=True)) for label, points in df.groupby('label', sort=True)]
+
     def gen_FIO_ZONE_THROUGHPUT_AVG_LAT(self, operation):
-        self.reset_plot()
-        number_datapoints = len(self.csv_files)
+        datasets = self.get_throughput_points(operation)
+        number_datapoints = len(datasets)
         parallel_requests = []
         parallel_label = 'Number of Jobs'
         block_sizes = []
         benchmarking_labels = []
         throughput = []
+        throughput_ci = []
         latency = []
         max_throughput = 0
         min_throughput = sys.maxsize
-        for csv_file in self.csv_files:
-            with open(csv_file, 'r') as f:
-                d_reader = csv.DictReader(f, delimiter=";")
-                for row in d_reader:
-                    if row['rw'] != operation:
-                        continue
-                    benchmarking_labels.append(self.get_user_annotation(os.path.dirname(csv_file)))
-                    #TODO: Include the unit of BS -> The graph and table should be sorted correctly.
-                    block_sizes.append(int(row['bs'][:-1]))
-                    if operation == 'randread':
-                        parallel_requests.append(int(row['iodepth']))
-                        parallel_label = 'Queue Depth'
-                    else:
-                        parallel_requests.append(int(row['numjobs']))
-                    if 'read' in operation:
-                        tp = float(row['read_bandwidth_kb'])/1024.0
-                        lat = float(row['read_clat_mean_us'])
-                    else:
-                        tp = float(row['write_bandwidth_kb'])/1024.0
-                        lat = float(row['write_clat_mean_us'])
-                    throughput.append(tp)
-                    latency.append(lat)
-                    max_throughput = max(tp, max_throughput)
-                    min_throughput = min(tp, min_throughput)
+        for label, df in datasets:
+            if len(df) == 0:
+                continue
+            benchmarking_labels.extend([label] * len(df))
+            #TODO: Include the unit of BS -> The graph and table should be sorted correctly.
+            block_sizes.extend([int(bs[:-1]) for bs in df['bs']])
+            if operation == 'randread':
+                parallel_requests.extend(df['iodepth'].tolist())
+                parallel_label = 'Queue Depth'
+            else:
+                parallel_requests.extend(df['numjobs'].tolist())
+            tp = (df['throughput_kb'] / 1024.0).tolist()
+            ci = (df['ci_kb'] / 1024.0).tolist()
+            throughput.extend(tp)
+            throughput_ci.extend(ci)
+            latency.extend(df['latency_us'].tolist())
+            max_throughput = max(max([t + c for t, c in zip(tp, ci)]), max_throughput)
+            min_throughput = min(min([t - c for t, c in zip(tp, ci)]), min_throughput)
 
         if len(throughput) == 0:
             print(f"Skipping plot for fio {operation} workload because there is data for it.")
             return
-        self.generate_graph_FIO_ZONE_THROUGHPUT_AVG_LAT(parallel_label, parallel_requests, block_sizes, benchmarking_labels, operation, throughput, min_throughput, max_throughput, number_datapoints)
-        self.generate_table_FIO_ZONE_THROUGHPUT_AVG_LAT(parallel_label, parallel_requests, block_sizes, benchmarking_labels, operation, latency)
+        self.add_artifact([f"throughput-graph-{operation}.pdf"], 'generate_graph_FIO_ZONE_THROUGHPUT_AVG_LAT',
+                          parallel_label, parallel_requests, block_sizes, benchmarking_labels, operation, throughput, min_throughput, max_throughput, number_datapoints, throughput_ci)
+        self.add_artifact([f"latency-table-{operation}.{ext}" for ext in ['tex', 'xlsx', 'html']], 'generate_table_FIO_ZONE_THROUGHPUT_AVG_LAT',
+                          parallel_label, parallel_requests, block_sizes, benchmarking_labels, operation, latency)
 
-    def generate_graph_FIO_ZONE_THROUGHPUT_AVG_LAT(self, parallel_label, parallel_requests, block_sizes, benchmarking_labels, operation, throughput, min_throughput, max_throughput, number_datapoints):
+    def generate_graph_FIO_ZONE_THROUGHPUT_AVG_LAT(self, parallel_label, parallel_requests, block_sizes, benchmarking_labels, operation, throughput, min_throughput, max_throughput, number_datapoints, throughput_ci=None):
+        if throughput_ci is None:
+            throughput_ci = [0.0] * len(throughput)
         df = pd.DataFrame({'parallel_request':parallel_requests,
                         'block_size_group':block_sizes,
                         'Label':benchmarking_labels,
-                        'Data':throughput})
-        df = df.set_index(['block_size_group','parallel_request','Label'])['Data'].unstack()
+                        'Data':throughput,
+                        'CI':throughput_ci})
+        df = df.set_index(['block_size_group','parallel_request','Label'])
+        # Error bars of the 95% confidence interval of repeated runs
+        yerr = df['CI'].unstack() if any([c > 0 for c in throughput_ci]) else None
+        df = df['Data'].unstack()
         min_throughput -= 20
         if min_throughput < 0:
             min_throughput = 0
-        ax = df.plot.bar(xlim=(-.5, (len(benchmarking_labels)/number_datapoints)-0.5), ylim=(min_throughput, max_throughput + 200), figsize=(15,7.5))
+        ax = df.plot.bar(xlim=(-.5, (len(benchmarking_labels)/number_datapoints)-0.5), ylim=(min_throughput, max_throughput + 200), figsize=(15,7.5), yerr=yerr, capsize=2)
 
         #Disable x ticks and regular labels
         ax.set_xticklabels('')
@@ -231,6 +435,140 @@ class Plot(object):
         with open(filename, 'w') as f:
             f.write(s.to_html())
 
+# Plots of the time series sampled during a single benchmark run. The plots are
+# saved in the results directory of the run.
+class RunPlot(Plot):
+    def __init__(self, results_dir):
+        self.header = []
+        self.csv_files = []
+        self.source = None
+        self.output_dir = results_dir
+        self.pending_artifacts = []
+
+    def get_dashboard_runs(self):
+        return [(self.output_dir, None)]
+
+    def gen_ZONE_STATE_TIMELINE(self, samples, devname):
+        if len(samples['times']) < 2:
+            print(f"Skipping zone state plots for {devname} because there are not enough zone samples.")
+            return
+
+        throughput = zbd.get_zone_write_throughput(samples)
+        extent = [samples['times'][0], samples['times'][-1], 0, throughput.shape[0]]
+        self.add_artifact([f"zone-heatmap-{devname}.pdf"], 'generate_graph_ZONE_HEATMAP', throughput, extent, devname)
+        self.add_artifact([f"zone-timeline-{devname}.pdf"], 'generate_graph_ZONE_TIMELINE',
+                          samples['times'], zbd.get_open_zone_count(samples), zbd.get_full_zone_count(samples), devname)
+
+    def generate_graph_ZONE_HEATMAP(self, throughput, extent, devname):
+        fig, ax = plt.subplots(figsize=(15,7.5))
+        im = ax.imshow(throughput, aspect='auto', origin='lower', interpolation='nearest', cmap='viridis',
+                       extent=extent)
+        cbar = fig.colorbar(im, ax=ax)
+        cbar.set_label("Write Throughput [MB/s]", fontweight="bold")
+        ax.set_xlabel("Time [s]", fontweight="bold")
+        ax.set_ylabel("Zone", fontweight="bold")
+        self.check_env_and_set_title(ax, f"Per zone write throughput {devname}")
+        self.save_graph_plt_in_output_dir(f"zone-heatmap-{devname}.pdf")
+
+    def generate_graph_ZONE_TIMELINE(self, times, open_zones, full_zones, devname):
+        df = pd.DataFrame({'time_sec': times,
+                           'Open zones': open_zones,
+                           'Full zones': full_zones})
+        ax = df.set_index(['time_sec']).plot(figsize=(8,7))
+        ax.set_xlabel("Time [s]", fontweight="bold")
+        ax.set_ylabel("Number of zones", fontweight="bold")
+        self.check_env_and_set_title(ax, f"Open and full zones {devname}")
+        self.save_graph_plt_in_output_dir(f"zone-timeline-{devname}.pdf")
+
+    # Time series of a fio bandwidth, latency or IOPS log, averaged over
+    # intervals so that multi hour logs stay plottable
+    def gen_FIO_LOG_TIMELINE(self, log_file, ylabel, scale=1, max_points=2000):
+        from benchs.fio_log import read_fio_log, bin_by_interval
+        times_ms, values = read_fio_log(log_file)
+        if len(times_ms) == 0:
+            print(f"Skipping the plot of {log_file} because the log is empty.")
+            return
+
+        interval_ms = max(1, int(np.ceil(times_ms[-1] / max_points)))
+        interval_times_ms, interval_values = bin_by_interval(times_ms, values, interval_ms)
+        name = os.path.basename(log_file)[:-len(".log")]
+        self.add_artifact([f"{name}.pdf"], 'generate_graph_FIO_LOG_TIMELINE', interval_times_ms / 1000, interval_values * scale, ylabel, name)
+
+    def generate_graph_FIO_LOG_TIMELINE(self, times_sec, values, ylabel, name):
+        df = pd.DataFrame({'time_sec': times_sec, ylabel: values})
+        ax = df.set_index(['time_sec']).plot(figsize=(8,7), legend=False)
+        ax.set_xlabel("Time [s]", fontweight="bold")
+        ax.set_ylabel(ylabel, fontweight="bold")
+        self.check_env_and_set_title(ax, name)
+        self.save_graph_plt_in_output_dir(f"{name}.pdf")
+
+    # Write stalls, L0 files, compaction writes per level and the cumulative
+    # writes over the statistics dumps of a db_bench run (<output>_stats.csv)
+    def gen_ROCKSDB_STATS(self, stats_file):
+        df = self.load_table(stats_file, ',')
+        if len(df) < 2:
+            print(f"Skipping the plot of {stats_file} because there are not enough statistics dumps.")
+            return
+        name = os.path.basename(stats_file)[:-len(".csv")]
+        self.add_artifact([f"{name}.pdf"], 'generate_graph_ROCKSDB_STATS', {c: df[c].to_numpy() for c in df.columns}, name)
+
+    def generate_graph_ROCKSDB_STATS(self, columns, name):
+        df = pd.DataFrame(columns).set_index('uptime_sec')
+        fig, axs = plt.subplots(4, 1, figsize=(10,14), sharex=True)
+        panels = [(axs[0], ['interval_stall_pct', 'stall_pct'], "Write stall [%]"),
+                  (axs[1], [c for c in df.columns if c.endswith('_files')], "Files per level"),
+                  (axs[2], [c for c in df.columns if c.startswith('L') and c.endswith('_write_gb')], "Compaction writes [GB]"),
+                  (axs[3], ['ingest_gb', 'wal_written_gb', 'flush_gb', 'compaction_write_gb'], "Cumulative writes [GB]")]
+        for ax, panel_columns, ylabel in panels:
+            panel_columns = [c for c in panel_columns if c in df.columns]
+            if len(panel_columns) > 0:
+                df[panel_columns].astype(float).plot(ax=ax)
+            ax.set_ylabel(ylabel, fontweight="bold")
+        axs[-1].set_xlabel("Time [s]", fontweight="bold")
+        self.check_env_and_set_title(axs[0], name)
+        self.save_graph_plt_in_output_dir(f"{name}.pdf")
+
+    # Throughput of each second and tail latencies of a db_bench phase (one
+    # db_bench output), from its interval lines and --histogram output
+    def gen_DB_BENCH_PHASE(self, output_file):
+        intervals = rocksdb_stats.read_intervals(output_file)
+        histograms = rocksdb_stats.read_histograms(output_file)
+        latencies = {op: [h.get_percentile(p) for p in rocksdb_stats.histogram_percentiles]
+                     for op, h in sorted(histograms.items()) if h.count() > 0}
+        if len(intervals) == 0 and len(latencies) == 0:
+            print(f"Skipping the phase plot of {output_file} because it has no interval lines or latency histograms.")
+            return
+        name = os.path.splitext(os.path.basename(output_file))[0] + "_phase"
+        times = np.array([t for t, _ in intervals], dtype=float)
+        ops = np.array([qps for _, qps in intervals], dtype=float)
+        self.add_artifact([f"{name}.pdf"], 'generate_graph_DB_BENCH_PHASE', times, ops, latencies, name)
+
+    def generate_graph_DB_BENCH_PHASE(self, times, ops, latencies, name):
+        fig, axs = plt.subplots(2, 1, figsize=(10,9))
+        ax = axs[0]
+        if len(times) > 0:
+            ax.plot(times, ops, linewidth=0.8)
+            ax.axhline(np.mean(ops), color='gray', linestyle='--', linewidth=0.8, label="mean")
+            ax.legend(loc='lower right')
+        ax.set_xlabel("Time [s]", fontweight="bold")
+        ax.set_ylabel("ops/s", fontweight="bold")
+        ax.set_ylim(bottom=0)
+
+        ax = axs[1]
+        labels = ["P%s" % p for p in rocksdb_stats.histogram_percentiles]
+        width = 0.8 / max(len(latencies), 1)
+        for i, (op, values) in enumerate(latencies.items()):
+            xpos = np.arange(len(labels)) + i * width
+            ax.bar(xpos, [np.nan if v is None else v for v in values], width, label=op)
+        ax.set_xticks(np.arange(len(labels)) + width * (len(latencies) - 1) / 2)
+        ax.set_xticklabels(labels)
+        ax.set_yscale('log')
+        ax.set_ylabel("Latency [us]", fontweight="bold")
+        if len(latencies) > 0:
+            ax.legend()
+        self.check_env_and_set_title(axs[0], name)
+        self.save_graph_plt_in_output_dir(f"{name}.pdf")
+
 if __name__ == "__main__":
     print("%s is not meant to run as a stand alone script." % os.path.basename(__file__))
 
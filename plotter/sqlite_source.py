@@ -0,0 +1,112 @@
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import pandas as pd
+
+# Plot source that reads the results collected in data-collection.sqlite3
+# (see --collect-results) instead of csv reports. The runs are selected by
+# their annotation, device serial, firmware and date. The plots read only the
+# columns they need, aggregated in SQL, and the resulting frames are cached
+# in <output>/.plot-cache. A cache entry is keyed by the SQL with its
+# parameters and by a fingerprint of the collected runs, so it is reused until
+# new runs are collected.
+database_file = "data-collection.sqlite3"
+plot_cache_dir = ".plot-cache"
+
+# Run filters of a query: annotation (SQL LIKE pattern, e.g. "fw-%"),
+# device_serial, device_fw and the run dates since and until (YYYY-MM-DD or
+# "YYYY-MM-DD HH:MM:SS", both inclusive)
+query_filters = ['annotation', 'device_serial', 'device_fw', 'since', 'until']
+
+# Parses run filters given as key=value
+def parse_plot_query(args):
+    query = {}
+    for arg in args:
+        key, sep, value = arg.partition('=')
+        if sep == '' or key not in query_filters:
+            print(f"Invalid plot query '{arg}'. Expected key=value with key one of: {', '.join(query_filters)}")
+            sys.exit(1)
+        query[key] = value
+    return query
+
+class SqlitePlotSource(object):
+    def __init__(self, output_path, query):
+        self.db_file = os.path.join(output_path, database_file)
+        self.query = query
+        if not os.path.exists(self.db_file):
+            print(f"No results database {self.db_file} found. Collect results with --collect-results first.")
+            sys.exit(1)
+        self.connection = sqlite3.connect(self.db_file)
+        self.cache_dir = os.path.join(output_path, plot_cache_dir)
+        self.fingerprint = None
+
+    def __del__(self):
+        if getattr(self, 'connection', None):
+            self.connection.close()
+
+    def describe(self):
+        filters = [f"{key}={self.query[key]}" for key in query_filters if key in self.query]
+        return '\n'.join([self.db_file] + filters)
+
+    # SQL condition and parameters selecting the runs of the query on the
+    # zbdbench_run table aliased as r
+    def get_run_filter(self):
+        conditions, params = [], []
+        if 'annotation' in self.query:
+            conditions.append("r.user_annotation LIKE ?")
+            params.append(self.query['annotation'])
+        for key in ['device_serial', 'device_fw']:
+            if key in self.query:
+                conditions.append(f"r.{key} = ?")
+                params.append(self.query[key])
+        if 'since' in self.query:
+            conditions.append("r.run_date >= ?")
+            params.append(self.query['since'])
+        if 'until' in self.query:
+            until = self.query['until']
+            conditions.append("r.run_date <= ?")
+            params.append(until + " 23:59:59" if len(until) == 10 else until)
+        return " AND ".join(conditions) if len(conditions) > 0 else "1", params
+
+    # Changes whenever runs are collected. The file change counter in the
+    # database header is not updated in WAL mode, so the runs are counted.
+    def get_fingerprint(self):
+        if self.fingerprint is None:
+            cursor = self.connection.cursor()
+            cursor.execute("PRAGMA user_version")
+            version = cursor.fetchone()[0]
+            cursor.execute("SELECT count(*), max(id) FROM zbdbench_run")
+            count, max_id = cursor.fetchone()
+            cursor.close()
+            self.fingerprint = f"{version}-{count}-{max_id}"
+        return self.fingerprint
+
+    def get_table_columns(self, table):
+        cursor = self.connection.cursor()
+        cursor.execute(f"PRAGMA table_info({table})")
+        columns = [row[1] for row in cursor.fetchall()]
+        cursor.close()
+        return columns
+
+    # Returns the result of the query as a DataFrame, from the cache if the
+    # collected runs did not change since it was stored
+    def read_frame(self, sql, params=[]):
+        key = hashlib.sha1(json.dumps([sql, list(params)]).encode()).hexdigest()[:16]
+        fingerprint = hashlib.sha1(self.get_fingerprint().encode()).hexdigest()[:16]
+        cache_file = os.path.join(self.cache_dir, f"{key}-{fingerprint}.pkl")
+        if os.path.exists(cache_file):
+            return pd.read_pickle(cache_file)
+
+        df = pd.read_sql_query(sql, self.connection, params=params)
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # Results of the query for older database contents
+        for old_file in glob.glob(os.path.join(self.cache_dir, f"{key}-*.pkl")):
+            os.remove(old_file)
+        tmp_file = cache_file + ".tmp"
+        df.to_pickle(tmp_file)
+        os.replace(tmp_file, cache_file)
+        return df
@@ -4,11 +4,16 @@ import sys
 import subprocess
 import os
 import re
+import glob
 import distutils.spawn
 import argparse
+import contextlib
+import io
+import multiprocessing
 
 from datetime import datetime
 from benchs.base import base_benches, is_dev_zoned, DeviceScheduler, set_spdk_install_dir
+from benchs.checkpoint import Checkpoint
 from benchs import *
 
 def get_zbdbench_version():
@@ -153,6 +158,42 @@ def gather_device_info(dev, run_output):
         subprocess.check_call(f"blkzone capacity {dev} > {run_output}/blkzone-capacity.txt", shell=True)
         subprocess.check_call(f"blkzone report {dev} > {run_output}/blkzone-report.txt", shell=True)
 
+        from benchs.zbd import get_zone_geometry
+        with open(f"{run_output}/zone-geometry.txt", 'w') as f:
+            f.write(get_zone_geometry(dev).summary() + "\n")
+
+# Properties of the udevadm info that identify a device independently of its
+# name, which can change after a reboot
+device_identity_fields = ['ID_SERIAL', 'ID_WWN']
+
+def get_device_identity(udevadm_info):
+    identity = {}
+    for line in udevadm_info.splitlines():
+        key, sep, value = line.partition(': ')[2].partition('=')
+        if sep and key in device_identity_fields:
+            identity[key] = value.strip()
+    return identity
+
+# Verifies that the devices of a resumed run are still the devices of the
+# earlier attempts (see gather_device_info), before any of them is prepared
+def check_resume_devs(devs, run_output):
+    for i, d in enumerate(devs):
+        dev_output = run_output if i == 0 else os.path.join(run_output, d.strip('/dev/'))
+        info_file = os.path.join(dev_output, "udevadm-info.txt")
+        if not os.path.exists(info_file):
+            print(f"No device information of {d} found in {dev_output}, can not verify the device of the run. Exiting...")
+            sys.exit(1)
+        with open(info_file, 'r') as f:
+            recorded = get_device_identity(f.read())
+        if len(recorded) == 0:
+            print(f"No serial number or WWN of {d} recorded in {info_file}, can not verify the device of the run. Exiting...")
+            sys.exit(1)
+        current = get_device_identity(subprocess.check_output(f"udevadm info --query=all --name={d}", shell=True, text=True))
+        for key, value in recorded.items():
+            if current.get(key) != value:
+                print(f"{d} is not the device of the interrupted run: {key} is {current.get(key)}, the run was on {value}. Exiting...")
+                sys.exit(1)
+
 def gather_benchmark(run_output, benchmark):
     subprocess.check_call(f"echo {benchmark} > {run_output}/benchmark.txt", shell=True)
 
@@ -179,11 +220,15 @@ def list_benchs(benches):
     for b in benches:
         print("  " + b.id())
 
+# Collects the results of a run directory, or of all runs below results_dir
+# if it is not a run directory itself
 def collect_results_in_sqlite(output_path, results_dir):
     from data_collector import sqlite_data_collector
     db_connection = sqlite_data_collector.DatabaseConnection(os.path.join(output_path, "data-collection.sqlite3"))
-    db_connection.collect_fio_results_from_directory(results_dir)
-    print("Done collecting results.")
+    if not os.path.exists(os.path.join(results_dir, 'benchmark.txt')):
+        db_connection.collect_results_from_tree(results_dir)
+    elif db_connection.collect_fio_results_from_directory(results_dir):
+        print("Done collecting results.")
 
 def check_and_set_scheduler_for_benchmark(dev, benchmark, scheduler_overwrite):
     if is_dev_zoned(dev):
@@ -195,67 +240,199 @@ def check_and_set_scheduler_for_benchmark(dev, benchmark, scheduler_overwrite):
         else:
             check_and_set_none_scheduler(dev)
 
-def run_benchmark(dev, container, benchmark, output_path, run_output, scheduler_overwrite, annotation, benchmark_args):
-    if not dev:
+def run_benchmark(devs, container, benchmark, output_path, run_output, scheduler_overwrite, annotation, benchmark_args, container_session, telemetry_interval, zone_sample_interval, force_prep, resume=False):
+    if not devs:
         print('No device name provided for benchmark')
         print('ex. run.py /dev/nvmeXnY')
         sys.exit()
 
-    # Verify that we're not about to destroy data unintended.
-    check_dev_string(dev)
-    check_dev_mounted(dev)
-    check_dev_zoned(dev)
-    check_missing_programs(container, benchmark)
+    if len(devs) > 1 and not benchmark.supports_multiple_devs():
+        print(f"The {benchmark.id()} benchmark does not support running on multiple devices")
+        sys.exit(1)
+
+    if len(set(devs)) != len(devs):
+        print("The same device has been provided multiple times. Exiting...")
+        sys.exit(1)
 
-    create_dirs(run_output)
+    dev = devs[0]
 
-    gather_benchmark(run_output, benchmark.id())
-    gather_benchmark_call(run_output, benchmark_args)
-    gather_device_info(dev, run_output)
-    gather_system_meminfo(run_output)
-    gather_system_cpuinfo(run_output)
-    gather_user_annotation(run_output, annotation)
-    gather_zbdbench_version(run_output)
+    # Verify that we're not about to destroy data unintended.
+    for d in devs:
+        check_dev_string(d)
+        check_dev_mounted(d)
+        check_dev_zoned(d)
+    check_missing_programs(container, benchmark)
 
-    print("\nDev: %s" % dev)
+    if resume:
+        check_resume_devs(devs, run_output)
+        checkpoint = Checkpoint.load(run_output)
+        print(f"Resuming the run with {len(checkpoint.get_completed())} completed jobs")
+    else:
+        create_dirs(run_output)
+
+        gather_benchmark(run_output, benchmark.id())
+        gather_benchmark_call(run_output, benchmark_args)
+        gather_device_info(dev, run_output)
+        if len(devs) > 1:
+            for d in devs:
+                dev_output = os.path.join(run_output, d.strip('/dev/'))
+                os.makedirs(dev_output)
+                gather_device_info(d, dev_output)
+        gather_system_meminfo(run_output)
+        gather_system_cpuinfo(run_output)
+        gather_user_annotation(run_output, annotation)
+        gather_zbdbench_version(run_output)
+        checkpoint = Checkpoint.create(run_output, benchmark.id(), devs, benchmark_args)
+
+    print("\nDev: %s" % " ".join(devs))
     print("Env: %s" % container)
     print("Output: %s\n" % run_output)
 
     print(f"Executing benchmark: {benchmark.id()}")
     if len(benchmark_args) > 0:
         print(f"   With arguments: {benchmark_args}")
-    check_and_set_scheduler_for_benchmark(dev, benchmark, scheduler_overwrite)
-    benchmark.setup(dev, container, run_output, benchmark_args)
-    benchmark.run(dev, container)
-    benchmark.teardown(dev, container)
+    for d in devs:
+        check_and_set_scheduler_for_benchmark(d, benchmark, scheduler_overwrite)
+    benchmark.set_devs(devs)
+    benchmark.set_force_prep(force_prep)
+    benchmark.set_checkpoint(checkpoint)
+    if container_session == 'yes':
+        benchmark.start_container_sessions(dev, container, run_output)
+    try:
+        benchmark.setup(dev, container, run_output, benchmark_args)
+        benchmark.start_telemetry(dev, telemetry_interval, zone_sample_interval)
+        try:
+            benchmark.run(dev, container)
+        finally:
+            benchmark.stop_telemetry()
+        benchmark.teardown(dev, container)
+    finally:
+        benchmark.stop_container_sessions()
     csv_file = benchmark.report(run_output)
     benchmark.plot(csv_file)
+    benchmark.plot_telemetry(run_output)
     collect_results_in_sqlite(output_path, run_output)
     print(f"\nCompleted benchmark {benchmark.id()}")
 
+def resume_benchmark(container, benchmark, run_output, scheduler_overwrite, annotation, container_session, telemetry_interval, zone_sample_interval, force_prep):
+    checkpoint = Checkpoint.load(run_output)
+    if checkpoint is None:
+        print(f"No checkpoint manifest found in {run_output}. Exiting...")
+        sys.exit(1)
+
+    if not benchmark.supports_resume():
+        print(f"The {benchmark.id()} benchmark does not support resuming a run")
+        sys.exit(1)
+
+    if checkpoint.get_benchmark() != benchmark.id():
+        print(f"The run in {run_output} is a {checkpoint.get_benchmark()} run. Exiting...")
+        sys.exit(1)
+
+    # The devices and benchmark arguments of the interrupted run are used
+    output_path = os.path.dirname(os.path.abspath(run_output))
+    run_benchmark(checkpoint.get_devs(), container, benchmark, output_path, run_output, scheduler_overwrite, annotation,
+                  checkpoint.get_benchmark_args(), container_session, telemetry_interval, zone_sample_interval, force_prep, True)
+
 def run_report(path, benchmark):
     print(f"Generating report for: {benchmark.id()}")
     csv_file = benchmark.report(path)
     benchmark.plot(csv_file)
+    benchmark.plot_telemetry(path)
+
+# Reports a run directory of --report-tree given as (run_dir, benchmark id).
+# Returns whether the report succeeded and its output, which is captured so
+# the output of the reports running in parallel is not interleaved. Module
+# level so it can run in a process pool.
+def report_run_directory(job):
+    run_dir, benchmark_id = job
+    benchmarks = {b.id(): b for b in base_benches}
+    output = io.StringIO()
+    reported = False
+    with contextlib.redirect_stdout(output):
+        print(f"Generating report for: {benchmark_id}, {run_dir}")
+        try:
+            benchmarks[benchmark_id].report(run_dir)
+            reported = True
+        except SystemExit:
+            print(f"  Report of {run_dir} failed")
+        except Exception as e:
+            print(f"  Report of {run_dir} failed: {e}")
+    return reported, output.getvalue()
+
+# Prints the output of the reports in order, returns the number of successful
+# ones
+def print_reports(results):
+    reported = 0
+    for success, output in results:
+        print(output, end='')
+        reported += int(success)
+    return reported
+
+# Regenerates the reports of all runs below path. Only the runs of the given
+# benchmark are reported if one is given. The runs are reported in a process
+# pool, in which each report parses its results serially.
+def run_report_tree(path, benchmark):
+    run_dirs = sorted([os.path.dirname(f) for f in glob.glob(os.path.join(path, '**', 'benchmark.txt'), recursive=True)])
+    benchmarks = {b.id(): b for b in base_benches}
+    jobs = []
+    for run_dir in run_dirs:
+        with open(os.path.join(run_dir, 'benchmark.txt'), 'r') as f:
+            run_benchmark_id = f.readline().strip()
+        if benchmark is not None and run_benchmark_id != benchmark.id():
+            continue
+        if run_benchmark_id not in benchmarks:
+            print(f"Skipping {run_dir}: unknown benchmark {run_benchmark_id}")
+            continue
+        jobs.append((run_dir, run_benchmark_id))
+
+    if len(jobs) > 1 and (os.cpu_count() or 1) > 1:
+        with multiprocessing.Pool() as pool:
+            reported = print_reports(pool.imap(report_run_directory, jobs))
+    else:
+        reported = print_reports(map(report_run_directory, jobs))
+    print(f"\nGenerated {reported} of {len(run_dirs)} reports in {path}")
 
 def run_plot(csv_file, benchmark):
     print(f"Generating plot for: {benchmark.id()}, {csv_file}")
     benchmark.plot(csv_file)
 
+# Plots the runs of the results database in output_path selected by the
+# key=value filters of query_args
+def run_plot_db(output_path, query_args, benchmark):
+    from plotter import sqlite_source
+    if not benchmark.supports_sqlite_plot():
+        print(f"The benchmark {benchmark.id()} can not be plotted from the results database.")
+        sys.exit(1)
+    source = sqlite_source.SqlitePlotSource(output_path, sqlite_source.parse_plot_query(query_args))
+    # The plots are saved next to the database
+    benchmark.output = output_path
+    print(f"Generating plot for: {benchmark.id()}, {' '.join(query_args) or 'all runs'} in {source.db_file}")
+    benchmark.plot(source)
+
 def print_help():
     print('Benchmarking')
     print('  List available benchmarks')
     print('    run.py -l')
     print('  Run specific benchmark')
     print('    run.py -d /dev/nvmeXnY -b fio_zone_write')
+    print('  Shard a benchmark across multiple identical devices')
+    print('    run.py -d /dev/nvmeXnY /dev/nvmeZnY -b fio_zone_throughput_avg_lat')
+
+    print('  Resume an interrupted run')
+    print('    run.py --resume output_dir')
 
     print('\nReporting')
     print('  Generate specific report')
     print('    run.py -r output_dir -b fio_zone_write')
 
+    print('  Generate the reports of all runs in a results tree')
+    print('    run.py --report-tree zbdbench_results')
+
     print('\nPloting')
     print('  Generate specific plot')
     print('    run.py -b fio_zone_write -p csv_file')
+    print('  Plot the collected runs of the results database')
+    print('    run.py -b fio_zone_throughput_avg_lat --plot-db device_fw=FW1 since=2024-01-01')
 
     print('\nExecution Environment')
     print('  Use system executables')
@@ -269,17 +446,24 @@ def print_help():
 def main(argv):
     parser = argparse.ArgumentParser(description = 'Zoned Block Device Benchmark Tool', add_help=False)
     group = parser.add_mutually_exclusive_group(required=True)
-    group.add_argument('--dev', '-d', type=str, help='Path to block device used for test')
+    group.add_argument('--dev', '-d', type=str, nargs='+', help='Path to block device used for test. Benchmarks supporting it shard their workload across multiple given devices')
+    group.add_argument('--resume', type=str, metavar='PATH', help='Resume an interrupted benchmark run in the given run directory')
     group.add_argument('--report', '-r', type=str, metavar='PATH', help='Generate reports')
+    group.add_argument('--report-tree', type=str, metavar='PATH', help='Generate the reports of all benchmark runs below PATH (of the benchmark given with -b, or all)')
     group.add_argument('--plot', '-p', type=str, nargs='+', help='Generate plots')
+    group.add_argument('--plot-db', type=str, nargs='*', metavar='KEY=VALUE', help='Generate plots of the runs collected in the results database of the output directory, selected by annotation, device_serial, device_fw, since and until')
     group.add_argument('--list-benchmarks', '-l', action='store_true', help='List available benchmarks')
     group.add_argument('--help', '-h', action='store_true', help='Print help message and exit')
-    group.add_argument('--collect-results', type=str, help='Collect benchmark results of the specified path within this argument in a MySQL database which is specified by the mysql.conf file.')
+    group.add_argument('--collect-results', type=str, help='Collect benchmark results of the specified path within this argument in a MySQL database which is specified by the mysql.conf file. If the path is not a run directory, all runs below it are collected.')
     parser.add_argument('--container', '-c', type=str, default='yes', choices=['yes', 'no'], help='Use containerized binaries or system binaries')
     parser.add_argument('--benchmark', '-b', type=str, metavar='NAME', help='Benchmark to run')
     parser.add_argument('--output', '-o', type=str, default=os.path.join(os.getcwd(), 'zbdbench_results'), help='Directory to place results. Will be created if it does not exist')
     parser.add_argument('--annotation', '-a', type=str, default=str(datetime.now().strftime("%Y-%m-%d-%H%M%S")), help='Annotation for easier manual benchmark run identification')
     parser.add_argument('--benchmark-args', '-x', type=str, nargs='+', default='', help='Additional benchmark specific arguments')
+    parser.add_argument('--container-session', type=str, default='yes', choices=['yes', 'no'], help='Run all commands of a container image in one long-lived container instead of a new container per command')
+    parser.add_argument('--telemetry-interval', type=float, default=1.0, metavar='SEC', help='Interval for sampling the block device I/O statistics during the benchmark run (min 0.1s, 0 to disable)')
+    parser.add_argument('--zone-sample-interval', type=float, default=10.0, metavar='SEC', help='Initial interval for zone report snapshots of zoned devices during the benchmark run, doubled when the snapshot buffer is full (0 to disable)')
+    parser.add_argument('--force-prep', action='store_true', help='Precondition the device even if it is already in the state left by an earlier prep of the benchmark')
     parser.add_argument('--use-spdk', '-s', type=str, default='no', choices=['yes', 'no'], help='Use spdk plugin for fio(uses io_uring spdk bdev)')
     parser.add_argument('--spdk-path', type=str, help='Dir path for SPDK checkout and build. Needed only for host spdk(-c no -s yes) benchmarks')
     scheduler_group = parser.add_mutually_exclusive_group(required=False)
@@ -288,7 +472,7 @@ def main(argv):
     args = parser.parse_args()
 
     annotation = args.annotation
-    dev = ''
+    devs = []
     container = args.container
     output_path = args.output
     selected_benchmark = args.benchmark
@@ -318,13 +502,28 @@ def main(argv):
         run = 'plot'
         csv_files = args.plot
 
+    if args.plot_db is not None:
+        run = 'plot-db'
+        query_args = args.plot_db
+
     if args.report is not None:
         run = 'report'
         report_path = args.report
 
     if args.dev is not None:
         run = 'bench'
-        dev = args.dev
+        devs = args.dev
+
+    if args.report_tree is not None:
+        run = 'report-tree'
+        report_path = args.report_tree
+
+    if args.resume is not None:
+        run = 'resume'
+        resume_path = args.resume
+        if selected_benchmark is None and os.path.exists(os.path.join(resume_path, 'benchmark.txt')):
+            with open(os.path.join(resume_path, 'benchmark.txt'), 'r') as f:
+                selected_benchmark = f.readline().strip()
 
     if args.list_benchmarks:
         list_benchs(base_benches)
@@ -333,7 +532,7 @@ def main(argv):
     for x in base_benches:
         if x.id() == selected_benchmark:
             benchmark = x
-    if benchmark == None:
+    if benchmark == None and not (run in ['report-tree', 'collect-results'] and selected_benchmark is None):
         print(f"Invalid benchmark name: {selected_benchmark}")
         list_benchs(base_benches)
         sys.exit(1)
@@ -355,13 +554,19 @@ def main(argv):
         collect_results_in_sqlite(output_path, results_dir)
     elif run == 'plot':
         run_plot(csv_files, benchmark)
+    elif run == 'plot-db':
+        run_plot_db(output_path, query_args, benchmark)
     elif run == 'report':
         run_report(report_path, benchmark)
+    elif run == 'report-tree':
+        run_report_tree(report_path, benchmark)
+    elif run == 'resume':
+        resume_benchmark(container, benchmark, resume_path, scheduler_overwrite, annotation, args.container_session, args.telemetry_interval, args.zone_sample_interval, args.force_prep)
     elif run == 'bench':
         run_output_relative = datetime.now().strftime("%Y-%m-%d-%H%M%S")
         run_output = "%s/%s" % (output_path, run_output_relative)
         print(f"Output directory: {run_output}")
-        run_benchmark(dev, container, benchmark, output_path, run_output, scheduler_overwrite, annotation, benchmark_args)
+        run_benchmark(devs, container, benchmark, output_path, run_output, scheduler_overwrite, annotation, benchmark_args, args.container_session, args.telemetry_interval, args.zone_sample_interval, args.force_prep)
     else:
         print_help()
 
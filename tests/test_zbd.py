@@ -0,0 +1,63 @@
+import numpy as np
+
+from benchs import zbd
+
+mib = 1024 * 1024
+sector = 512
+
+def zone_samples(wp, cond, capacity, zone_len, times):
+    nr_zones = len(wp)
+    start = np.arange(nr_zones, dtype=np.uint64) * zone_len
+    return {'times': np.array(times, dtype=float),
+            'start': start,
+            'len': np.full(nr_zones, zone_len, dtype=np.uint64),
+            'capacity': np.full(nr_zones, capacity, dtype=np.uint64),
+            'cond': np.array(cond, dtype=np.uint8),
+            'wp': start[:, None] + np.array(wp, dtype=np.uint64)}
+
+def test_full_zone_write_throughput_is_limited_to_the_zone_capacity():
+    # 1077MiB of zone capacity in 2048MiB zones. Both zones are written up to
+    # their capacity, which makes them FULL and moves their write pointer to
+    # the zone end. The second zone is written within one interval.
+    zone_len = 2048 * mib // sector
+    capacity = 1077 * mib // sector
+    samples = zone_samples(wp=[[0, capacity // 2, zone_len], [0, 0, zone_len]],
+                           cond=[[zbd.BLK_ZONE_COND_EMPTY, zbd.BLK_ZONE_COND_IMP_OPEN, zbd.BLK_ZONE_COND_FULL],
+                                 [zbd.BLK_ZONE_COND_EMPTY, zbd.BLK_ZONE_COND_EMPTY, zbd.BLK_ZONE_COND_FULL]],
+                           capacity=capacity, zone_len=zone_len, times=[0, 10, 20])
+
+    throughput = zbd.get_zone_write_throughput(samples)
+
+    assert throughput.shape == (2, 2)
+    np.testing.assert_allclose(throughput * 10 * 1000 * 1000, [[1077 * mib / 2, 1077 * mib / 2],
+                                                               [0, 1077 * mib]])
+    assert np.all(zbd.get_full_zone_count(samples) == [0, 0, 2])
+
+def test_zone_reset_is_not_counted_as_written():
+    zone_len = 64 * mib // sector
+    samples = zone_samples(wp=[[0, zone_len, 0, 8 * mib // sector]],
+                           cond=[[zbd.BLK_ZONE_COND_EMPTY, zbd.BLK_ZONE_COND_FULL,
+                                  zbd.BLK_ZONE_COND_EMPTY, zbd.BLK_ZONE_COND_IMP_OPEN]],
+                           capacity=48 * mib // sector, zone_len=zone_len, times=[0, 1, 2, 3])
+
+    np.testing.assert_allclose(zbd.get_zone_write_throughput(samples) * 1000 * 1000, [[48 * mib, 0, 8 * mib]])
+
+def test_zone_sampler_memory_is_bounded(monkeypatch):
+    zones = np.zeros(4, dtype=zbd.blk_zone_dtype)
+    monkeypatch.setattr(zbd, 'report_zones', lambda dev: zones)
+    sampler = zbd.ZoneSampler('/dev/nullb0', 10)
+
+    # The run loop takes the snapshots on the grid of the current interval
+    end_time = 4 * zbd.ZoneSampler.max_samples * 10
+    sample_time = 0
+    while sample_time <= end_time:
+        zones['wp'] = sample_time
+        sampler.add_sample(sample_time, zones)
+        sample_time += sampler.interval_sec
+
+    # The interval was doubled three times, the kept snapshots are those at
+    # the multiples of the last interval
+    assert sampler.interval_sec == 80
+    assert sampler.times.shape == (zbd.ZoneSampler.max_samples,)
+    np.testing.assert_array_equal(sampler.times[:sampler.nr_samples], np.arange(0, end_time + 1, 80))
+    np.testing.assert_array_equal(sampler.wp[0, :sampler.nr_samples], np.arange(0, end_time + 1, 80))